@@ -1,33 +1,290 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from utils import load_data, save_data, generate_id
-from models import Customer, Driver, RideRequest, RideMatchingService, Payment
+from utils import generate_id, use_id_allocator, dumps
+from storage import store, STORAGE_BACKEND
+from sqlite_store import SqliteDriverStats, SqliteIdAllocator
+from geofence import Geofence, ShardedDriverIndex, OUTSIDE
+from dispatch import BatchDispatcher
+from offers import OfferDispatcher
+from stats import DriverStats, DRIVER_SHARE, ACTIVE_STATUSES
+from pagination import parse_ride_filters, parse_limit, query_rides, paginate
+from geocode import Geocoder
+from locations import LocationHub, ALL_DRIVERS, driver_topic, sse_stream
+from trajectory import TrajectoryStore
+from pricing import PricingEngine
+from demand import DemandGrid
+from dashboard import DashboardSnapshot
+from archive import RideArchive, GROUP_BY, FINISHED_STATUSES, archive_rides, revenue_of
+from jobs import JobQueue, JOBS_FILE
+from providers import StubPaymentProvider, StubNotifier
+from models import Customer, Driver, Ride, RideMatchingService
+from metrics import configure_logging, registry, HTTP_LATENCY
+import logging
 import os
-import requests
 import random
-import json
+import time
+from datetime import datetime
+from heapq import merge
+from itertools import chain
 
 
+configure_logging()
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)
 
+# Bản ghi trong store là model (models.py): jsonify ghi chúng qua to_dict()
+_flask_json_default = app.json.default
+app.json.default = lambda obj: obj.to_dict() if hasattr(obj, "to_dict") else _flask_json_default(obj)
+
 # Thêm vào đầu file, sau các import
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 
+# "greedy": ghép ngay với tài xế gần nhất; "batch": gom yêu cầu theo cửa sổ rồi ghép tối ưu;
+# "offer": mời lần lượt các tài xế gần nhất, chờ tài xế nhận (offers.py)
+DISPATCH_MODE = os.environ.get("DISPATCH_MODE", "greedy")
+DISPATCH_WINDOW = float(os.environ.get("DISPATCH_WINDOW", "1.5"))
+# Thời gian (giây) tài xế có để trả lời một lời mời và số tài xế tối đa được mời cho một chuyến
+OFFER_TIMEOUT = float(os.environ.get("OFFER_TIMEOUT", "15"))
+OFFER_MAX = int(os.environ.get("OFFER_MAX", "10"))
+# Thời gian (giây) tối đa một yêu cầu đặt xe giữ thread WSGI chờ tài xế nhận lời mời (ASGI chờ trên event loop, không áp giới hạn này)
+OFFER_MAX_WAIT = float(os.environ.get("OFFER_MAX_WAIT", "45"))
+# Số tài xế gần nhất được thử lần lượt nếu giữ chỗ tài xế trước đó thất bại
+MATCH_CANDIDATES = int(os.environ.get("MATCH_CANDIDATES", "5"))
+# Xếp hạng ứng viên theo "eta" (thời gian tới điểm đón) hoặc "distance" (đường chim bay)
+MATCH_RANK = os.environ.get("MATCH_RANK", "eta")
+# Khoảng cách tối thiểu (giây) giữa hai lần đẩy vị trí tới cùng một người theo dõi
+LOCATION_MIN_INTERVAL = float(os.environ.get("LOCATION_MIN_INTERVAL", "1.0"))
+ADMIN_LOCATION_MIN_INTERVAL = float(os.environ.get("ADMIN_LOCATION_MIN_INTERVAL", "2.0"))
+# Chuyến đã hoàn thành/hủy quá số giờ này được chuyển sang kho lưu trữ dạng cột (0: tắt)
+ARCHIVE_AFTER_HOURS = float(os.environ.get("ARCHIVE_AFTER_HOURS", "168"))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "3600"))
+# Công việc nền sau chuyến đi: số thread worker, số lần thử tối đa và độ trễ (giây) trước lần thử lại đầu tiên
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF = float(os.environ.get("JOB_BACKOFF", "1.0"))
+# Các vùng/thành phố (geofence.py) worker này phục vụ, vd. "hanoi" hoặc "hcmc-east,outside" (rỗng: mọi vùng)
+SHARD_ZONES = [name.strip() for name in os.environ.get("SHARD_ZONES", "").split(",") if name.strip()]
+# Địa chỉ worker của các vùng/thành phố khác, vd. "hanoi=http://10.0.0.2:5000,hcmc=http://10.0.0.3:5000";
+# yêu cầu đặt xe có điểm đón ngoài vùng của worker được chuyển (307) tới đó
+SHARD_ROUTES = dict(item.strip().split("=", 1) for item in os.environ.get("SHARD_ROUTES", "").split(",") if "=" in item)
+# Điểm đón cách biên vùng không quá số km này thì tìm cả tài xế của vùng bên kia
+SHARD_SPILLOVER_KM = float(os.environ.get("SHARD_SPILLOVER_KM", "2.0"))
+
+store.open()
+
+# Chuyến đi đã kết thúc được chuyển khỏi store; lịch sử và thống kê đọc cả hai nơi
+ride_archive = RideArchive().open()
+
+# Chỉ mục không gian của tài xế rảnh chia theo vùng, cập nhật theo từng thay đổi trong store
+driver_index = ShardedDriverIndex(Geofence.load(), spill_km=SHARD_SPILLOVER_KM, served=SHARD_ZONES or None,
+                                  lookup=store.drivers.get)
+driver_index.rebuild(store.drivers)
+
+
+if STORAGE_BACKEND == "sqlite":
+    # ID và thống kê tài xế lấy thẳng từ CSDL dùng chung giữa các worker
+    use_id_allocator(SqliteIdAllocator(store))
+    driver_stats = SqliteDriverStats(store)
+else:
+    # Thống kê theo tài xế, cập nhật khi chuyến đi được tạo/hoàn thành/hủy
+    driver_stats = DriverStats()
+    driver_stats.rebuild(chain(store.rides, ride_archive))
+
+# Gợi ý địa điểm: cache + chỉ mục các địa chỉ đã có trong rides trước khi gọi Nominatim
+geocoder = Geocoder()
+for _ride in chain(store.rides, ride_archive):
+    geocoder.index.add_ride(_ride)
+
+# Vị trí GPS mới nhất của tài xế, phát tới người theo dõi qua SSE
+location_hub = LocationHub()
+
+# Quỹ đạo GPS của tài xế trong ring buffer, phần cũ được giản lược
+trajectories = TrajectoryStore()
+
+# Cung/cầu theo ô lưới trên cửa sổ trượt, cung cấp hệ số surge cho giá
+demand = DemandGrid()
+for _driver in store.drivers:
+    demand.set_driver(_driver["id"], driver_index.position(_driver["id"]))
+
+# Giá và ETA phía máy chủ, hiệu chỉnh từ quãng đường/thời gian của các chuyến cũ (kể cả đã lưu trữ)
+pricing = PricingEngine(surge=demand.surge)
+pricing.matrix.calibrate(chain(store.rides, ride_archive))
+
+
+def _driver_eta(driver, pickup):
+    # Ưu tiên vị trí GPS trực tiếp mà chỉ mục ghép chuyến đang dùng
+    return pricing.eta(driver, pickup, coords=driver_index.position(driver["id"]))
+
+
+def _round_eta(seconds):
+    return round(seconds) if seconds != float("inf") else None
+
+
+@app.before_request
+def _start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+def _record_latency(response):
+    started = g.get("started")
+    if started is not None:
+        # Nhãn theo mẫu route (vd. /api/ride/cancel/<int:ride_id>) để không bùng nổ số chuỗi
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - started,
+                             method=request.method, route=route, status=response.status_code)
+    return response
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@store.on_change
+def _sync_indexes(name, record):
+    if name == "drivers":
+        driver_index.update(record)
+        demand.set_driver(record["id"], driver_index.position(record["id"]))
+    elif name == "rides":
+        driver_stats.update(record)
+        geocoder.index.add_ride(record)
+
+
+# Thu tiền, thống kê tài xế, thông báo, lưu trữ và gom WAL chạy ngoài request.
+# Journal chỉ dùng với backend bộ nhớ (một tiến trình); các worker SQLite không
+# dùng chung được một journal nên giữ hàng đợi trong bộ nhớ
+jobs = JobQueue(workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS, backoff=JOB_BACKOFF,
+                path=os.path.join(store.data_dir, JOBS_FILE) if STORAGE_BACKEND == "memory" else None)
+payments = StubPaymentProvider()
+notifier = StubNotifier()
+
+RIDE_NOTIFICATIONS = {
+    "completed": "Chuyến đi #{id} đã hoàn thành. Số tiền: {fare}",
+    "cancelled": "Chuyến đi #{id} đã bị hủy.",
+}
+
+
+@jobs.register("payment.capture")
+def _capture_payment(job):
+    payload = job.payload
+    charge = payments.capture(payload["amount"], payload["method"], job.idempotency_key)
+    ride_id = payload.get("ride_id")
+    if ride_id is not None and store.rides.get(ride_id) is not None:
+        store.update("rides", ride_id, {"payment_status": charge["status"], "charge_id": charge["id"]})
+    return charge
+
+
+@jobs.register("driver.ride_completed")
+def _count_driver_ride(job):
+    """Cộng chuyến vào total_rides của tài xế đúng một lần (đánh dấu trên chuyến đi, compare-and-set)."""
+    ride_id = job.payload["ride_id"]
+    while True:
+        ride = store.rides.get(ride_id)
+        driver = ride and store.drivers.get(ride["driver_id"])
+        if driver is None or ride.get("driver_counted"):
+            return False
+        total = driver["total_rides"]
+        if store.commit(
+            [("set", "drivers", driver["id"], {"total_rides": (total or 0) + 1}),
+             ("set", "rides", ride_id, {"driver_counted": True})],
+            expect=[("rides", ride_id, {"driver_counted": None}), ("drivers", driver["id"], {"total_rides": total})]
+        ) is not None:
+            return True
+
+
+@jobs.register("notify.ride")
+def _notify_ride(job):
+    """Chia thông báo về chuyến đi thành một công việc gửi cho mỗi người nhận (thử lại riêng rẽ)."""
+    ride_id = job.payload["ride_id"]
+    ride = store.rides.get(ride_id) or ride_archive.get(ride_id)
+    if ride is None:
+        return 0
+    message = RIDE_NOTIFICATIONS[job.payload["event"]].format(id=ride_id, fare=ride["fare"])
+    recipients = [f"{kind}:{ride[kind + '_id']}" for kind in ("customer", "driver")
+                  if ride.get(kind + "_id") is not None]
+    for recipient in recipients:
+        jobs.enqueue("notify.send", {"recipient": recipient, "message": message},
+                     key=f"{job.idempotency_key}:{recipient}")
+    return len(recipients)
+
+
+@jobs.register("notify.send")
+def _send_notification(job):
+    return notifier.send(job.payload["recipient"], job.payload["message"], job.idempotency_key)
+
+
+@jobs.register("rides.archive", max_attempts=1)
+def _archive_old_rides(job):
+    return archive_rides(store, ride_archive, ARCHIVE_AFTER_HOURS * 3600)
+
+
+@jobs.register("store.compact")
+def _compact_store(job):
+    store.compact()
+
+
+jobs.open().start()
+
+if STORAGE_BACKEND == "memory":
+    store.schedule_compact = lambda: jobs.enqueue("store.compact")
+    # Với SQLite, thống kê tài xế là GROUP BY trên bảng rides nên các chuyến được giữ nguyên
+    if ARCHIVE_AFTER_HOURS > 0:
+        jobs.every(ARCHIVE_INTERVAL, "rides.archive")
+
+
+def _reserve_driver(driver, ride):
+    """
+    Giữ tài xế và tạo chuyến đi trong một giao dịch.
+    Chỉ thành công nếu tài xế vẫn còn rảnh (compare-and-set trên từng tài xế).
+    """
+    ride["driver_id"] = driver["id"]
+    return store.commit(
+        [
+            ("set", "drivers", driver["id"], {"status": "busy", "available": False}),
+            ("put", "rides", ride),
+        ],
+        expect=[("drivers", driver["id"], {"status": "available"})]
+    ) is not None
+
+
+def _find_by_identifier(collection, identifier):
+    """Tìm bản ghi theo email hoặc số điện thoại qua chỉ mục băm."""
+    matches = {r["id"]: r for r in collection.find("email", identifier) + collection.find("phone", identifier)}
+    return [matches[record_id] for record_id in sorted(matches)]
+
+
+def _find_candidates(pickup, vehicle_type, k=MATCH_CANDIDATES):
+    return RideMatchingService.find_candidate_drivers(
+        pickup_location=pickup,
+        vehicle_type=vehicle_type,
+        index=driver_index,
+        k=k,
+        eta=_driver_eta if MATCH_RANK == "eta" else None
+    )
+
+
+dispatcher = None
+if DISPATCH_MODE == "batch":
+    dispatcher = BatchDispatcher(driver_index, _reserve_driver, window=DISPATCH_WINDOW).start()
+elif DISPATCH_MODE == "offer":
+    dispatcher = OfferDispatcher(_find_candidates, _reserve_driver, timeout=OFFER_TIMEOUT,
+                                 candidates=MATCH_CANDIDATES, max_offers=OFFER_MAX,
+                                 max_wait=OFFER_MAX_WAIT).start()
+
 @app.route("/api/register/customer", methods=["POST"])
 def register_customer():
     data = request.json
-    customers = load_data("customers.json")
-    for customer in customers:
-        if customer.get("email") == data["email"]:
-            return jsonify({"message": "Email đã tồn tại!"}), 400
-        if customer.get("phone") == data["phone"]:
-            return jsonify({"message": "Số điện thoại đã tồn tại!"}), 400
+    if store.customers.count("email", data["email"]):
+        return jsonify({"message": "Email đã tồn tại!"}), 400
+    if store.customers.count("phone", data["phone"]):
+        return jsonify({"message": "Số điện thoại đã tồn tại!"}), 400
     id = generate_id("customer_id")
     customer = Customer(id, data["name"], data["phone"], data["email"], data["password"])
-    customers.append(customer.__dict__)
-    save_data("customers.json", customers)
+    store.insert("customers", customer)
     return jsonify({"message": "Đăng ký thành công", "id": customer.id})
 
 def random_location():
@@ -39,17 +296,12 @@ def random_location():
 @app.route("/api/register/driver", methods=["POST"])
 def register_driver():
     data = request.json
-    drivers_data = load_data("drivers.json")
-    drivers = drivers_data.get("drivers", [])
-    
-    for driver in drivers:
-        if driver.get("email") == data["email"]:
-            return jsonify({"message": "Email đã tồn tại!"}), 400
-        if driver.get("phone") == data["phone"]:
-            return jsonify({"message": "Số điện thoại đã tồn tại!"}), 400
+    if store.drivers.count("email", data["email"]):
+        return jsonify({"message": "Email đã tồn tại!"}), 400
+    if store.drivers.count("phone", data["phone"]):
+        return jsonify({"message": "Số điện thoại đã tồn tại!"}), 400
 
     id = generate_id("driver_id")
-    location = random_location()
 
     driver = Driver(
         id=id,
@@ -57,204 +309,319 @@ def register_driver():
         vehicle_info=data["vehicle_info"],
         phone=data["phone"],
         email=data["email"],
-        password=data["password"]
+        password=data["password"],
+        vehicle_type=data.get("vehicle_type", "car"),
+        current_location=random_location()
     )
 
-    driver_dict = driver.__dict__
-    driver_dict["location"] = location
-    driver_dict["available"] = True
-    driver_dict["vehicle_type"] = data.get("vehicle_type", "car")
-
-    drivers.append(driver_dict)
-    
-    save_data("drivers.json", {"drivers": drivers})
+    store.insert("drivers", driver)
 
     return jsonify({"message": "Đăng ký tài xế thành công", "id": driver.id})
 
 
+def _new_ride(data):
+    """
+    Ghi nhận nhu cầu, báo giá phía máy chủ và tạo bản ghi chuyến đi (chưa lưu).
+    Trả về (Ride, quote); ném ValueError nếu dữ liệu không hợp lệ.
+    """
+    # Giá do máy chủ tính, không dùng estimated_price do client gửi lên
+    demand.record_request(float(data["pickup"]["lat"]), float(data["pickup"]["lng"]))
+    quote = pricing.quote(data["pickup"], data["dropoff"], data["vehicle_type"])
+
+    ride = Ride(
+        id=generate_id("ride_id"),
+        pickup=data["pickup"],
+        dropoff=data["dropoff"],
+        vehicle_type=data["vehicle_type"],
+        estimated_price=quote["fare"],
+        estimated_distance=quote["distance"],
+        estimated_duration=quote["duration"],
+        status="ongoing",
+        payment_method=data.get("payment_method", "cash")
+    )
+    return ride, quote
+
+
+def _match_response(ride, quote, closest_driver, dispatch_info=None):
+    """Nội dung trả về cho yêu cầu đặt xe: (payload, mã HTTP)."""
+    if not closest_driver:
+        logger.info("No suitable driver found")
+        return {"message": "Không tìm thấy tài xế phù hợp"}, 404
+
+    logger.info("Ride %s matched with driver %s", ride["id"], closest_driver["id"])
+
+    response = {
+        "message": "Đặt xe thành công",
+        "ride_id": ride["id"],
+        "driver": {
+            "id": closest_driver["id"],
+            "name": closest_driver["name"],
+            "phone": closest_driver["phone"],
+            "vehicle_info": closest_driver["vehicle_info"],
+            "current_location": closest_driver["current_location"],
+            "rating": closest_driver["rating"]
+        },
+        "fare": quote["fare"],
+        "eta": _round_eta(_driver_eta(closest_driver, ride["pickup"]))
+    }
+    if dispatch_info:
+        response["dispatch"] = dispatch_info
+    return response, 200
+
+
+def _shard_route(zone):
+    """Địa chỉ worker phục vụ vùng trong SHARD_ROUTES (theo tên vùng rồi tên thành phố), hoặc None."""
+    if zone is None:
+        return SHARD_ROUTES.get(OUTSIDE)
+    return SHARD_ROUTES.get(zone.name) or SHARD_ROUTES.get(zone.city)
+
+
+def _misrouted(pickup):
+    """
+    None nếu worker này phục vụ vùng chứa điểm đón; ngược lại (payload, mã
+    HTTP, địa chỉ worker phụ trách vùng đó hoặc None nếu không biết).
+    """
+    lat, lng = float(pickup["lat"]), float(pickup["lng"])
+    if driver_index.serves(lat, lng):
+        return None
+    zone = driver_index.geofence.locate(lat, lng)
+    name = zone.name if zone else OUTSIDE
+    target = _shard_route(zone)
+    payload = {"message": f"Điểm đón thuộc vùng {name}, không do máy chủ này phục vụ", "zone": name}
+    if target:
+        return payload, 307, target.rstrip("/")
+    return payload, 421, None
+
+
 @app.route("/api/ride/request", methods=["POST"])
 def request_ride():
     try:
         data = request.json
-        print("Received ride request data:", data)
-        
-        drivers_data = load_data("drivers.json")
-        if not isinstance(drivers_data, dict) or "drivers" not in drivers_data:
-            print("Invalid drivers data format")
-            return jsonify({"message": "Lỗi hệ thống: Dữ liệu tài xế không hợp lệ"}), 500
-            
-        drivers = drivers_data["drivers"]
-        print(f"Loaded {len(drivers)} drivers")
-        
-        id = generate_id("ride_id")
-        ride_request = RideRequest(
-            id=id,
-            pickup=data["pickup"],
-            dropoff=data["dropoff"],
-            vehicle_type=data["vehicle_type"],
-            estimated_price=data.get("estimated_price"),
-            estimated_distance=data.get("estimated_distance"),
-            estimated_duration=data.get("estimated_duration")
-        )
-        
-        closest_driver = RideMatchingService.find_closest_driver(
-            drivers=drivers,
-            pickup_location=data["pickup"],
-            vehicle_type=data["vehicle_type"]
-        )
-        
-        if not closest_driver:
-            print("No suitable driver found")
-            return jsonify({"message": "Không tìm thấy tài xế phù hợp"}), 404
-            
-        print(f"Found driver: {closest_driver['id']}")
-        
-        for driver in drivers:
-            if driver["id"] == closest_driver["id"]:
-                driver["status"] = "busy"
-                driver["available"] = False
-                break
-                
-        save_data("drivers.json", {"drivers": drivers})
-        
-        ride_request_dict = ride_request.__dict__
-        ride_request_dict["driver_id"] = closest_driver["id"]
-        ride_request_dict["status"] = "ongoing"
+        logger.debug("Received ride request: vehicle_type=%s", data.get("vehicle_type"))
         
-        rides = load_data("rides.json")
-        rides.append(ride_request_dict)
-        save_data("rides.json", rides)
+        try:
+            misrouted = _misrouted(data["pickup"])
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({"message": f"Điểm đón không hợp lệ: {str(e)}"}), 400
+        if misrouted:
+            payload, status, target = misrouted
+            response = jsonify(payload)
+            response.status_code = status
+            if target:
+                # 307 giữ nguyên phương thức và body khi client gửi lại
+                response.headers["Location"] = target + request.full_path.rstrip("?")
+            return response
+
+        try:
+            ride_request_dict, quote = _new_ride(data)
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+
+        dispatch_info = None
+        closest_driver = None
+        if dispatcher is not None:
+            # Chuyến đi được tạo ngay khi dispatcher giữ được tài xế
+            match = dispatcher.submit(data["pickup"], data["vehicle_type"], ride=ride_request_dict)
+            closest_driver = match["driver"] if match else None
+            dispatch_info = match["dispatch"] if match else None
+        else:
+            candidates = _find_candidates(data["pickup"], data["vehicle_type"])
+            # Nếu tài xế gần nhất vừa bị yêu cầu khác giữ thì chuyển sang người kế tiếp
+            for driver in candidates:
+                if _reserve_driver(driver, ride_request_dict):
+                    closest_driver = driver
+                    break
         
-        return jsonify({
-            "message": "Đặt xe thành công",
-            "ride_id": ride_request.id,
-            "driver": {
-                "id": closest_driver["id"],
-                "name": closest_driver["name"],
-                "phone": closest_driver["phone"],
-                "vehicle_info": closest_driver["vehicle_info"],
-                "current_location": closest_driver["current_location"],
-                "rating": closest_driver["rating"]
-            }
-        }), 200
+        response, status = _match_response(ride_request_dict, quote, closest_driver, dispatch_info)
+        return jsonify(response), status
         
     except Exception as e:
-        print(f"Error in request_ride: {str(e)}")
+        logger.exception("Error in request_ride")
         return jsonify({"message": f"Lỗi hệ thống: {str(e)}"}), 500
 
 
+@app.route("/api/quote", methods=["POST"])
+def quote_ride():
+    """Báo giá và thời gian di chuyển cho mọi loại xe (hoặc các loại trong vehicle_types)."""
+    try:
+        data = request.json
+        quotes = pricing.quote_all(data["pickup"], data["dropoff"], data.get("vehicle_types"))
+        return jsonify({"quotes": quotes})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"message": f"Dữ liệu không hợp lệ: {str(e)}"}), 400
+
+
+@app.route("/api/admin/heatmap", methods=["GET"])
+def demand_heatmap():
+    return jsonify({
+        "cell_size": demand.cell_size,
+        "window": demand.window,
+        "cells": demand.heatmap()
+    })
+
+
+@app.route("/api/shards/locate", methods=["GET"])
+def locate_shard():
+    """Vùng chứa một điểm và worker phục vụ vùng đó (cho load balancer hoặc client tự định tuyến)."""
+    lat, lng = request.args.get("lat", type=float), request.args.get("lng", type=float)
+    if lat is None or lng is None:
+        return jsonify({"error": "Cần lat và lng"}), 400
+    zone = driver_index.geofence.locate(lat, lng)
+    name = zone.name if zone else OUTSIDE
+    return jsonify({
+        "zone": name,
+        "city": zone.city if zone else None,
+        "served": driver_index.serves(lat, lng),
+        "route": _shard_route(zone),
+    })
+
+
+@app.route("/api/admin/shards", methods=["GET"])
+def shard_stats():
+    sizes = driver_index.sizes()
+    return jsonify({
+        "served": sorted(driver_index.served),
+        "spillover_km": driver_index.spill_km,
+        "zones": [dict(zone.to_dict(), available_drivers=sizes.get(zone.name))
+                  for zone in driver_index.geofence.zones],
+        "outside_available_drivers": sizes.get(OUTSIDE),
+    })
+
+
+@app.route("/api/admin/dispatch/stats", methods=["GET"])
+def dispatch_stats():
+    if dispatcher is None:
+        return jsonify({"mode": DISPATCH_MODE})
+    return jsonify(dict(dispatcher.stats(), mode=DISPATCH_MODE))
+
+
 @app.route("/api/payment", methods=["POST"])
 def process_payment():
-    data = request.json
-    amount = data.get("amount")
-    method = data.get("method", "credit_card")
-    result = Payment.process(amount, method)
-    return jsonify(result)
+    """
+    Thu tiền qua cổng thanh toán trong nền: trả 202 kèm công việc, kết quả
+    xem ở /api/jobs/<id>. Gửi lại với cùng Idempotency-Key (header hoặc
+    trường idempotency_key) trả về đúng công việc cũ.
+    """
+    data = request.json or {}
+    try:
+        amount = float(data["amount"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"message": "Số tiền không hợp lệ"}), 400
+    if amount < 0:
+        return jsonify({"message": "Số tiền không hợp lệ"}), 400
+    key = request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+    job = jobs.enqueue("payment.capture", {
+        "amount": amount,
+        "method": data.get("method", "credit_card"),
+        "ride_id": data.get("ride_id"),
+    }, key=f"client:{key}" if key else None)
+    return jsonify({"message": "Đã nhận yêu cầu thanh toán", "job": job.to_dict()}), 202
+
+
+@app.route("/api/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy công việc"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/api/admin/jobs/stats", methods=["GET"])
+def job_stats():
+    return jsonify(jobs.stats())
+
 
 @app.route("/api/ride/history/<customer_id>", methods=["GET"])
 def ride_history(customer_id):
-    rides = load_data("rides.json")
-    history = [r for r in rides if r["customer_id"] == int(customer_id)]
-    return jsonify(history)
+    return _ride_list_response(customer_id=int(customer_id))
+
+def _finish_ride(ride_id, status, changes=None):
+    """
+    Kết thúc chuyến đi và trả tài xế về trạng thái rảnh trong một giao dịch.
+    Compare-and-set trên trạng thái chuyến nên hai request đồng thời không
+    cùng kết thúc một chuyến. Trả về bản ghi chuyến đi (đã kết thúc trước đó
+    thì giữ nguyên trạng thái cũ) hoặc None nếu không tìm thấy.
+    """
+    while True:
+        ride = store.rides.get(ride_id)
+        if ride is None or ride["status"] in FINISHED_STATUSES:
+            return ride
+        ops = [("set", "rides", ride_id, dict(changes or {}, status=status))]
+        driver_id = ride.get("driver_id")
+        if driver_id is not None and store.drivers.get(driver_id) is not None:
+            ops.append(("set", "drivers", driver_id, {"status": "available", "available": True}))
+        if store.commit(ops, expect=[("rides", ride_id, {"status": ride["status"]})]) is not None:
+            logger.info("Chuyến %s: %s, tài xế %s đã sẵn sàng nhận chuyến mới", ride_id, status, driver_id)
+            return store.rides.get(ride_id)
+
 
 @app.route("/api/ride/cancel/<int:ride_id>", methods=["POST"])
 def cancel_ride(ride_id):
     try:
-        rides = load_data("rides.json")
-        drivers_data = load_data("drivers.json")
-        
-        if not isinstance(drivers_data, dict) or "drivers" not in drivers_data:
-            return jsonify({"error": "Dữ liệu tài xế không hợp lệ"}), 500
-            
-        drivers = drivers_data["drivers"]
-        
-        ride = next((r for r in rides if r["id"] == ride_id), None)
+        ride = _finish_ride(ride_id, "cancelled")
         if not ride:
             return jsonify({"error": "Không tìm thấy chuyến đi!"}), 404
-            
-        ride["status"] = "cancelled"
-        
-        driver = next((d for d in drivers if d["id"] == ride["driver_id"]), None)
-        if driver:
-            driver["status"] = "available"
-            driver["available"] = True
-            print(f"✅ Tài xế {driver['id']} đã được giải phóng!")
-        
-        save_data("rides.json", rides)
-        save_data("drivers.json", {"drivers": drivers})
-        
+        if ride["status"] != "cancelled":
+            return jsonify({"error": "Chuyến đi đã hoàn thành, không thể hủy!"}), 409
+
+        # Gọi lại (vd. client thử lại) không gửi thông báo lần nữa nhờ idempotency key
+        jobs.enqueue("notify.ride", {"ride_id": ride_id, "event": "cancelled"}, key=f"notify:ride:{ride_id}:cancelled")
+
         return jsonify({
             "message": "Đã hủy chuyến thành công!",
             "ride_id": ride_id
         })
         
     except Exception as e:
-        print(f"Error in cancel_ride: {str(e)}")
+        logger.exception("Error in cancel_ride")
         return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
 @app.route("/api/ride/complete/<int:ride_id>", methods=["POST"])
 def complete_ride(ride_id):
     try:
-        rides = load_data("rides.json")
-        drivers_data = load_data("drivers.json")
-        
-        if isinstance(drivers_data, dict) and "drivers" in drivers_data:
-            drivers = drivers_data["drivers"]
-        else:
-            drivers = []
-
-        ride_found = False
-        updated_rides = []
-
-        for ride in rides:
-            if str(ride["id"]) == str(ride_id):  
-                ride_found = True
-                ride["status"] = "completed"
-                
-                updated_drivers = []
-                for driver in drivers:
-                    if str(driver["id"]) == str(ride["driver_id"]):
-                        driver["available"] = True
-                        driver["status"] = "available"
-                        print(f"✅ Tài xế {driver['id']} đã sẵn sàng nhận chuyến mới!")
-                    updated_drivers.append(driver)
-                
-                save_data("drivers.json", {"drivers": updated_drivers})
-            
-            updated_rides.append(ride)
-
-        if not ride_found:
+        ride = _finish_ride(ride_id, "completed", {"completed_at": datetime.now().isoformat(timespec="seconds")})
+        if not ride:
             return jsonify({"error": "Không tìm thấy chuyến đi!"}), 404
+        if ride["status"] != "completed":
+            return jsonify({"error": "Chuyến đi đã bị hủy!"}), 409
+
+        # Phần còn lại chạy nền; key theo chuyến đi nên gọi lại không thu tiền hai lần
+        queued = [
+            jobs.enqueue("payment.capture", {
+                "amount": ride["fare"] or 0,
+                "method": ride.get("payment_method") or "cash",
+                "ride_id": ride_id,
+            }, key=f"capture:ride:{ride_id}"),
+            jobs.enqueue("driver.ride_completed", {"ride_id": ride_id}, key=f"driver-stats:ride:{ride_id}"),
+            jobs.enqueue("notify.ride", {"ride_id": ride_id, "event": "completed"},
+                         key=f"notify:ride:{ride_id}:completed"),
+        ]
 
-        save_data("rides.json", updated_rides)
-        return jsonify({"message": "Chuyến đi đã hoàn thành!"})
+        return jsonify({"message": "Chuyến đi đã hoàn thành!", "jobs": [job.id for job in queued]})
         
     except Exception as e:
-        print(f"Error in complete_ride: {e}")
+        logger.exception("Error in complete_ride")
         return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
 
 
-
 @app.route("/api/login/customer", methods=["POST"])
 def login_customer():
     data = request.json
     identifier = data.get("identifier")
     password = data.get("password")
 
-    print(f"Login attempt: identifier={identifier}, password={password}")
-
-    customers = load_data("customers.json")
+    logger.debug("Login attempt: identifier=%s", identifier)
 
-    for customer in customers:
-        if (customer["email"] == identifier or customer["phone"] == identifier) and customer["password"] == password:
-            print(f"Login successful for customer ID: {customer['id']}")
+    for customer in _find_by_identifier(store.customers, identifier):
+        if customer["password"] == password:
+            logger.info("Login successful for customer ID: %s", customer["id"])
             return jsonify({
                 "message": "Đăng nhập thành công",
                 "id": customer["id"]
             })
 
-    print("Login failed: Invalid credentials")
+    logger.info("Login failed: Invalid credentials")
     return jsonify({"message": "Sai thông tin đăng nhập"}), 401
 
 @app.route('/api/location-suggestions')
@@ -264,186 +631,389 @@ def location_suggestions():
         return jsonify([])
 
     try:
-        response = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={
-                "q": query,
-                "format": "json",
-                "addressdetails": 1,
-                "limit": 5,
-                "countrycodes": "vn"
-            },
-            headers={"User-Agent": "SmartRideApp/1.0"}
-        )
-        response.raise_for_status()
-        return jsonify(response.json())
+        return jsonify(geocoder.search(query))
     except Exception as e:
-        print(f"Error fetching location suggestions: {e}")
+        logger.exception("Error fetching location suggestions")
         return jsonify({"error": "Failed to fetch location suggestions"}), 500
 
+def _driver_location(driver):
+    """Vị trí mới nhất của tài xế: ưu tiên điểm GPS vừa nhận, sau đó tới bản ghi."""
+    latest = location_hub.get(driver["id"])
+    if latest:
+        return {"lat": latest["lat"], "lng": latest["lng"]}
+    return driver["current_location"]
+
+
+def _sse_response(stream):
+    return Response(
+        stream_with_context(stream),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _parse_ping(ping):
+    """Một điểm GPS dạng {"lat", "lng", "ts"} hoặc [driver_id, ts, lat, lng] -> (ts, lat, lng)."""
+    if isinstance(ping, (list, tuple)):
+        return float(ping[1]), float(ping[2]), float(ping[3])
+    return (
+        float(ping.get("ts") or time.time()),
+        float(ping["lat"]),
+        float(ping.get("lng", ping.get("lon")))
+    )
+
+
+def _ingest_points(driver_id, points):
+    """Ghi quỹ đạo, dời tài xế trong chỉ mục ghép chuyến và phát vị trí mới nhất."""
+    latest = trajectories.ingest(driver_id, points)
+    if latest is None:
+        return None
+    ts, lat, lng = latest
+    driver_index.move(driver_id, lat, lng)
+    demand.set_driver(driver_id, driver_index.position(driver_id))
+    return location_hub.ingest(driver_id, [{"lat": lat, "lng": lng, "ts": ts}])
+
+
+@app.route("/api/driver/<int:driver_id>/location", methods=["POST"])
+def ingest_driver_location(driver_id):
+    try:
+        if store.drivers.get(driver_id) is None:
+            return jsonify({"error": "Không tìm thấy tài xế"}), 404
+        data = request.json or {}
+        # Nhận cả lô {"pings": [...]} lẫn một điểm {"lat", "lng"}
+        pings = data.get("pings") or [data]
+        latest = _ingest_points(driver_id, [_parse_ping(p) for p in pings])
+        if latest is None:
+            return jsonify({"error": "Không có điểm GPS"}), 400
+        return jsonify({"accepted": len(pings), "current_location": latest})
+    except (KeyError, TypeError, ValueError, IndexError) as e:
+        return jsonify({"error": f"Dữ liệu GPS không hợp lệ: {str(e)}"}), 400
+
+
+@app.route("/api/locations/bulk", methods=["POST"])
+def ingest_locations_bulk():
+    """
+    Nhận một lô điểm GPS của nhiều tài xế:
+    {"pings": [{"driver_id", "lat", "lng", "ts"}, ...]} hoặc dạng gọn
+    {"pings": [[driver_id, ts, lat, lng], ...]}.
+    """
+    data = request.json or {}
+    by_driver = {}
+    rejected = 0
+    for ping in data.get("pings", []):
+        try:
+            driver_id = int(ping[0] if isinstance(ping, (list, tuple)) else ping["driver_id"])
+            by_driver.setdefault(driver_id, []).append(_parse_ping(ping))
+        except (KeyError, TypeError, ValueError, IndexError):
+            rejected += 1
+
+    accepted = 0
+    for driver_id, points in by_driver.items():
+        if store.drivers.get(driver_id) is None:
+            rejected += len(points)
+            continue
+        _ingest_points(driver_id, points)
+        accepted += len(points)
+    return jsonify({"accepted": accepted, "rejected": rejected, "drivers": len(by_driver)})
+
+
+def _offer_mode_error(driver_id):
+    """Lỗi (response, mã) nếu không chạy DISPATCH_MODE=offer hoặc không có tài xế; None nếu hợp lệ."""
+    if not isinstance(dispatcher, OfferDispatcher):
+        return jsonify({"error": "Máy chủ không chạy chế độ ghép chuyến qua lời mời"}), 404
+    if store.drivers.get(driver_id) is None:
+        return jsonify({"error": "Không tìm thấy tài xế"}), 404
+    return None
+
+
+@app.route("/api/driver/<int:driver_id>/offers", methods=["GET"])
+def get_driver_offers(driver_id):
+    """Long-poll: các lời mời đang chờ tài xế; chờ tối đa wait giây (mặc định 25) nếu chưa có."""
+    error = _offer_mode_error(driver_id)
+    if error:
+        return error
+    wait = min(max(request.args.get("wait", 25, type=float), 0), 60)
+    return jsonify({"offers": dispatcher.wait(driver_id, timeout=wait)})
+
+
+@app.route("/api/driver/<int:driver_id>/offers/<int:offer_id>/accept", methods=["POST"])
+def accept_offer(driver_id, offer_id):
+    error = _offer_mode_error(driver_id)
+    if error:
+        return error
+    result = dispatcher.accept(driver_id, offer_id)
+    if result is None:
+        return jsonify({"error": "Lời mời đã hết hạn hoặc không còn hiệu lực"}), 409
+    return jsonify({"message": "Đã nhận chuyến", "ride_id": result["ride_id"]})
+
+
+@app.route("/api/driver/<int:driver_id>/offers/<int:offer_id>/decline", methods=["POST"])
+def decline_offer(driver_id, offer_id):
+    error = _offer_mode_error(driver_id)
+    if error:
+        return error
+    if not dispatcher.decline(driver_id, offer_id):
+        return jsonify({"error": "Lời mời đã hết hạn hoặc không còn hiệu lực"}), 409
+    return jsonify({"message": "Đã từ chối chuyến"})
+
+
+@app.route("/api/driver/<int:driver_id>/trajectory", methods=["GET"])
+def get_driver_trajectory(driver_id):
+    trajectory = trajectories.get(driver_id)
+    since = request.args.get("since", type=float)
+    return jsonify({
+        "driver_id": driver_id,
+        "points": trajectory.points(since) if trajectory else []
+    })
+
+
 @app.route("/api/ride/driver-location/<int:ride_id>", methods=["GET"])
 def get_driver_location(ride_id):
     try:
-        rides = load_data("rides.json")
-        drivers_data = load_data("drivers.json")
-        
-        if not isinstance(drivers_data, dict) or "drivers" not in drivers_data:
-            return jsonify({"error": "Dữ liệu tài xế không hợp lệ"}), 500
-            
-        drivers = drivers_data["drivers"]
-        
-        ride = next((r for r in rides if r["id"] == ride_id), None)
+        ride = store.rides.get(ride_id)
         if not ride:
             return jsonify({"error": "Không tìm thấy chuyến đi"}), 404
             
-        driver = next((d for d in drivers if d["id"] == ride["driver_id"]), None)
+        driver = store.drivers.get(ride.get("driver_id"))
         if not driver:
             return jsonify({"error": "Không tìm thấy tài xế"}), 404
             
         return jsonify({
-            "current_location": driver.get("location")
+            "current_location": _driver_location(driver)
         })
         
     except Exception as e:
-        print(f"Error in get_driver_location: {e}")
+        logger.exception("Error in get_driver_location")
         return jsonify({"error": f"Có lỗi xảy ra: {str(e)}"}), 500
 
+
+def _ride_stream_driver(ride_id):
+    """
+    Tài xế của chuyến đi cùng vị trí ban đầu để gửi ngay khi mở stream.
+    Trả về (driver, initial, None) hoặc (None, None, thông báo lỗi).
+    """
+    ride = store.rides.get(ride_id)
+    if not ride:
+        return None, None, "Không tìm thấy chuyến đi"
+    driver = store.drivers.get(ride.get("driver_id"))
+    if not driver:
+        return None, None, "Không tìm thấy tài xế"
+    initial = []
+    location = _driver_location(driver)
+    if location:
+        initial.append({"driver_id": driver["id"], "lat": location.get("lat"), "lng": location.get("lng")})
+    return driver, initial, None
+
+
+@app.route("/api/ride/driver-location/<int:ride_id>/stream", methods=["GET"])
+def stream_driver_location(ride_id):
+    """Server-Sent Events: đẩy vị trí tài xế của chuyến đi thay cho việc polling."""
+    driver, initial, error = _ride_stream_driver(ride_id)
+    if error:
+        return jsonify({"error": error}), 404
+
+    subscription = location_hub.subscribe(driver_topic(driver["id"]), min_interval=LOCATION_MIN_INTERVAL)
+    return _sse_response(sse_stream(subscription, initial, extra={"ride_id": ride_id}))
+
+
+@app.route("/api/admin/locations/stream", methods=["GET"])
+def stream_all_locations():
+    """Server-Sent Events cho AdminDashboard: vị trí mới nhất của mọi tài xế, đã gộp theo lô."""
+    subscription = location_hub.subscribe(ALL_DRIVERS, min_interval=ADMIN_LOCATION_MIN_INTERVAL)
+    return _sse_response(sse_stream(subscription))
+
+def _with_names(ride):
+    """Bản sao của chuyến đi kèm tên tài xế/khách hàng để hiển thị."""
+    # Sao chép để không ghi thông tin hiển thị vào bản ghi gốc
+    ride = dict(ride)
+    # Thêm thông tin tài xế
+    if 'driver_id' in ride:
+        driver = store.drivers.get(ride['driver_id'])
+        if driver:
+            ride['driver_name'] = driver['name']
+            ride['vehicle_type'] = driver['vehicle_type']
+
+    # Thêm thông tin khách hàng
+    if 'customer_id' in ride:
+        customer = store.customers.get(ride['customer_id'])
+        if customer:
+            ride['customer_name'] = customer['name']
+            ride['customer_phone'] = customer['phone']
+    return ride
+
+
+def _ride_list_response(statuses=None, decorate=None, **fixed_filters):
+    """
+    Trả danh sách chuyến đi, mới nhất trước, theo một trong ba dạng:
+    - có limit/cursor: một trang {"items", "next_cursor"} (keyset pagination)
+    - format=ndjson: luồng NDJSON sinh lười, dùng để xuất dữ liệu
+    - mặc định: toàn bộ danh sách như trước
+    """
+    try:
+        filters = parse_ride_filters(request.args, statuses)
+        filters.update(fixed_filters)
+        # Chuyến đã chuyển sang kho lưu trữ được gộp vào theo cùng thứ tự (created_at, id)
+        rides = merge(query_rides(store.rides, **filters), ride_archive.query(**filters),
+                      key=store.rides.order_key, reverse=filters["descending"])
+        decorate = decorate or (lambda ride: ride)
+
+        if request.args.get("format") == "ndjson":
+            def generate():
+                for ride in rides:
+                    yield dumps(decorate(ride)) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        if "limit" in request.args or "cursor" in request.args:
+            items, next_cursor = paginate(store.rides, rides, parse_limit(request.args))
+            return jsonify({"items": [decorate(ride) for ride in items], "next_cursor": next_cursor})
+
+        return jsonify([decorate(ride) for ride in rides])
+    except ValueError as e:
+        return jsonify({"error": f"Tham số không hợp lệ: {str(e)}"}), 400
+
+
 # Admin endpoints
 @app.route('/api/admin/rides/active', methods=['GET'])
 def get_active_rides():
     try:
-        rides = load_data('rides.json')
-        drivers_data = load_data('drivers.json')
-        customers = load_data('customers.json')
-        
-        drivers = drivers_data.get('drivers', [])
-        
         # Lấy các chuyến đi đang hoạt động
-        active_rides = []
-        for ride in rides:
-            if ride['status'] in ['pending', 'accepted', 'in_progress', 'ongoing']:
-                # Thêm thông tin tài xế
-                if 'driver_id' in ride:
-                    driver = next((d for d in drivers if d['id'] == ride['driver_id']), None)
-                    if driver:
-                        ride['driver_name'] = driver['name']
-                        ride['vehicle_type'] = driver['vehicle_type']
-                
-                # Thêm thông tin khách hàng
-                if 'customer_id' in ride:
-                    customer = next((c for c in customers if c['id'] == ride['customer_id']), None)
-                    if customer:
-                        ride['customer_name'] = customer['name']
-                        ride['customer_phone'] = customer['phone']
-                
-                active_rides.append(ride)
-
-        return jsonify(active_rides)
+        return _ride_list_response(list(ACTIVE_STATUSES), decorate=_with_names)
     except Exception as e:
-        print(f"Error in get_active_rides: {str(e)}")
+        logger.exception("Error in get_active_rides")
         return jsonify([])
 
 @app.route('/api/admin/rides/history', methods=['GET'])
 def get_ride_history():
     try:
-        rides = load_data('rides.json')
-        drivers_data = load_data('drivers.json')
-        customers = load_data('customers.json')
-        
-        drivers = drivers_data.get('drivers', [])
-        
-        # Lấy các chuyến đi đã hoàn thành hoặc đã hủy
-        completed_rides = []
-        for ride in rides:
-            if ride['status'] in ['completed', 'cancelled']:
-                # Thêm thông tin tài xế
-                if 'driver_id' in ride:
-                    driver = next((d for d in drivers if d['id'] == ride['driver_id']), None)
-                    if driver:
-                        ride['driver_name'] = driver['name']
-                        ride['vehicle_type'] = driver['vehicle_type']
-                
-                # Thêm thông tin khách hàng
-                if 'customer_id' in ride:
-                    customer = next((c for c in customers if c['id'] == ride['customer_id']), None)
-                    if customer:
-                        ride['customer_name'] = customer['name']
-                        ride['customer_phone'] = customer['phone']
-                
-                completed_rides.append(ride)
-
-        # Sắp xếp theo thời gian tạo, mới nhất lên đầu
-        completed_rides.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-        
-        return jsonify(completed_rides)
+        # Lấy các chuyến đi đã hoàn thành hoặc đã hủy, mới nhất lên đầu
+        return _ride_list_response(['completed', 'cancelled'], decorate=_with_names)
     except Exception as e:
-        print(f"Error in get_ride_history: {str(e)}")
+        logger.exception("Error in get_ride_history")
         return jsonify([])
 
+def _with_stats(driver, summary):
+    """
+    Bản sao của tài xế kèm điểm đánh giá trung bình. total_rides giữ nguyên
+    bộ đếm trên bản ghi (công việc driver.ride_completed cộng dồn), giống
+    /api/driver/<id>/details.
+    """
+    driver = dict(driver)
+    driver['total_rides'] = driver.get('total_rides') or 0
+    if summary is None:
+        driver['rating'] = 0
+        return driver
+
+    # Điểm đánh giá trung bình trên các chuyến đã hoàn thành
+    if summary['completed']:
+        driver['rating'] = round(summary['rating_sum'] / summary['completed'], 1)
+    else:
+        driver['rating'] = 0
+    return driver
+
+
+def _dashboard_driver(driver, summary):
+    # Bảng điều khiển không cần (và không nên nhận) mật khẩu
+    driver = _with_stats(driver, summary)
+    driver.pop('password', None)
+    return driver
+
+
+# Dữ liệu gộp cho trang quản trị, chỉ dựng lại phần thay đổi
+dashboard = DashboardSnapshot(store, _with_names, _dashboard_driver, driver_stats)
+store.on_change(dashboard.record_change)
+store.on_remove(dashboard.record_removed)
+
+
+@app.route('/api/admin/dashboard', methods=['GET'])
+def get_dashboard():
+    """
+    Chuyến đi và tài xế cho trang quản trị trong một request.
+    ETag theo version dữ liệu: If-None-Match khớp thì trả 304. Với
+    ?since=<version>&epoch=<epoch> chỉ trả các mục thay đổi sau version đó
+    (full=false); nếu không tính được delta thì trả toàn bộ (full=true).
+    """
+    try:
+        version = dashboard.refresh()
+        etag = dashboard.etag(version)
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+        since = request.args.get('since')
+        payload = None
+        if since is not None:
+            payload = dashboard.delta(int(since), request.args.get('epoch'))
+        if payload is not None:
+            response = jsonify(payload)
+            version = payload['version']
+        else:
+            version, body = dashboard.snapshot()
+            response = Response(body, mimetype='application/json')
+        response.headers['ETag'] = dashboard.etag(version)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except ValueError as e:
+        return jsonify({"error": f"Tham số không hợp lệ: {str(e)}"}), 400
+    except Exception as e:
+        logger.exception("Error in get_dashboard")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/admin/drivers', methods=['GET'])
 def get_all_drivers():
     try:
-        drivers_data = load_data('drivers.json')
-        drivers = drivers_data.get('drivers', [])
-        rides = load_data('rides.json')
-        
-        # Tính toán thống kê cho mỗi tài xế
-        for driver in drivers:
-            # Đếm tổng số chuyến đi
-            driver['total_rides'] = len([r for r in rides if r.get('driver_id') == driver['id']])
-            
-            # Tính điểm đánh giá trung bình
-            completed_rides = [r for r in rides if r.get('driver_id') == driver['id'] and r['status'] == 'completed']
-            if completed_rides:
-                total_rating = sum(r.get('rating', 0) for r in completed_rides if 'rating' in r)
-                driver['rating'] = round(total_rating / len(completed_rides), 1)
-            else:
-                driver['rating'] = 0
-        
+        # Thống kê của mọi tài xế lấy một lần (bộ đếm trong bộ nhớ hoặc một truy vấn GROUP BY)
+        summaries = driver_stats.summaries()
+        drivers = [_with_stats(d, summaries.get(d['id'])) for d in store.drivers]
         return jsonify(drivers)
     except Exception as e:
-        print(f"Error in get_all_drivers: {str(e)}")
+        logger.exception("Error in get_all_drivers")
         return jsonify([])
 
+@app.route('/api/admin/analytics/revenue', methods=['GET'])
+def revenue_analytics():
+    """
+    Doanh thu các chuyến đã hoàn thành, nhóm theo by=day|driver|vehicle_type|district,
+    lọc theo from/to (ngày ISO). Phần trong kho lưu trữ được tính bằng phép quét
+    trên cột, phần còn trong store cộng thêm vào.
+    """
+    try:
+        by = request.args.get('by', 'day')
+        if by not in GROUP_BY:
+            return jsonify({"error": f"by phải là một trong {', '.join(GROUP_BY)}"}), 400
+        date_from, date_to = request.args.get('from'), request.args.get('to')
+        totals = ride_archive.revenue(by, date_from, date_to)
+        revenue_of(store.rides.find('status', 'completed'), by, date_from, date_to, into=totals)
+
+        items = [{"key": key, "rides": count, "revenue": round(total)} for key, (count, total) in totals.items()]
+        if by == 'day':
+            items.sort(key=lambda item: item["key"])
+        else:
+            items.sort(key=lambda item: (-item["revenue"], -item["rides"]))
+        return jsonify({"by": by, "items": items})
+    except Exception as e:
+        logger.exception("Error in revenue_analytics")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/admin/drivers/<driver_id>', methods=['PUT'])
 def update_driver(driver_id):
     try:
-        print(f"Nhận yêu cầu cập nhật cho tài xế {driver_id}")
+        logger.debug("Nhận yêu cầu cập nhật cho tài xế %s", driver_id)
         data = request.get_json()
-        print("Dữ liệu nhận được:", data)
-        
-        drivers_data = load_data('drivers.json')
-        if not isinstance(drivers_data, dict) or "drivers" not in drivers_data:
-            print("Lỗi: Dữ liệu tài xế không hợp lệ")
-            return jsonify({'error': 'Dữ liệu tài xế không hợp lệ'}), 500
-            
-        drivers = drivers_data.get('drivers', [])
+        logger.debug("Dữ liệu nhận được: %s", data)
         
-        # Tìm và cập nhật thông tin tài xế
-        driver_found = False
-        for driver in drivers:
-            if str(driver['id']) == str(driver_id):
-                driver_found = True
-                # Cập nhật các trường được cho phép
-                allowed_fields = ['name', 'phone', 'vehicle_info', 'status', 'available']
-                for field in allowed_fields:
-                    if field in data:
-                        driver[field] = data[field]
-                print(f"Đã cập nhật tài xế {driver_id}:", driver)
-                break
-        
-        if not driver_found:
-            print(f"Không tìm thấy tài xế {driver_id}")
+        if store.drivers.get(driver_id) is None:
+            logger.info("Không tìm thấy tài xế %s", driver_id)
             return jsonify({'error': 'Không tìm thấy tài xế'}), 404
-        
-        # Lưu lại vào file
-        save_data('drivers.json', {'drivers': drivers})
-        print("Đã lưu dữ liệu thành công")
+
+        # Cập nhật các trường được cho phép
+        allowed_fields = ['name', 'phone', 'vehicle_info', 'status', 'available']
+        changes = {field: data[field] for field in allowed_fields if field in data}
+        driver = store.update('drivers', driver_id, changes)
+        logger.info("Đã cập nhật tài xế %s: %s", driver_id, sorted(changes))
         
         return jsonify({'message': 'Cập nhật thành công', 'driver': driver})
         
     except Exception as e:
-        print(f"Lỗi khi cập nhật tài xế: {str(e)}")
+        logger.exception("Lỗi khi cập nhật tài xế")
         return jsonify({'error': str(e)}), 500
 
 @app.route("/api/login/driver", methods=["POST"])
@@ -453,23 +1023,16 @@ def login_driver():
         identifier = data.get("identifier")  # Email hoặc số điện thoại
         password = data.get("password")
 
-        print(f"Driver login attempt: identifier={identifier}, password={password}")
-
-        drivers_data = load_data("drivers.json")
-        if not isinstance(drivers_data, dict) or "drivers" not in drivers_data:
-            return jsonify({"message": "Lỗi hệ thống: Dữ liệu tài xế không hợp lệ"}), 500
-            
-        drivers = drivers_data["drivers"]
+        logger.debug("Driver login attempt: identifier=%s", identifier)
 
         # Tìm tài xế theo email hoặc số điện thoại
         driver = next(
-            (d for d in drivers if (d["email"] == identifier or d["phone"] == identifier) 
-             and d["password"] == password),
+            (d for d in _find_by_identifier(store.drivers, identifier) if d["password"] == password),
             None
         )
 
         if driver:
-            print(f"Login successful for driver ID: {driver['id']}")
+            logger.info("Login successful for driver ID: %s", driver["id"])
             return jsonify({
                 "message": "Đăng nhập thành công",
                 "id": driver["id"],
@@ -480,37 +1043,32 @@ def login_driver():
                 "available": driver.get("available", True)
             })
 
-        print("Login failed: Invalid credentials")
+        logger.info("Login failed: Invalid credentials")
         return jsonify({"message": "Sai thông tin đăng nhập"}), 401
 
     except Exception as e:
-        print(f"Error in login_driver: {str(e)}")
+        logger.exception("Error in login_driver")
         return jsonify({"message": f"Lỗi hệ thống: {str(e)}"}), 500
 
 @app.route("/api/driver/<int:driver_id>/details", methods=["GET"])
 def get_driver_details(driver_id):
     try:
         # Lấy thông tin tài xế
-        drivers_data = load_data("drivers.json")
-        drivers = drivers_data.get("drivers", [])
-        driver = next((d for d in drivers if d["id"] == driver_id), None)
+        driver = store.drivers.get(driver_id)
         
         if not driver:
             return jsonify({"message": "Không tìm thấy tài xế"}), 404
 
-        # Lấy lịch sử chuyến đi
-        rides = load_data("rides.json")
-        driver_rides = [ride for ride in rides if ride.get("driver_id") == driver_id]
-        
-        # Tính tổng thu nhập (70% giá chuyến đi)
-        completed_rides = [ride for ride in driver_rides if ride["status"] == "completed"]
-        total_earnings = sum(ride.get("fare", 0) * 0.7 for ride in completed_rides)
+        # Thống kê và thu nhập (70% giá chuyến đi) lấy từ bộ đếm đã tính sẵn
+        summary = driver_stats.summary(driver_id)
+        recent_rides = [store.rides.get(ride_id) or ride_archive.get(ride_id)
+                        for ride_id in driver_stats.recent_ride_ids(driver_id)]
         
         # Thống kê theo trạng thái
         ride_stats = {
-            "completed": len([r for r in driver_rides if r["status"] == "completed"]),
-            "cancelled": len([r for r in driver_rides if r["status"] == "cancelled"]),
-            "ongoing": len([r for r in driver_rides if r["status"] in ["pending", "accepted", "in_progress", "ongoing"]])
+            "completed": summary["completed"],
+            "cancelled": summary["cancelled"],
+            "ongoing": summary["ongoing"]
         }
 
         return jsonify({
@@ -527,8 +1085,8 @@ def get_driver_details(driver_id):
                 "available": driver["available"]
             },
             "earnings": {
-                "total": round(total_earnings),
-                "ride_count": len(completed_rides)
+                "total": round(summary["earnings"]),
+                "ride_count": summary["completed"]
             },
             "ride_stats": ride_stats,
             "recent_rides": [
@@ -537,18 +1095,20 @@ def get_driver_details(driver_id):
                     "pickup": ride["pickup"]["address"],
                     "dropoff": ride["dropoff"]["address"],
                     "status": ride["status"],
-                    "fare": round(ride["fare"] * 0.7) if ride["fare"] else 0,
+                    "fare": round(ride["fare"] * DRIVER_SHARE) if ride["fare"] else 0,
                     "created_at": ride.get("created_at", ""),
-                    "completed_at": ride.get("completed_at", "")
+                    "completed_at": ride.get("completed_at") or ""
                 }
-                for ride in sorted(driver_rides, key=lambda x: x.get("created_at", ""), reverse=True)[:10]
+                for ride in recent_rides if ride
             ]
         })
 
     except Exception as e:
-        print(f"Error in get_driver_details: {str(e)}")
+        logger.exception("Error in get_driver_details")
         return jsonify({"message": f"Lỗi hệ thống: {str(e)}"}), 500
 
 if __name__ == "__main__":
     os.makedirs("data", exist_ok=True)
-    app.run(host="localhost", port=5000, debug=True)
\ No newline at end of file
+    # Không dùng reloader: store, journal công việc và các thread nền được mở ngay
+    # khi import, tiến trình cha của reloader sẽ mở cùng wal.log/jobs.log với tiến trình con
+    app.run(host="localhost", port=5000, debug=True, use_reloader=False)
\ No newline at end of file
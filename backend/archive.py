@@ -0,0 +1,678 @@
+"""
+Kho lưu trữ dạng cột cho các chuyến đi đã kết thúc.
+
+Mỗi cột là một file nhị phân nối thêm (array typecode cố định) trong
+data/archive/rides/; địa chỉ, loại xe và trạng thái được mã hóa từ điển
+(mỗi giá trị khác nhau chỉ lưu một lần trong dict_<tên>.jsonl). Khi đọc,
+các cột được memory-map nên không phải nạp vào heap Python; các truy vấn
+thống kê là phép quét vector trên cột (numpy nếu có cài, nếu không thì
+vòng lặp trên memoryview).
+
+meta.json giữ số dòng đã ghi xong và là điểm commit: khi mở, phần đuôi
+cột/từ điển ghi dở sau lần dừng đột ngột được cắt bỏ.
+
+Chạy tay: python archive.py [--older-than-hours N] để chuyển các chuyến đã
+hoàn thành/hủy từ store sang kho lưu trữ.
+"""
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from utils import DATA_DIR, dumps
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn: không có thì quét bằng vòng lặp
+    np = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive", "rides")
+META_FILE = "meta.json"
+EXTRA_FILE = "extra.bin"
+
+FINISHED_STATUSES = ("completed", "cancelled")
+
+NULL_ID = -1
+NAN = float("nan")
+
+# (tên cột, typecode của array)
+COLUMNS = (
+    ("id", "q"),
+    ("created_at", "d"),  # epoch giây, NaN nếu không có
+    ("customer_id", "q"),
+    ("driver_id", "q"),
+    ("status", "B"),
+    ("vehicle_type", "H"),
+    ("pickup_lat", "d"),
+    ("pickup_lng", "d"),
+    ("pickup_address", "I"),
+    ("dropoff_lat", "d"),
+    ("dropoff_lng", "d"),
+    ("dropoff_address", "I"),
+    ("fare", "d"),
+    ("estimated_price", "d"),
+    ("estimated_distance", "d"),
+    ("estimated_duration", "d"),
+    ("rating", "d"),
+    ("extra_end", "q"),  # vị trí kết thúc phần trường phụ (JSON) trong extra.bin
+)
+TYPECODES = dict(COLUMNS)
+
+# Cột mã hóa từ điển -> tên từ điển (điểm đón và điểm đến dùng chung từ điển địa chỉ)
+DICTIONARY_COLUMNS = {
+    "status": "status",
+    "vehicle_type": "vehicle_type",
+    "pickup_address": "address",
+    "dropoff_address": "address",
+}
+DICTIONARIES = ("status", "vehicle_type", "address")
+
+# Phần địa chỉ (theo thứ tự ưu tiên) dùng làm quận/huyện khi thống kê
+DISTRICT_PREFIXES = ("Quận ", "Huyện ", "Thị xã ", "Thành phố ", "Tỉnh ")
+UNKNOWN_DISTRICT = "Không xác định"
+
+GROUP_BY = ("day", "driver", "vehicle_type", "district")
+
+
+def iso_to_ts(value):
+    """Chuỗi ISO (created_at) -> epoch giây theo giờ địa phương; NaN nếu trống/không hợp lệ."""
+    if not value:
+        return NAN
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return NAN
+
+
+def ts_to_iso(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+
+
+def district_of(address):
+    """Quận/huyện trong địa chỉ kiểu Nominatim ("..., Quận Nam Từ Liêm, Thành phố Hà Nội, ...")."""
+    if not address:
+        return UNKNOWN_DISTRICT
+    parts = [p.strip() for p in str(address).split(",")]
+    for prefix in DISTRICT_PREFIXES:
+        for part in parts:
+            if part.startswith(prefix):
+                return part
+    return UNKNOWN_DISTRICT
+
+
+def _float(value):
+    try:
+        return NAN if value is None else float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def _int(value):
+    try:
+        return NULL_ID if value is None else int(value)
+    except (TypeError, ValueError):
+        return NULL_ID
+
+
+def _number(value):
+    # Giá/điểm lưu dạng float; trả lại int nếu là số nguyên như bản ghi gốc
+    if value != value:
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _ride_from_values(values):
+    """Dựng lại dict chuyến đi (các khóa như Ride.to_dict()) từ giá trị các cột (đã giải mã từ điển)."""
+    ride = {"id": values["id"]}
+    ride["customer_id"] = None if values["customer_id"] == NULL_ID else values["customer_id"]
+    ride["pickup"] = _location(values["pickup_lat"], values["pickup_lng"], values["pickup_address"])
+    ride["dropoff"] = _location(values["dropoff_lat"], values["dropoff_lng"], values["dropoff_address"])
+    ride["vehicle_type"] = values["vehicle_type"]
+    ride["estimated_price"] = _number(values["estimated_price"])
+    distance, duration = values["estimated_distance"], values["estimated_duration"]
+    ride["estimated_distance"] = None if distance != distance else distance
+    ride["estimated_duration"] = None if duration != duration else duration
+    ride["status"] = values["status"]
+    ride["driver_id"] = None if values["driver_id"] == NULL_ID else values["driver_id"]
+    ride["fare"] = _number(values["fare"])
+    ride["created_at"] = ts_to_iso(values["created_at"]) if values["created_at"] == values["created_at"] else None
+    ride["rating"] = _number(values["rating"])
+    return ride
+
+
+def _location(lat, lng, address):
+    if address is None:
+        return {"lat": lat, "lng": lng}
+    return {"lat": lat, "lng": lng, "address": address}
+
+
+def _values_from_ride(ride):
+    # pickup/dropoff là Location (models.py) hoặc dict
+    pickup = ride.get("pickup") if hasattr(ride.get("pickup"), "get") else {}
+    dropoff = ride.get("dropoff") if hasattr(ride.get("dropoff"), "get") else {}
+    return {
+        "id": int(ride["id"]),
+        "created_at": iso_to_ts(ride.get("created_at")),
+        "customer_id": _int(ride.get("customer_id")),
+        "driver_id": _int(ride.get("driver_id")),
+        "status": ride.get("status"),
+        "vehicle_type": ride.get("vehicle_type"),
+        "pickup_lat": _float(pickup.get("lat")),
+        "pickup_lng": _float(pickup.get("lng")),
+        "pickup_address": pickup.get("address"),
+        "dropoff_lat": _float(dropoff.get("lat")),
+        "dropoff_lng": _float(dropoff.get("lng")),
+        "dropoff_address": dropoff.get("address"),
+        "fare": _float(ride.get("fare")),
+        "estimated_price": _float(ride.get("estimated_price")),
+        "estimated_distance": _float(ride.get("estimated_distance")),
+        "estimated_duration": _float(ride.get("estimated_duration")),
+        "rating": _float(ride.get("rating")),
+    }
+
+
+def _same(a, b):
+    # NaN/None ở cả hai phía được coi là bằng nhau
+    if isinstance(a, float) and isinstance(b, float) and a != a and b != b:
+        return True
+    return a == b
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class _View:
+    """Ảnh chụp chỉ đọc của kho tại một số dòng: các cột đã map và từ điển."""
+
+    def __init__(self, rows, columns, dictionaries, extra):
+        self.rows = rows
+        self.columns = columns
+        self.dictionaries = dictionaries
+        self.extra = extra
+        self._districts = None
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def code(self, column, value):
+        """Mã từ điển của value trong cột; None nếu chưa từng xuất hiện."""
+        return self.dictionaries[DICTIONARY_COLUMNS[column]][1].get(value)
+
+    def districts(self):
+        """(tên các quận, bảng mã địa chỉ -> mã quận)."""
+        if self._districts is None:
+            names, codes, lut = [], {}, []
+            for address in self.dictionaries["address"][0]:
+                name = district_of(address)
+                if name not in codes:
+                    codes[name] = len(names)
+                    names.append(name)
+                lut.append(codes[name])
+            self._districts = (names, np.array(lut, dtype=np.uint32) if np is not None else lut)
+        return self._districts
+
+    def ride(self, i):
+        values = {}
+        for name, _ in COLUMNS:
+            value = self.columns[name][i]
+            if name in DICTIONARY_COLUMNS:
+                value = self.dictionaries[DICTIONARY_COLUMNS[name]][0][value]
+            elif np is not None:
+                value = value.item()
+            values[name] = value
+        ride = _ride_from_values(values)
+        start = self.columns["extra_end"][i - 1] if i else 0
+        end = values["extra_end"]
+        if end > start:
+            ride.update(json.loads(self.extra[int(start):int(end)].decode("utf-8")))
+        return ride
+
+
+class RideArchive:
+    """
+    Kho cột chỉ nối thêm cho chuyến đi đã kết thúc. Ghi qua append() (một
+    thread ghi tại một thời điểm); đọc qua ảnh chụp _View được đổi nguyên
+    khối sau mỗi lần ghi nên người đọc không bao giờ thấy dòng ghi dở.
+    """
+
+    def __init__(self, path=ARCHIVE_DIR):
+        self.path = path
+        self._lock = threading.Lock()
+        self._view = _View(0, {name: self._empty(name) for name, _ in COLUMNS},
+                           {name: ([], {}) for name in DICTIONARIES}, b"")
+        self._extra_size = 0
+        # id chuyến đi -> số dòng, để get() và append() không phải quét cả cột id
+        self._rows = {}
+
+    @staticmethod
+    def _empty(name):
+        if np is not None:
+            return np.empty(0, dtype=np.dtype(TYPECODES[name]))
+        return memoryview(array(TYPECODES[name]))
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return self._view.rows
+
+    def __iter__(self):
+        view = self._view
+        return (view.ride(i) for i in range(view.rows))
+
+    def open(self):
+        """Mở kho (tạo thư mục nếu chưa có) và cắt phần ghi dở sau meta.json."""
+        os.makedirs(self.path, exist_ok=True)
+        meta_path = self._file(META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            meta = {"rows": 0, "extra_bytes": 0, "dictionaries": {}}
+        rows = meta["rows"]
+        with self._lock:
+            for name, typecode in COLUMNS:
+                self._truncate(self._file(f"{name}.bin"), rows * array(typecode).itemsize)
+            self._truncate(self._file(EXTRA_FILE), meta["extra_bytes"])
+            dictionaries = {}
+            for name in DICTIONARIES:
+                count = meta["dictionaries"].get(name, 0)
+                values = self._read_dictionary(name, count)
+                dictionaries[name] = (values, {v: i for i, v in enumerate(values)})
+            self._extra_size = meta["extra_bytes"]
+            self._remap(rows, dictionaries)
+            self._rows = dict(zip(self._view["id"].tolist(), range(rows)))
+        logger.info("Kho lưu trữ chuyến đi: %d dòng tại %s", rows, self.path)
+        return self
+
+    @staticmethod
+    def _truncate(path, size):
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        elif os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    def _read_dictionary(self, name, count):
+        path = self._file(f"dict_{name}.jsonl")
+        values, trailing = [], False
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if len(values) == count:
+                        trailing = True
+                        break
+                    values.append(json.loads(line))
+        if trailing or not os.path.exists(path):
+            # Viết lại để bỏ các dòng ghi dở phía sau
+            with open(path, "w", encoding="utf-8") as f:
+                for value in values:
+                    f.write(json.dumps(value, ensure_ascii=False) + "\n")
+        return values
+
+    def _map(self, path, size):
+        if not size:
+            return b""
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def _remap(self, rows, dictionaries):
+        columns = {}
+        for name, typecode in COLUMNS:
+            size = rows * array(typecode).itemsize
+            if not size:
+                columns[name] = self._empty(name)
+            elif np is not None:
+                columns[name] = np.frombuffer(self._map(self._file(f"{name}.bin"), size),
+                                              dtype=np.dtype(typecode), count=rows)
+            else:
+                columns[name] = memoryview(self._map(self._file(f"{name}.bin"), size)).cast(typecode)
+        extra = self._map(self._file(EXTRA_FILE), self._extra_size)
+        self._view = _View(rows, columns, dictionaries, extra)
+
+    def append(self, rides):
+        """Nối các chuyến đi vào kho; bỏ qua chuyến đã có. Trả về số dòng được thêm."""
+        rides = list(rides)
+        wanted = [int(ride["id"]) for ride in rides]
+        with self._lock:
+            view = self._view
+            existing = {ride_id for ride_id in wanted if ride_id in self._rows}
+            added_ids = []
+            dictionaries = {name: (list(values), dict(codes))
+                            for name, (values, codes) in view.dictionaries.items()}
+            new_values = {name: [] for name in DICTIONARIES}
+            buffers = {name: array(typecode) for name, typecode in COLUMNS}
+            extra_chunks = []
+            extra_end = self._extra_size
+            added = 0
+            for ride in rides:
+                if int(ride["id"]) in existing:
+                    continue
+                existing.add(int(ride["id"]))
+                added_ids.append(int(ride["id"]))
+                values = _values_from_ride(ride)
+                # Trường không khôi phục đúng được từ các cột thì giữ nguyên dạng JSON
+                restored = _ride_from_values(values)
+                # Trường của Ride không có cột riêng chỉ cần lưu khi có giá trị
+                extra = {k: v for k, v in ride.items()
+                         if (v is not None if k not in restored else not _same(restored[k], v))}
+                if extra:
+                    chunk = dumps(extra).encode("utf-8")
+                    extra_chunks.append(chunk)
+                    extra_end += len(chunk)
+                values["extra_end"] = extra_end
+                for name, _ in COLUMNS:
+                    value = values[name]
+                    if name in DICTIONARY_COLUMNS:
+                        values_list, codes = dictionaries[DICTIONARY_COLUMNS[name]]
+                        code = codes.get(value)
+                        if code is None:
+                            code = codes[value] = len(values_list)
+                            values_list.append(value)
+                            new_values[DICTIONARY_COLUMNS[name]].append(value)
+                        value = code
+                    buffers[name].append(value)
+                added += 1
+            if not added:
+                return 0
+
+            # Dữ liệu phải xuống đĩa trước meta.json: sau khi mất điện, meta không
+            # được trỏ tới các dòng mà file cột chưa kịp ghi
+            for name, _ in COLUMNS:
+                with open(self._file(f"{name}.bin"), "ab") as f:
+                    buffers[name].tofile(f)
+                    _sync(f)
+            if extra_chunks:
+                with open(self._file(EXTRA_FILE), "ab") as f:
+                    for chunk in extra_chunks:
+                        f.write(chunk)
+                    _sync(f)
+            for name, values in new_values.items():
+                if values:
+                    with open(self._file(f"dict_{name}.jsonl"), "a", encoding="utf-8") as f:
+                        for value in values:
+                            f.write(json.dumps(value, ensure_ascii=False) + "\n")
+                        _sync(f)
+
+            rows = view.rows + added
+            meta = {
+                "rows": rows,
+                "extra_bytes": extra_end,
+                "dictionaries": {name: len(dictionaries[name][0]) for name in DICTIONARIES},
+            }
+            tmp_path = self._file(META_FILE + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+                _sync(f)
+            os.replace(tmp_path, self._file(META_FILE))
+            self._extra_size = extra_end
+            self._remap(rows, dictionaries)
+            self._rows.update(zip(added_ids, range(view.rows, rows)))
+            return added
+
+    def get(self, ride_id):
+        view = self._view
+        i = self._rows.get(_int(ride_id))
+        return view.ride(i) if i is not None and i < view.rows else None
+
+    # ------------------------------------------------------------------
+    # Truy vấn
+    # ------------------------------------------------------------------
+
+    def _mask(self, view, statuses=None, driver_id=None, customer_id=None, vehicle_type=None,
+              date_from=None, date_to=None):
+        """Các dòng thỏa bộ lọc: mảng bool (numpy) hoặc list chỉ số."""
+        tests = []
+        if statuses is not None:
+            codes = [c for c in (view.code("status", s) for s in statuses) if c is not None]
+            tests.append(("status", "in", codes))
+        if driver_id is not None:
+            tests.append(("driver_id", "==", int(driver_id)))
+        if customer_id is not None:
+            tests.append(("customer_id", "==", int(customer_id)))
+        if vehicle_type:
+            tests.append(("vehicle_type", "==", view.code("vehicle_type", vehicle_type)))
+        if date_from:
+            tests.append(("created_at", ">=", iso_to_ts(date_from)))
+        if date_to:
+            tests.append(("created_at", "<", _end_of(date_to)))
+
+        if np is not None:
+            mask = np.ones(view.rows, dtype=bool)
+            for column, op, value in tests:
+                data = view[column]
+                if op == "in":
+                    mask &= np.isin(data, value)
+                elif value is None:
+                    mask[:] = False
+                elif op == "==":
+                    mask &= data == value
+                elif op == ">=":
+                    mask &= data >= value
+                else:
+                    mask &= data < value
+            return mask
+
+        checks = []
+        for column, op, value in tests:
+            data = view[column]
+            if op == "in":
+                value = set(value)
+                checks.append(lambda i, d=data, v=value: d[i] in v)
+            elif value is None:
+                return []
+            elif op == "==":
+                checks.append(lambda i, d=data, v=value: d[i] == v)
+            elif op == ">=":
+                checks.append(lambda i, d=data, v=value: d[i] >= v)
+            else:
+                checks.append(lambda i, d=data, v=value: d[i] < v)
+        return [i for i in range(view.rows) if all(check(i) for check in checks)]
+
+    def query(self, statuses=None, driver_id=None, customer_id=None, vehicle_type=None,
+              date_from=None, date_to=None, after=None, descending=True):
+        """
+        Như pagination.query_rides nhưng trên kho lưu trữ: sinh lười các chuyến
+        đi theo thứ tự (created_at, id), lọc bằng phép quét trên cột.
+        """
+        view = self._view
+        if not view.rows:
+            return
+        selected = self._mask(view, statuses, driver_id, customer_id, vehicle_type, date_from, date_to)
+        ts, ids = view["created_at"], view["id"]
+        if np is not None:
+            rows = np.flatnonzero(selected)
+            keys = np.nan_to_num(ts[rows], nan=-np.inf)
+            if after is not None:
+                after_ts, after_id = _after_key(after)
+                if descending:
+                    keep = (keys < after_ts) | ((keys == after_ts) & (ids[rows] < after_id))
+                else:
+                    keep = (keys > after_ts) | ((keys == after_ts) & (ids[rows] > after_id))
+                rows, keys = rows[keep], keys[keep]
+            order = np.lexsort((ids[rows], keys))
+            rows = rows[order[::-1] if descending else order].tolist()
+        else:
+            key = lambda i: (-math.inf if ts[i] != ts[i] else ts[i], ids[i])
+            if after is not None:
+                after_key = _after_key(after)
+                if descending:
+                    selected = [i for i in selected if key(i) < after_key]
+                else:
+                    selected = [i for i in selected if key(i) > after_key]
+            rows = sorted(selected, key=key, reverse=descending)
+        for i in rows:
+            yield view.ride(i)
+
+    def revenue(self, by="day", date_from=None, date_to=None):
+        """
+        Doanh thu các chuyến đã hoàn thành theo ngày/tài xế/loại xe/quận
+        (quận của điểm đón): {khóa: [số chuyến, doanh thu]}.
+        Chuyến không có fare vẫn được đếm nhưng không cộng doanh thu; khi
+        nhóm theo ngày, chuyến không có created_at bị bỏ qua.
+        """
+        if by not in GROUP_BY:
+            raise ValueError(f"Không hỗ trợ nhóm theo {by}")
+        view = self._view
+        if not view.rows:
+            return {}
+        selected = self._mask(view, ["completed"], date_from=date_from, date_to=date_to)
+        if by == "district":
+            names, lut = view.districts()
+
+        if np is not None:
+            fare = np.nan_to_num(view["fare"][selected], nan=0.0)
+            if by == "day":
+                days = view["created_at"][selected]
+                known = ~np.isnan(days)
+                keys = (np.floor((days[known] + _utc_offset()) / 86400)).astype(np.int64)
+                fare = fare[known]
+            elif by == "driver":
+                keys = view["driver_id"][selected]
+            elif by == "vehicle_type":
+                keys = view["vehicle_type"][selected]
+            else:
+                keys = lut[view["pickup_address"][selected]]
+            uniq, inverse = np.unique(keys, return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(uniq))
+            sums = np.bincount(inverse, weights=fare, minlength=len(uniq))
+            grouped = zip(uniq.tolist(), counts.tolist(), sums.tolist())
+        else:
+            column = {"day": "created_at", "driver": "driver_id",
+                      "vehicle_type": "vehicle_type", "district": "pickup_address"}[by]
+            data, fares, offset = view[column], view["fare"], _utc_offset()
+            acc = {}
+            for i in selected:
+                key = data[i]
+                if by == "day":
+                    if key != key:
+                        continue
+                    key = int((key + offset) // 86400)
+                elif by == "district":
+                    key = lut[key]
+                entry = acc.get(key)
+                if entry is None:
+                    entry = acc[key] = [0, 0.0]
+                entry[0] += 1
+                if fares[i] == fares[i]:
+                    entry[1] += fares[i]
+            grouped = ((k, c, s) for k, (c, s) in acc.items())
+
+        result = {}
+        for key, count, total in grouped:
+            if by == "day":
+                key = (date(1970, 1, 1) + timedelta(days=key)).isoformat()
+            elif by == "driver":
+                key = None if key == NULL_ID else key
+            elif by == "vehicle_type":
+                key = view.dictionaries["vehicle_type"][0][key]
+            else:
+                key = names[key]
+            result[key] = [count, total]
+        return result
+
+
+def _utc_offset():
+    # Ngày được tính theo giờ địa phương như created_at
+    return datetime.now().astimezone().utcoffset().total_seconds()
+
+
+def _end_of(value):
+    """Mốc (không bao gồm) của bộ lọc "to": cả ngày nếu chỉ có ngày, như pagination."""
+    if len(value) == 10:
+        return iso_to_ts(value) + 86400
+    return iso_to_ts(value) + 1
+
+
+def _after_key(after):
+    created_at, ride_id = after
+    ts = iso_to_ts(created_at)
+    return (-math.inf if ts != ts else ts, int(ride_id))
+
+
+def revenue_of(rides, by="day", date_from=None, date_to=None, into=None):
+    """
+    Cộng doanh thu của các chuyến đi còn trong store (dict) vào kết quả
+    RideArchive.revenue; dùng cho phần chưa được chuyển sang kho lưu trữ.
+    """
+    result = into if into is not None else {}
+    low = iso_to_ts(date_from) if date_from else None
+    high = _end_of(date_to) if date_to else None
+    for ride in rides:
+        if ride.get("status") != "completed":
+            continue
+        ts = iso_to_ts(ride.get("created_at"))
+        if (low is not None and not ts >= low) or (high is not None and not ts < high):
+            continue
+        if by == "day":
+            if ts != ts:
+                continue
+            key = datetime.fromtimestamp(ts).date().isoformat()
+        elif by == "driver":
+            key = ride.get("driver_id")
+        elif by == "vehicle_type":
+            key = ride.get("vehicle_type")
+        else:
+            key = district_of((ride.get("pickup") or {}).get("address"))
+        entry = result.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        fare = _float(ride.get("fare"))
+        if fare == fare:
+            entry[1] += fare
+    return result
+
+
+def archive_rides(store, archive, older_than, statuses=FINISHED_STATUSES, batch=500, now=None):
+    """
+    Chuyển các chuyến đã kết thúc có created_at cũ hơn older_than giây từ
+    store sang kho lưu trữ. Chuyến không có created_at (dữ liệu mẫu cũ) không
+    biết tuổi nên được giữ lại trong store. Ghi vào kho trước rồi mới
+    xóa khỏi store: nếu dừng giữa chừng, lần sau append() bỏ qua chuyến đã
+    có và chỉ còn bước xóa. Trả về số chuyến đã chuyển.
+    """
+    cutoff = (now or time.time()) - older_than
+    candidates = []
+    for status in statuses:
+        for ride in store.rides.find("status", status):
+            ts = iso_to_ts(ride.get("created_at"))
+            if ts == ts and ts < cutoff:
+                candidates.append(ride)
+    candidates.sort(key=store.rides.order_key)
+    moved = 0
+    for start in range(0, len(candidates), batch):
+        chunk = [dict(ride) for ride in candidates[start:start + batch]]
+        archive.append(chunk)
+        store.commit([("del", "rides", ride["id"]) for ride in chunk])
+        moved += len(chunk)
+    if moved:
+        logger.info("Đã chuyển %d chuyến đi sang kho lưu trữ", moved)
+    return moved
+
+
+if __name__ == "__main__":
+    from metrics import configure_logging
+    from storage import store
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Chuyển chuyến đi đã kết thúc sang kho lưu trữ dạng cột")
+    parser.add_argument("--older-than-hours", type=float, default=0,
+                        help="chỉ chuyển chuyến tạo trước N giờ (mặc định: mọi chuyến đã kết thúc có created_at)")
+    args = parser.parse_args()
+    store.open()
+    try:
+        moved = archive_rides(store, RideArchive().open(), args.older_than_hours * 3600)
+        # Ghi lại snapshot không còn các chuyến đã chuyển
+        store.compact()
+        print(f"Đã chuyển {moved} chuyến đi")
+    finally:
+        store.close()
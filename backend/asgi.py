@@ -0,0 +1,351 @@
+"""
+Chế độ phục vụ ASGI (asyncio).
+
+Các endpoint chủ yếu là chờ I/O chạy trực tiếp trên event loop, mỗi kết
+nối chỉ tốn một coroutine thay vì giữ một thread:
+  GET  /api/location-suggestions                 gọi Nominatim bất đồng bộ, gộp truy vấn trùng
+  GET  /api/ride/driver-location/<id>/stream     SSE vị trí tài xế của chuyến đi
+  GET  /api/admin/locations/stream               SSE vị trí mọi tài xế
+  POST /api/ride/request                         chờ lô ghép chuyến hoặc tài xế nhận lời mời
+                                                 (khi DISPATCH_MODE=batch/offer)
+  GET  /api/driver/<id>/offers                   long-poll lời mời của tài xế (DISPATCH_MODE=offer)
+Mọi route còn lại được chuyển cho Flask app (app.py) qua cầu nối WSGI chạy
+trong thread pool (WSGI_THREADS luồng mỗi worker).
+
+Chạy production với nhiều tiến trình worker (bắt buộc STORAGE_BACKEND=sqlite):
+  STORAGE_BACKEND=sqlite gunicorn -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:5000 asgi:app
+hoặc
+  STORAGE_BACKEND=sqlite WORKERS=4 HOST=0.0.0.0 PORT=5000 python asgi.py
+
+Store mặc định (memory) giữ dữ liệu trong từng tiến trình và khóa thư mục
+dữ liệu khi mở, nên worker thứ hai không khởi động được; asgi.py từ chối
+WORKERS > 1 khi không dùng sqlite. Vị trí GPS và người theo dõi SSE cũng nằm trong từng
+worker, nên các request gửi vị trí và stream của cùng một tài xế cần được
+định tuyến về cùng worker (sticky session ở load balancer) hoặc chạy phần
+vị trí trên một worker riêng.
+
+Chia theo vùng (geofence.py): mỗi nhóm worker chạy với SHARD_ZONES là các
+vùng/thành phố nó phục vụ và chỉ giữ tài xế của các vùng đó (cùng vùng kề
+để tìm tràn qua biên). Yêu cầu đặt xe có điểm đón ở vùng khác được trả
+307 tới worker phụ trách theo SHARD_ROUTES; GET /api/shards/locate cho
+load balancer biết trước vùng của một điểm.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as flask_module
+from locations import ALL_DRIVERS, driver_topic, sse_stream_async
+from metrics import HTTP_LATENCY
+from offers import OfferDispatcher
+from utils import dumps
+
+logger = logging.getLogger(__name__)
+
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+_END = object()
+
+# Giống flask_cors mặc định: cho phép mọi origin
+_CORS = [(b"access-control-allow-origin", b"*")]
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode())] + _CORS + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_sse(send, receive, stream):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no")] + _CORS,
+    })
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnected = asyncio.ensure_future(watch_disconnect())
+    try:
+        async for chunk in stream:
+            if disconnected.done():
+                break
+            await send({"type": "http.response.body", "body": chunk.encode("utf-8"), "more_body": True})
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+        await stream.aclose()
+
+
+# ---------------------------------------------------------------------------
+# Các endpoint chạy trên event loop
+# ---------------------------------------------------------------------------
+
+async def location_suggestions(scope, receive, send, params):
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("q", [""])[0]
+    if not query:
+        return await _send_json(send, [])
+    try:
+        return await _send_json(send, await flask_module.geocoder.search_async(query))
+    except Exception:
+        logger.exception("Error fetching location suggestions")
+        return await _send_json(send, {"error": "Failed to fetch location suggestions"}, 500)
+
+
+async def stream_driver_location(scope, receive, send, params):
+    ride_id = int(params["ride_id"])
+    driver, initial, error = flask_module._ride_stream_driver(ride_id)
+    if error:
+        return await _send_json(send, {"error": error}, 404)
+    subscription = flask_module.location_hub.subscribe(
+        driver_topic(driver["id"]), min_interval=flask_module.LOCATION_MIN_INTERVAL,
+        loop=asyncio.get_running_loop())
+    await _send_sse(send, receive, sse_stream_async(subscription, initial, extra={"ride_id": ride_id}))
+
+
+async def stream_all_locations(scope, receive, send, params):
+    subscription = flask_module.location_hub.subscribe(
+        ALL_DRIVERS, min_interval=flask_module.ADMIN_LOCATION_MIN_INTERVAL, loop=asyncio.get_running_loop())
+    await _send_sse(send, receive, sse_stream_async(subscription))
+
+
+async def request_ride(scope, receive, send, params):
+    try:
+        data = json.loads(await _read_body(receive) or b"null")
+        try:
+            misrouted = flask_module._misrouted(data["pickup"])
+        except (KeyError, TypeError, ValueError) as e:
+            return await _send_json(send, {"message": f"Điểm đón không hợp lệ: {str(e)}"}, 400)
+        if misrouted:
+            payload, status, target = misrouted
+            query = scope.get("query_string", b"")
+            location = target + scope["path"] + ("?" + query.decode("latin-1") if query else "")
+            return await _send_json(send, payload, status,
+                                    [(b"location", location.encode("latin-1"))] if target else ())
+        try:
+            ride, quote = flask_module._new_ride(data)
+        except ValueError as e:
+            return await _send_json(send, {"message": str(e)}, 400)
+        match = await flask_module.dispatcher.submit_async(data["pickup"], data["vehicle_type"], ride=ride)
+        payload, status = flask_module._match_response(
+            ride, quote, match["driver"] if match else None, match["dispatch"] if match else None)
+        return await _send_json(send, payload, status)
+    except Exception as e:
+        logger.exception("Error in request_ride")
+        return await _send_json(send, {"message": f"Lỗi hệ thống: {str(e)}"}, 500)
+
+
+async def driver_offers(scope, receive, send, params):
+    driver_id = int(params["driver_id"])
+    if flask_module.store.drivers.get(driver_id) is None:
+        return await _send_json(send, {"error": "Không tìm thấy tài xế"}, 404)
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    try:
+        wait = min(max(float(query.get("wait", ["25"])[0]), 0), 60)
+    except ValueError:
+        wait = 25
+    offers = await flask_module.dispatcher.wait_async(driver_id, timeout=wait)
+    return await _send_json(send, {"offers": offers})
+
+
+def _offer_mode():
+    return isinstance(flask_module.dispatcher, OfferDispatcher)
+
+
+# (method, route, handler, điều kiện bật); route không bật được chuyển cho Flask
+ROUTES = [
+    ("GET", "/api/location-suggestions", location_suggestions, None),
+    ("GET", "/api/ride/driver-location/<int:ride_id>/stream", stream_driver_location, None),
+    ("GET", "/api/admin/locations/stream", stream_all_locations, None),
+    # Ghép tham lam không chờ I/O nên chỉ xử lý ở đây khi chạy DISPATCH_MODE=batch/offer
+    ("POST", "/api/ride/request", request_ride, lambda: flask_module.dispatcher is not None),
+    ("GET", "/api/driver/<int:driver_id>/offers", driver_offers, _offer_mode),
+]
+_COMPILED = [
+    (method, rule, re.compile("^" + re.sub(r"<int:(\w+)>", r"(?P<\1>\\d+)", rule) + "$"), handler, enabled)
+    for method, rule, handler, enabled in ROUTES
+]
+
+
+# ---------------------------------------------------------------------------
+# Cầu nối WSGI cho các route còn lại
+# ---------------------------------------------------------------------------
+
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI yêu cầu path dạng byte giải mã latin-1
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key == "CONTENT_LENGTH":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            key = "HTTP_" + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def call_wsgi(scope, receive, send, wsgi_app=None):
+    """
+    Chạy Flask app trong thread pool; body được đẩy về theo từng đoạn qua
+    hàng đợi có giới hạn nên response dạng stream (NDJSON) không bị dồn
+    hết vào bộ nhớ khi client đọc chậm.
+    """
+    wsgi_app = wsgi_app or flask_module.app
+    body = await _read_body(receive)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=8)
+    aborted = threading.Event()
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        return lambda data: None
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def run():
+        result = None
+        try:
+            result = wsgi_app(_environ(scope, body), start_response)
+            for chunk in result:
+                if aborted.is_set():
+                    break
+                if chunk:
+                    put(chunk)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            put(_END)
+
+    loop.run_in_executor(_executor, run)
+    started = False
+    try:
+        while True:
+            item = await queue.get()
+            if isinstance(item, BaseException):
+                raise item
+            if not started:
+                await send({"type": "http.response.start", "status": response["status"],
+                            "headers": response["headers"]})
+                started = True
+            if item is _END:
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({"type": "http.response.body", "body": item, "more_body": True})
+    except BaseException:
+        # Client ngắt kết nối: dừng vòng lặp WSGI và nhận nốt các đoạn còn lại để thread kết thúc
+        aborted.set()
+
+        async def drain():
+            while (await queue.get()) is not _END:
+                pass
+
+        asyncio.ensure_future(drain())
+        raise
+
+
+# ---------------------------------------------------------------------------
+# Ứng dụng ASGI
+# ---------------------------------------------------------------------------
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await flask_module.geocoder.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    for method, rule, pattern, handler, enabled in _COMPILED:
+        if scope["method"] == method and (enabled is None or enabled()):
+            match = pattern.match(scope["path"])
+            if match:
+                started = time.perf_counter()
+
+                async def send_recorded(message):
+                    # Độ trễ tính tới lúc gửi header (giống after_request bên Flask)
+                    if message["type"] == "http.response.start":
+                        HTTP_LATENCY.observe(time.perf_counter() - started,
+                                             method=method, route=rule, status=message["status"])
+                    await send(message)
+
+                return await handler(scope, receive, send_recorded, match.groupdict())
+    return await call_wsgi(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    workers = int(os.environ.get("WORKERS", "1"))
+    if workers > 1 and flask_module.STORAGE_BACKEND != "sqlite":
+        # Store trong bộ nhớ ghi wal.log/snapshot của tiến trình: các worker sẽ xóa log của nhau
+        sys.exit("WORKERS > 1 cần STORAGE_BACKEND=sqlite")
+    uvicorn.run(
+        "asgi:app",
+        host=os.environ.get("HOST", "127.0.0.1"),
+        port=int(os.environ.get("PORT", "5000")),
+        workers=workers,
+        log_level=os.environ.get("LOG_LEVEL", "info").lower(),
+    )
@@ -0,0 +1,582 @@
+"""
+Benchmark và load test cho vòng đời chuyến đi.
+
+Sinh một thành phố giả lập (tài xế, khách hàng, lịch sử chuyến đi) vào thư
+mục tạm rồi chạy:
+  micro   - đo find_closest_driver (quét, chỉ mục, chỉ mục chia vùng),
+            geofence.locate, calculate_distance, load_data/save_data,
+            read_snapshot/write_snapshot
+  inproc  - vòng đời đăng ký → đăng nhập → đặt xe → gửi vị trí → hoàn thành/hủy
+            → các trang admin qua Flask test client (cùng tiến trình)
+  server  - cùng kịch bản qua HTTP tới server thật (gunicorn, thiếu gunicorn
+            thì server của Flask với một worker)
+  all     - cả ba
+
+Ví dụ:
+  python benchmark.py all --drivers 2000 --rides 20000 --json bench.json
+  python benchmark.py inproc --users 100 --concurrency 16 --compare bench.json
+
+Kết quả (--json) có thể dùng làm mốc so sánh giữa các commit (--compare).
+Store trong bộ nhớ chỉ mở được bởi một tiến trình nên --workers > 1 chạy
+server với STORAGE_BACKEND=sqlite (dữ liệu giả lập được chuyển sang SQLite
+trước khi khởi động). gunicorn, requests và các gói tùy chọn khác nằm trong
+requirements-optional.txt.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from math import cos, radians, sqrt
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STREETS = [
+    "Phố Duy Tân", "Đường Láng", "Phố Huế", "Đường Giải Phóng", "Phố Kim Mã",
+    "Đường Nguyễn Trãi", "Phố Tràng Tiền", "Đường Cầu Giấy", "Phố Bà Triệu",
+    "Đường Lê Văn Lương", "Phố Hàng Bài", "Đường Phạm Văn Đồng",
+]
+DISTRICTS = [
+    "Quận Cầu Giấy", "Quận Đống Đa", "Quận Hai Bà Trưng", "Quận Hoàn Kiếm",
+    "Quận Ba Đình", "Quận Thanh Xuân", "Quận Nam Từ Liêm", "Quận Tây Hồ",
+]
+VEHICLES = {"bike": "Honda Wave", "car": "Toyota Vios", "van": "Toyota Innova"}
+
+
+# ---------------------------------------------------------------------------
+# Dữ liệu giả lập
+# ---------------------------------------------------------------------------
+
+class City:
+    """Sinh điểm ngẫu nhiên (có địa chỉ) trong phạm vi radius_km quanh tâm thành phố."""
+
+    def __init__(self, rng, center=(21.0285, 105.8342), radius_km=10.0):
+        self.rng = rng
+        self.center = center
+        self.radius_lat = radius_km / 111.195
+        self.radius_lng = radius_km / (111.195 * cos(radians(center[0])))
+
+    def point(self, address=True):
+        lat = self.center[0] + self.rng.uniform(-self.radius_lat, self.radius_lat)
+        lng = self.center[1] + self.rng.uniform(-self.radius_lng, self.radius_lng)
+        location = {"lat": round(lat, 6), "lng": round(lng, 6)}
+        if address:
+            location["address"] = (f"{self.rng.randint(1, 300)} {self.rng.choice(STREETS)}, "
+                                   f"{self.rng.choice(DISTRICTS)}, Thành phố Hà Nội, Việt Nam")
+        return location
+
+    def near(self, location, km=0.3):
+        """Một điểm lệch ngẫu nhiên tối đa km quanh location (mô phỏng tài xế di chuyển)."""
+        return {
+            "lat": round(location["lat"] + self.rng.uniform(-km, km) / 111.195, 6),
+            "lng": round(location["lng"] + self.rng.uniform(-km, km) / 111.195, 6),
+        }
+
+
+def _straight_km(a, b):
+    dy = (a["lat"] - b["lat"]) * 111.195
+    dx = (a["lng"] - b["lng"]) * 111.195 * cos(radians(a["lat"]))
+    return sqrt(dx * dx + dy * dy)
+
+
+def generate_city(data_dir, drivers=500, customers=1000, rides=5000, seed=42):
+    """Ghi customers.json, drivers.json, rides.json và id_tracker.json vào data_dir."""
+    rng = random.Random(seed)
+    city = City(rng)
+    os.makedirs(data_dir, exist_ok=True)
+
+    customer_list = [
+        {"id": i, "name": f"Khách hàng {i}", "phone": f"09{i:08d}",
+         "email": f"customer{i}@bench.local", "password": "bench"}
+        for i in range(1, customers + 1)
+    ]
+    driver_list = []
+    for i in range(1, drivers + 1):
+        vehicle_type = rng.choice(list(VEHICLES))
+        driver_list.append({
+            "id": i, "name": f"Tài xế {i}", "phone": f"08{i:08d}",
+            "email": f"driver{i}@bench.local", "password": "bench",
+            "vehicle_type": vehicle_type,
+            "vehicle_info": f"{VEHICLES[vehicle_type]} - 29A-{i:05d}",
+            "rating": round(rng.uniform(4.0, 5.0), 1),
+            "total_rides": 0, "status": "available", "available": True,
+            "current_location": city.point(address=False),
+        })
+    ride_list = []
+    started = datetime.now() - timedelta(days=90)
+    for i in range(1, rides + 1):
+        pickup, dropoff = city.point(), city.point()
+        distance_m = _straight_km(pickup, dropoff) * 1300
+        vehicle_type = rng.choice(list(VEHICLES))
+        price = round(15000 + distance_m / 1000 * 8000)
+        ride_list.append({
+            "id": i, "customer_id": rng.randint(1, max(customers, 1)),
+            "driver_id": rng.randint(1, max(drivers, 1)),
+            "pickup": pickup, "dropoff": dropoff, "vehicle_type": vehicle_type,
+            "estimated_price": price, "estimated_distance": round(distance_m, 1),
+            "estimated_duration": round(distance_m / rng.uniform(5, 11), 1),
+            "status": "completed" if rng.random() < 0.8 else "cancelled",
+            "fare": price,
+            "created_at": (started + timedelta(seconds=i * 90 * 86400 // max(rides, 1))).isoformat(timespec="seconds"),
+        })
+
+    files = {
+        "customers.json": customer_list,
+        "drivers.json": {"drivers": driver_list},
+        "rides.json": ride_list,
+        "id_tracker.json": {"customer_id": customers + 1, "driver_id": drivers + 1, "ride_id": rides + 1},
+    }
+    for filename, data in files.items():
+        with open(os.path.join(data_dir, filename), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+    # snapshot.bin/wal.log của lần chạy trước sẽ che các file JSON vừa sinh
+    for filename in ("snapshot.bin", "wal.log"):
+        path = os.path.join(data_dir, filename)
+        if os.path.exists(path):
+            os.remove(path)
+    return {"city": city, "customers": customer_list, "drivers": driver_list, "rides": ride_list}
+
+
+# ---------------------------------------------------------------------------
+# Ghi nhận và tổng hợp kết quả
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def rss_kb(pid=None):
+    """RSS (KB) của tiến trình pid cùng các tiến trình con; None nếu không đọc được /proc."""
+    pid = pid or os.getpid()
+    try:
+        pids = [pid]
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+        total = 0
+        for p in pids:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        return total
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Recorder:
+    """Độ trễ, lỗi và (tùy chọn) bộ nhớ cấp phát đỉnh theo từng endpoint."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.memory = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok, peak_bytes=None):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            if peak_bytes is not None:
+                self.memory.setdefault(endpoint, []).append(peak_bytes)
+
+    def summary(self, wall_seconds):
+        result = {}
+        for endpoint, values in sorted(self.samples.items()):
+            values = sorted(values)
+            row = {
+                "count": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+                "mean_ms": round(sum(values) / len(values) * 1000, 3),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+            if endpoint in self.memory:
+                peaks = self.memory[endpoint]
+                row["mem_peak_kb"] = round(sum(peaks) / len(peaks) / 1024, 1)
+            result[endpoint] = row
+        return result
+
+
+class InProcessClient:
+    """Gọi app qua Flask test client; trace_memory đo bộ nhớ cấp phát đỉnh mỗi request."""
+
+    def __init__(self, app, recorder, trace_memory=False):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.trace_memory = trace_memory
+
+    def call(self, endpoint, method, path, body=None):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, json=body)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - baseline if self.trace_memory else None
+        self.recorder.record(endpoint, elapsed, response.status_code < 500, peak)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Gọi server thật qua HTTP với session giữ kết nối."""
+
+    def __init__(self, base_url, recorder):
+        import requests
+        self.base_url = base_url
+        self.recorder = recorder
+        self.session = requests.Session()
+
+    def call(self, endpoint, method, path, body=None):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, json=body, timeout=30)
+        except Exception:
+            self.recorder.record(endpoint, time.perf_counter() - started, False)
+            return 0, None
+        self.recorder.record(endpoint, time.perf_counter() - started, response.status_code < 500)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+# ---------------------------------------------------------------------------
+# Kịch bản vòng đời chuyến đi
+# ---------------------------------------------------------------------------
+
+def run_lifecycle(client, user_no, iterations, rng, pings=5, cancel_ratio=0.2):
+    """Một người dùng ảo: đăng ký, đăng nhập, đặt iterations chuyến, rồi xem các trang admin."""
+    city = City(rng)
+    tag = f"{os.getpid()}{user_no:05d}{rng.randrange(10 ** 6):06d}"
+    email = f"user{tag}@bench.local"
+    _, body = client.call("register_customer", "POST", "/api/register/customer", {
+        "name": f"Người dùng {user_no}", "phone": f"07{tag}", "email": email, "password": "bench"
+    })
+    customer_id = (body or {}).get("id")
+    client.call("login_customer", "POST", "/api/login/customer", {"identifier": email, "password": "bench"})
+
+    if user_no % 10 == 0:
+        driver_email = f"driver{tag}@bench.local"
+        client.call("register_driver", "POST", "/api/register/driver", {
+            "name": f"Tài xế mới {user_no}", "phone": f"06{tag}", "email": driver_email,
+            "password": "bench", "vehicle_info": "Honda Vision", "vehicle_type": "bike"
+        })
+        client.call("login_driver", "POST", "/api/login/driver", {"identifier": driver_email, "password": "bench"})
+
+    for _ in range(iterations):
+        pickup, dropoff = city.point(), city.point()
+        vehicle_type = rng.choice(list(VEHICLES))
+        client.call("quote", "POST", "/api/quote", {"pickup": pickup, "dropoff": dropoff})
+        client.call("location_suggestions", "GET",
+                    f"/api/location-suggestions?q={rng.choice(STREETS)}")
+        status, body = client.call("request_ride", "POST", "/api/ride/request", {
+            "pickup": pickup, "dropoff": dropoff, "vehicle_type": vehicle_type, "customer_id": customer_id
+        })
+        if status != 200 or not body:
+            continue
+        ride_id, driver_id = body["ride_id"], body["driver"]["id"]
+        position = pickup
+        for _ in range(pings):
+            position = city.near(position)
+            client.call("driver_location", "POST", f"/api/driver/{driver_id}/location",
+                        dict(position, ts=time.time()))
+            client.call("ride_driver_location", "GET", f"/api/ride/driver-location/{ride_id}")
+        if rng.random() < cancel_ratio:
+            client.call("cancel_ride", "POST", f"/api/ride/cancel/{ride_id}")
+        else:
+            client.call("complete_ride", "POST", f"/api/ride/complete/{ride_id}")
+        client.call("driver_details", "GET", f"/api/driver/{driver_id}/details")
+
+    if customer_id is not None:
+        client.call("ride_history", "GET", f"/api/ride/history/{customer_id}?limit=20")
+    client.call("admin_active_rides", "GET", "/api/admin/rides/active?limit=50")
+    client.call("admin_ride_history", "GET", "/api/admin/rides/history?limit=50")
+    client.call("admin_drivers", "GET", "/api/admin/drivers")
+    client.call("admin_heatmap", "GET", "/api/admin/heatmap")
+
+
+def run_load(make_client, users, iterations, concurrency, seed, pings=5):
+    """Chạy users người dùng ảo trên concurrency thread; trả về thời gian tường (giây)."""
+    def worker(user_no):
+        run_lifecycle(make_client(), user_no, iterations, random.Random(seed * 100003 + user_no), pings)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, n) for n in range(users)]:
+            future.result()
+    return time.perf_counter() - started
+
+
+def bench_inproc(args):
+    # app được import sau khi SMART_RIDE_DATA_DIR trỏ tới dữ liệu giả lập
+    from app import app
+    recorder = Recorder()
+    if args.trace_memory:
+        tracemalloc.start()
+    wall = run_load(lambda: InProcessClient(app, recorder, args.trace_memory),
+                    args.users, args.iterations, args.concurrency, args.seed, args.pings)
+    if args.trace_memory:
+        tracemalloc.stop()
+    return {"wall_s": round(wall, 3), "rss_kb": rss_kb(), "endpoints": recorder.summary(wall)}
+
+
+def server_command(port, workers, threads):
+    """Lệnh khởi động server mặc định: gunicorn, hoặc server của Flask nếu chỉ một worker."""
+    if importlib.util.find_spec("gunicorn") is not None:
+        return [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                "-b", f"127.0.0.1:{port}", "app:app"]
+    if workers > 1:
+        raise RuntimeError("Chạy nhiều worker cần gunicorn (pip install -r requirements-optional.txt)")
+    return [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(port),
+            "--no-reload", "--no-debugger", "--with-threads"]
+
+
+def start_server(data_dir, port, workers, threads, command=None, timeout=30):
+    import requests
+    command = command or server_command(port, workers, threads)
+    env = dict(os.environ, SMART_RIDE_DATA_DIR=data_dir, LOG_LEVEL="WARNING")
+    if workers > 1:
+        # Các worker dùng chung một CSDL; chuyển dữ liệu giả lập một lần ở đây
+        # thay vì để từng worker cùng chuyển khi khởi động
+        env["STORAGE_BACKEND"] = "sqlite"
+        if not os.path.exists(os.path.join(data_dir, "smartride.db")):
+            subprocess.run([sys.executable, "sqlite_store.py", "--data-dir", data_dir], cwd=BACKEND_DIR, env=env,
+                           stdout=subprocess.DEVNULL, check=True)
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server dừng khi khởi động: {process.stderr.read().decode(errors='replace')}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server không phản hồi sau thời gian chờ")
+
+
+def bench_server(args, data_dir):
+    command = args.server_cmd.split() if args.server_cmd else None
+    process = start_server(data_dir, args.port, args.workers, args.threads, command)
+    try:
+        rss_before = rss_kb(process.pid)
+        recorder = Recorder()
+        base_url = f"http://127.0.0.1:{args.port}"
+        wall = run_load(lambda: HttpClient(base_url, recorder),
+                        args.users, args.iterations, args.concurrency, args.seed, args.pings)
+        return {
+            "wall_s": round(wall, 3),
+            "workers": args.workers,
+            "threads": args.threads,
+            "storage": "sqlite" if args.workers > 1 else os.environ.get("STORAGE_BACKEND", "memory"),
+            "server_rss_kb": {"before": rss_before, "after": rss_kb(process.pid)},
+            "endpoints": recorder.summary(wall),
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# ---------------------------------------------------------------------------
+# Microbenchmark
+# ---------------------------------------------------------------------------
+
+def _measure(fn, repeat=5, min_time=0.2):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = sorted(t / number for t in timer.repeat(repeat=repeat, number=number))
+    return {"best_us": round(runs[0] * 1e6, 3), "median_us": round(runs[len(runs) // 2] * 1e6, 3),
+            "loops": number}
+
+
+def bench_micro(dataset, data_dir, seed=42):
+    from models import RideMatchingService
+    from geofence import Geofence, ShardedDriverIndex
+    from snapshot import read_snapshot, write_snapshot
+    from spatial import DriverIndex
+    from utils import load_data, save_data
+
+    rng = random.Random(seed)
+    city = City(rng)
+    drivers = dataset["drivers"]
+    pickups = [city.point(address=False) for _ in range(256)]
+    pairs = [(p["lat"], p["lng"], q["lat"], q["lng"]) for p, q in zip(pickups, reversed(pickups))]
+    index = DriverIndex()
+    index.rebuild(drivers)
+    geofence = Geofence.load()
+    sharded = ShardedDriverIndex(geofence)
+    sharded.rebuild(drivers)
+    rides_path = os.path.join(data_dir, "rides.json")
+    save_path = os.path.join(data_dir, "bench_save.json")
+    snapshot_path = os.path.join(data_dir, "bench_snapshot.bin")
+    rides = load_data(rides_path)
+    write_snapshot(snapshot_path, {"rides": rides})
+    counter = iter(range(1 << 62))
+
+    def cycle(items):
+        return items[next(counter) % len(items)]
+
+    cases = {
+        "calculate_distance": lambda: RideMatchingService.calculate_distance(*cycle(pairs)),
+        "find_closest_driver.scan": lambda: RideMatchingService.find_closest_driver(drivers, cycle(pickups)),
+        "find_closest_driver.index": lambda: RideMatchingService.find_closest_driver(
+            drivers, cycle(pickups), index=index),
+        "find_closest_driver.sharded": lambda: RideMatchingService.find_closest_driver(
+            drivers, cycle(pickups), index=sharded),
+        "geofence.locate": lambda: geofence.locate(*cycle(pairs)[:2]),
+        "load_data.rides": lambda: load_data(rides_path),
+        "save_data.rides": lambda: save_data(save_path, rides),
+        "read_snapshot.rides": lambda: read_snapshot(snapshot_path),
+        "write_snapshot.rides": lambda: write_snapshot(snapshot_path, {"rides": rides}),
+    }
+    results = {name: _measure(fn) for name, fn in cases.items()}
+    os.remove(save_path)
+    os.remove(snapshot_path)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Báo cáo và so sánh
+# ---------------------------------------------------------------------------
+
+def print_report(results):
+    meta = results["meta"]
+    print(f"# commit {meta.get('commit') or '?'}  python {meta['python']}  {meta['dataset']}")
+    if "micro" in results:
+        print("\n## micro (µs/lần)")
+        for name, row in results["micro"].items():
+            print(f"  {name:<28} best {row['best_us']:>12.3f}  median {row['median_us']:>12.3f}")
+    for section in ("inproc", "server"):
+        if section not in results:
+            continue
+        data = results[section]
+        print(f"\n## {section}: {data['wall_s']} s, RSS {data.get('rss_kb') or data.get('server_rss_kb')}")
+        print(f"  {'endpoint':<22}{'n':>7}{'err':>5}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'memKB':>8}")
+        for name, row in data["endpoints"].items():
+            print(f"  {name:<22}{row['count']:>7}{row['errors']:>5}{row['throughput_rps']:>9.1f}"
+                  f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+                  f"{row.get('mem_peak_kb', ''):>8}")
+
+
+def compare(results, baseline, threshold=0.10):
+    """In chênh lệch so với baseline; trả về danh sách các chỉ số chậm hơn ngưỡng."""
+    regressions = []
+    rows = []
+    for name, row in results.get("micro", {}).items():
+        old = baseline.get("micro", {}).get(name)
+        if old:
+            rows.append((f"micro/{name}", old["median_us"], row["median_us"]))
+    for section in ("inproc", "server"):
+        for name, row in results.get(section, {}).get("endpoints", {}).items():
+            old = baseline.get(section, {}).get("endpoints", {}).get(name)
+            if old:
+                rows.append((f"{section}/{name} p95", old["p95_ms"], row["p95_ms"]))
+    print(f"\n## so với {baseline['meta'].get('commit') or 'baseline'}")
+    for label, old, new in rows:
+        change = (new - old) / old if old else 0.0
+        flag = "  <-- chậm hơn" if change > threshold else ""
+        print(f"  {label:<40}{old:>12.3f}{new:>12.3f}{change:>+9.1%}{flag}")
+        if change > threshold:
+            regressions.append(label)
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark vòng đời chuyến đi của SmartRide")
+    parser.add_argument("mode", choices=["micro", "inproc", "server", "all"])
+    parser.add_argument("--drivers", type=int, default=500)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--rides", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=int, default=50, help="số người dùng ảo")
+    parser.add_argument("--iterations", type=int, default=3, help="số chuyến mỗi người dùng")
+    parser.add_argument("--pings", type=int, default=5, help="số lần gửi vị trí mỗi chuyến")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="đo bộ nhớ cấp phát đỉnh mỗi endpoint (inproc, chính xác nhất với --concurrency 1)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="số worker của server (> 1 thì dùng STORAGE_BACKEND=sqlite)")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--server-cmd", help="lệnh khởi động server thay cho gunicorn mặc định")
+    parser.add_argument("--data-dir", help="giữ dữ liệu giả lập tại đây thay vì thư mục tạm")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    parser.add_argument("--compare", help="file JSON kết quả trước đó để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="smartride-bench-")
+    try:
+        dataset = generate_city(data_dir, args.drivers, args.customers, args.rides, args.seed)
+        # Phải đặt trước khi import các module backend (utils đọc DATA_DIR khi import)
+        os.environ["SMART_RIDE_DATA_DIR"] = data_dir
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        results = {"meta": {
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "dataset": f"{args.drivers} tài xế, {args.customers} khách, {args.rides} chuyến (seed {args.seed})",
+            "args": vars(args),
+        }}
+        if args.mode in ("micro", "all"):
+            results["micro"] = bench_micro(dataset, data_dir, args.seed)
+        if args.mode in ("server", "all"):
+            # Chạy server trước khi store trong tiến trình này ghi đè dữ liệu giả lập
+            server_dir = tempfile.mkdtemp(prefix="smartride-server-")
+            shutil.copytree(data_dir, server_dir, dirs_exist_ok=True)
+            try:
+                results["server"] = bench_server(args, server_dir)
+            finally:
+                shutil.rmtree(server_dir, ignore_errors=True)
+        if args.mode in ("inproc", "all"):
+            results["inproc"] = bench_inproc(args)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
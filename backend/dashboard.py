@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from collections import deque
+
+from utils import dumps
+
+
+class DashboardSnapshot:
+    """
+    Ảnh chụp dữ liệu cho trang quản trị: mọi chuyến đi (kèm tên tài xế/khách
+    hàng) và mọi tài xế (kèm thống kê), giữ sẵn trong bộ nhớ.
+
+    Listener của store chỉ đánh dấu bản ghi bị thay đổi và tăng version;
+    lần đọc tiếp theo mới dựng lại đúng các mục đó (và các mục phụ thuộc:
+    thống kê của tài xế khi chuyến đi đổi, tên trên chuyến đi khi tài xế
+    hoặc khách hàng đổi tên). Mỗi mục nhớ version thay đổi gần nhất trong
+    một log có giới hạn để trả delta kể từ một version cho trước.
+
+    version chỉ có nghĩa trong một tiến trình; epoch phân biệt các tiến
+    trình/lần khởi động để client không dùng nhầm version của worker khác.
+    """
+
+    def __init__(self, store, decorate_ride, decorate_driver, driver_stats, log_size=10000):
+        self.store = store
+        self.decorate_ride = decorate_ride
+        self.decorate_driver = decorate_driver
+        self.driver_stats = driver_stats
+        self.epoch = f"{os.getpid():x}.{int(time.time()):x}"
+        self.version = 0
+        self._built_version = -1
+        self._dirty = {"rides": set(), "drivers": set(), "customers": set()}
+        self._dirty_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._rides = {}
+        self._drivers = {}
+        # (version, kind, id) theo thứ tự tăng dần; _floor: các thay đổi có
+        # version <= _floor có thể đã bị cắt khỏi log
+        self._log = deque()
+        self._log_size = log_size
+        self._floor = 0
+        self._body = None
+
+    def record_change(self, name, record):
+        """Listener của store: ghi nhận bản ghi thay đổi, việc dựng lại để tới lần đọc sau."""
+        self.record_removed(name, record["id"])
+
+    def record_removed(self, name, record_id):
+        """Listener on_remove của store: bản ghi bị xóa (chuyến đi được lưu trữ) cũng là một thay đổi."""
+        with self._dirty_lock:
+            dirty = self._dirty.get(name)
+            if dirty is not None:
+                dirty.add(record_id)
+                self.version += 1
+
+    def etag(self, version):
+        return f'"{self.epoch}-{version}"'
+
+    def _build_all(self, version):
+        summaries = self.driver_stats.summaries()
+        self._rides = {ride["id"]: self.decorate_ride(ride) for ride in self.store.rides}
+        self._drivers = {
+            driver["id"]: self.decorate_driver(driver, summaries.get(driver["id"]))
+            for driver in self.store.drivers
+        }
+        self._log.clear()
+        self._floor = version
+
+    def _refresh_ride(self, ride_id, changed):
+        ride = self.store.rides.get(ride_id)
+        old = self._rides.get(ride_id)
+        if ride is None:
+            # Đã chuyển sang kho lưu trữ: bỏ khỏi ảnh chụp như khi khởi động lại
+            if old is None:
+                return
+            del self._rides[ride_id]
+            changed.append(("ride", ride_id))
+            return {old["driver_id"]} if old.get("driver_id") is not None else None
+        self._rides[ride_id] = self.decorate_ride(ride)
+        changed.append(("ride", ride_id))
+        # Thống kê (số chuyến, đánh giá) của tài xế cũ và mới đều có thể đổi
+        return {d for d in (old and old.get("driver_id"), ride.get("driver_id")) if d is not None}
+
+    def _refresh_driver(self, driver_id, changed):
+        driver = self.store.drivers.get(driver_id)
+        if driver is None:
+            return False
+        old = self._drivers.get(driver_id)
+        entry = self.decorate_driver(driver, self.driver_stats.summary(driver_id))
+        self._drivers[driver_id] = entry
+        changed.append(("driver", driver_id))
+        # Tên/loại xe hiển thị trên các chuyến đi của tài xế
+        return old is not None and (old.get("name"), old.get("vehicle_type")) != \
+            (entry.get("name"), entry.get("vehicle_type"))
+
+    def refresh(self):
+        """Dựng lại các mục đã thay đổi (không làm gì nếu version chưa đổi); trả về version đã dựng."""
+        if self._built_version == self.version:
+            return self._built_version
+        with self._build_lock:
+            with self._dirty_lock:
+                version = self.version
+                dirty = self._dirty
+                self._dirty = {name: set() for name in dirty}
+            if self._built_version < 0:
+                self._build_all(version)
+            else:
+                changed = []
+                rides = set(dirty["rides"])
+                for customer_id in dirty["customers"]:
+                    rides.update(r["id"] for r in self.store.rides.find("customer_id", customer_id))
+                drivers = set(dirty["drivers"])
+                for ride_id in rides:
+                    drivers |= self._refresh_ride(ride_id, changed) or set()
+                renamed = [d for d in drivers if self._refresh_driver(d, changed)]
+                for driver_id in renamed:
+                    for ride in self.store.rides.find("driver_id", driver_id):
+                        if ride["id"] not in rides:
+                            self._refresh_ride(ride["id"], changed)
+                for kind, item_id in changed:
+                    self._log.append((version, kind, item_id))
+                while len(self._log) > self._log_size:
+                    self._floor = self._log.popleft()[0]
+            self._body = None
+            self._built_version = version
+            return version
+
+    def snapshot(self):
+        """(version, toàn bộ dữ liệu dạng JSON bytes); phần JSON được cache tới khi version đổi."""
+        self.refresh()
+        with self._build_lock:
+            if self._body is None:
+                rides = sorted(self._rides.values(),
+                               key=lambda r: (r.get("created_at") or "", r["id"]), reverse=True)
+                self._body = (self._built_version, dumps({
+                    "version": self._built_version,
+                    "epoch": self.epoch,
+                    "full": True,
+                    "rides": rides,
+                    "drivers": list(self._drivers.values()),
+                }).encode("utf-8"))
+            return self._body
+
+    def delta(self, since, epoch=None):
+        """
+        Các chuyến đi và tài xế thay đổi sau version since. Trả về None nếu
+        không thể tính delta (khác epoch hoặc log đã bị cắt) - khi đó client
+        cần lấy lại toàn bộ snapshot.
+        """
+        self.refresh()
+        with self._build_lock:
+            if (epoch is not None and epoch != self.epoch) or since < self._floor \
+                    or since > self._built_version:
+                return None
+            rides, drivers, removed = {}, {}, set()
+            for version, kind, item_id in reversed(self._log):
+                if version <= since:
+                    break
+                if kind == "driver":
+                    drivers.setdefault(item_id, self._drivers[item_id])
+                elif item_id not in rides and item_id not in removed:
+                    ride = self._rides.get(item_id)
+                    if ride is None:
+                        removed.add(item_id)
+                    else:
+                        rides[item_id] = ride
+            return {
+                "version": self._built_version,
+                "epoch": self.epoch,
+                "full": False,
+                "since": since,
+                "rides": list(rides.values()),
+                "removed_rides": sorted(removed),
+                "drivers": list(drivers.values()),
+            }
@@ -0,0 +1,134 @@
+import threading
+import time
+from array import array
+
+
+class _CellCounters:
+    """Bộ đếm cố định của một ô: số yêu cầu theo từng khoảng bucket_seconds (ring) và số tài xế rảnh."""
+
+    __slots__ = ("counts", "stamps", "supply")
+
+    def __init__(self, buckets):
+        self.counts = array("I", bytes(4 * buckets))
+        self.stamps = array("q", [-1] * buckets)
+        self.supply = 0
+
+    def demand(self, epoch):
+        # Chỉ cộng các bucket còn nằm trong cửa sổ trượt
+        oldest = epoch - len(self.counts) + 1
+        return sum(c for c, s in zip(self.counts, self.stamps) if s >= oldest)
+
+
+class DemandGrid:
+    """
+    Cung/cầu theo ô lưới trên cửa sổ thời gian trượt.
+    Cầu: số yêu cầu đặt xe trong window giây gần nhất, đếm trong ring các
+    bucket cố định nên không phải quét lại lịch sử. Cung: số tài xế rảnh
+    hiện có trong ô, cập nhật theo từng lần tài xế đổi vị trí/trạng thái.
+    Hệ số surge của từng ô được tính sẵn khi có thay đổi, đọc trong O(1).
+    """
+
+    def __init__(self, cell_size=0.01, window=600, bucket_seconds=60,
+                 sensitivity=0.5, max_surge=2.5, clock=time.time):
+        self.cell_size = cell_size
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(1, int(window // bucket_seconds))
+        self.window = self.buckets * bucket_seconds
+        self.sensitivity = sensitivity
+        self.max_surge = max_surge
+        self.clock = clock
+        self._cells = {}
+        self._surge = {}
+        self._drivers = {}  # driver_id -> ô đang được tính là cung
+        self._epoch = self._now_epoch()
+        self._lock = threading.Lock()
+
+    def cell(self, lat, lng):
+        return (int(lat // self.cell_size), int(lng // self.cell_size))
+
+    def _now_epoch(self):
+        return int(self.clock() // self.bucket_seconds)
+
+    def _counters(self, cell):
+        counters = self._cells.get(cell)
+        if counters is None:
+            counters = self._cells[cell] = _CellCounters(self.buckets)
+        return counters
+
+    def _refresh(self, cell, counters):
+        demand = counters.demand(self._epoch)
+        if not demand and not counters.supply:
+            self._cells.pop(cell, None)
+            self._surge.pop(cell, None)
+            return
+        pressure = demand / (counters.supply + 1)
+        surge = 1.0 + self.sensitivity * (pressure - 1.0)
+        surge = round(min(self.max_surge, max(1.0, surge)), 1)
+        if surge > 1.0:
+            self._surge[cell] = surge
+        else:
+            self._surge.pop(cell, None)
+
+    def _roll(self):
+        # Khi sang bucket mới, tính lại surge cho các ô còn dữ liệu (mỗi bucket một lần)
+        epoch = self._now_epoch()
+        if epoch == self._epoch:
+            return
+        self._epoch = epoch
+        for cell, counters in list(self._cells.items()):
+            self._refresh(cell, counters)
+
+    def record_request(self, lat, lng):
+        """Ghi nhận một yêu cầu đặt xe tại điểm đón (lat, lng)."""
+        with self._lock:
+            self._roll()
+            cell = self.cell(lat, lng)
+            counters = self._counters(cell)
+            slot = self._epoch % self.buckets
+            if counters.stamps[slot] != self._epoch:
+                counters.stamps[slot] = self._epoch
+                counters.counts[slot] = 0
+            counters.counts[slot] += 1
+            self._refresh(cell, counters)
+
+    def set_driver(self, driver_id, position):
+        """position: (lat, lng) nếu tài xế đang rảnh, None nếu bận/ngừng hoạt động."""
+        with self._lock:
+            self._roll()
+            new_cell = self.cell(*position) if position else None
+            old_cell = self._drivers.get(driver_id)
+            if old_cell == new_cell:
+                return
+            if old_cell is not None:
+                del self._drivers[driver_id]
+                counters = self._counters(old_cell)
+                counters.supply -= 1
+                self._refresh(old_cell, counters)
+            if new_cell is not None:
+                self._drivers[driver_id] = new_cell
+                counters = self._counters(new_cell)
+                counters.supply += 1
+                self._refresh(new_cell, counters)
+
+    def surge(self, lat, lng):
+        """Hệ số tăng giá tại (lat, lng); 1.0 nếu ô không thiếu tài xế."""
+        if self._now_epoch() != self._epoch:
+            with self._lock:
+                self._roll()
+        return self._surge.get(self.cell(lat, lng), 1.0)
+
+    def heatmap(self):
+        """Danh sách ô còn dữ liệu: tâm ô, cầu trong cửa sổ, cung hiện tại và surge."""
+        with self._lock:
+            self._roll()
+            half = self.cell_size / 2
+            return [
+                {
+                    "lat": round(cell[0] * self.cell_size + half, 6),
+                    "lng": round(cell[1] * self.cell_size + half, 6),
+                    "demand": counters.demand(self._epoch),
+                    "supply": counters.supply,
+                    "surge": self._surge.get(cell, 1.0)
+                }
+                for cell, counters in self._cells.items()
+            ]
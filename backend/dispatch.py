@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn, thiếu thì hỏi chỉ mục không gian cho từng yêu cầu
+    np = None
+
+from metrics import MATCH_SECONDS
+from models import DistanceEngine
+
+logger = logging.getLogger(__name__)
+
+# Chi phí của cột giả: hàng chỉ rơi vào đó khi không còn ứng viên thật nào
+NO_EDGE = 1e9
+# Nhóm có nhiều tài xế rảnh hơn thế này thì chỉ mục lưới (chỉ xét ô lân cận)
+# nhanh hơn ma trận điểm đón x mọi tài xế
+MATRIX_MAX_DRIVERS = 5000
+
+
+def solve_assignment(edges, m):
+    """
+    Ghép tối ưu trên đồ thị hai phía thưa: edges[i] là dict {cột: chi phí}
+    chỉ gồm các ứng viên của hàng i, m là số cột.
+    Trả về list độ dài n: chỉ số cột được gán cho mỗi hàng hoặc None.
+
+    Hungarian theo từng hàng (đường tăng ngắn nhất bằng Dijkstra với thế vị)
+    nhưng chỉ duyệt cạnh ứng viên thay vì trải ra ma trận n x m. Mỗi hàng có
+    thêm một cột giả riêng chi phí NO_EDGE, nên kết quả giống ma trận đầy đủ
+    điền NO_EDGE: ghép được nhiều hàng nhất rồi tổng chi phí nhỏ nhất.
+    """
+    n = len(edges)
+    size = m + n  # cột m + i là cột giả của hàng i
+    row_match = [None] * n
+    col_match = [None] * size
+    row_pot = [0.0] * n
+    col_pot = [0.0] * size
+    inf = float("inf")
+    row_dist = [inf] * n
+    col_dist = [inf] * size
+    col_prev = [None] * size
+
+    def cost(i, j):
+        return NO_EDGE if j >= m else edges[i][j]
+
+    for source in range(n):
+        row_dist[source] = 0.0
+        rows_seen = [source]
+        cols_seen = []
+        heap = [(0.0, 0, source)]
+        end = None
+        while heap:
+            d, kind, x = heapq.heappop(heap)
+            if kind == 0:
+                if d > row_dist[x]:
+                    continue
+                for j, c in itertools.chain(edges[x].items(), ((m + x, NO_EDGE),)):
+                    if row_match[x] == j:
+                        continue
+                    nd = d + c + row_pot[x] - col_pot[j]
+                    if nd < col_dist[j]:
+                        if col_dist[j] == inf:
+                            cols_seen.append(j)
+                        col_dist[j] = nd
+                        col_prev[j] = x
+                        heapq.heappush(heap, (nd, 1, j))
+            else:
+                if d > col_dist[x]:
+                    continue
+                r = col_match[x]
+                if r is None:
+                    # Cột trống đầu tiên lấy ra khỏi heap cho đường tăng ngắn nhất
+                    end = x
+                    break
+                nd = d - cost(r, x) + col_pot[x] - row_pot[r]
+                if nd < row_dist[r]:
+                    if row_dist[r] == inf:
+                        rows_seen.append(r)
+                    row_dist[r] = nd
+                    heapq.heappush(heap, (nd, 0, r))
+
+        # Cập nhật thế vị chỉ cho đỉnh đã chạm tới (lệch một hằng số so với
+        # cập nhật mọi đỉnh nên chi phí rút gọn không đổi) rồi đặt lại khoảng cách
+        limit = col_dist[end]
+        for i in rows_seen:
+            if row_dist[i] < limit:
+                row_pot[i] += row_dist[i] - limit
+            row_dist[i] = inf
+        for j in cols_seen:
+            if col_dist[j] < limit:
+                col_pot[j] += col_dist[j] - limit
+            col_dist[j] = inf
+
+        j = end
+        while True:
+            i = col_prev[j]
+            previous = row_match[i]
+            row_match[i] = j
+            col_match[j] = i
+            if previous is None:
+                break
+            j = previous
+    return [j if j is not None and j < m else None for j in row_match]
+
+
+class _PendingRequest:
+    def __init__(self, pickup, vehicle_type, ride):
+        self.pickup = pickup
+        self.vehicle_type = vehicle_type
+        self.ride = ride
+        self.submitted_at = time.time()
+        self.done = threading.Event()
+        # Giữ khi hủy và khi giữ tài xế để hai việc không chen nhau
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.result = None
+        self.callbacks = []
+
+    def cancel(self):
+        """Hủy yêu cầu đã hết giờ chờ; trả về False nếu dispatcher đã xử lý xong nó."""
+        with self.lock:
+            if self.done.is_set():
+                return False
+            self.cancelled = True
+            return True
+
+    def finish(self):
+        self.done.set()
+        for callback in self.callbacks:
+            callback(self)
+
+
+class BatchDispatcher:
+    """
+    Gom các yêu cầu đặt xe trong một cửa sổ thời gian ngắn rồi ghép
+    yêu cầu - tài xế tối ưu toàn cục (tổng quãng đường đón nhỏ nhất)
+    thay vì ghép tham lam từng yêu cầu với tài xế gần nhất.
+    """
+
+    def __init__(self, index, reserve, window=1.5, candidates=5, max_radius_km=None):
+        self.index = index
+        self.reserve = reserve  # reserve(driver, ride) -> bool, giữ tài xế và tạo chuyến đi
+        self.window = window
+        self.candidates = candidates
+        self.max_radius_km = max_radius_km
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats = {
+            "batches": 0,
+            "requests": 0,
+            "matched": 0,
+            "last_batch_size": 0,
+            "last_solve_ms": 0.0,
+            "max_solve_ms": 0.0,
+            "total_wait_ms": 0.0,
+        }
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="batch-dispatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, pickup, vehicle_type, ride=None, timeout=None):
+        """
+        Đưa yêu cầu vào lô hiện tại và chờ kết quả ghép.
+        Trả về dict {"driver", "distance", "dispatch"} hoặc None nếu không có tài xế.
+        """
+        item = _PendingRequest(pickup, vehicle_type, ride)
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify()
+        if timeout is None:
+            timeout = self.window * 10 + 5
+        if not item.done.wait(timeout) and item.cancel():
+            return None
+        return item.result
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+        stats["window_seconds"] = self.window
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / stats["requests"], 2) if stats["requests"] else 0
+        return stats
+
+    async def submit_async(self, pickup, vehicle_type, ride=None, timeout=None):
+        """Như submit nhưng chờ kết quả trên event loop thay vì chặn một thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(item):
+            if not future.done():
+                future.set_result(item.result)
+
+        item = _PendingRequest(pickup, vehicle_type, ride)
+        item.callbacks.append(lambda item: loop.call_soon_threadsafe(resolve, item))
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify()
+        if timeout is None:
+            timeout = self.window * 10 + 5
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            if item.cancel():
+                return None
+            return item.result
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Cửa sổ tính từ yêu cầu đầu tiên của lô
+                deadline = self._pending[0].submitted_at + self.window
+                while True:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+            try:
+                self._dispatch(batch)
+            except Exception:
+                logger.exception("Error in batch dispatch")
+                for item in batch:
+                    item.finish()
+
+    def _candidates(self, batch):
+        """
+        Với mỗi yêu cầu: tối đa self.candidates cặp (khoảng cách, tài xế) gần nhất.
+        Có numpy thì gom các yêu cầu cùng loại xe và cùng vùng, tính một ma trận
+        điểm đón x tài xế rảnh (DistanceEngine) cho cả nhóm thay vì một lần tìm
+        trên chỉ mục cho mỗi yêu cầu; nhóm quá MATRIX_MAX_DRIVERS tài xế vẫn
+        tìm trên chỉ mục.
+        """
+        points = [(float(item.pickup.get("lat", 0)), float(item.pickup.get("lng", 0))) for item in batch]
+        if np is None:
+            return [self.index.nearest(lat, lng, vehicle_type=item.vehicle_type, k=self.candidates,
+                                       max_radius_km=self.max_radius_km)
+                    for item, (lat, lng) in zip(batch, points)]
+        groups = {}
+        for i, (item, (lat, lng)) in enumerate(zip(batch, points)):
+            groups.setdefault((item.vehicle_type, self.index.region(lat, lng)), []).append(i)
+        results = [None] * len(batch)
+        for (vehicle_type, region), members in groups.items():
+            drivers, coords = self.index.available(vehicle_type, region)
+            if len(drivers) > MATRIX_MAX_DRIVERS:
+                for i in members:
+                    results[i] = self.index.nearest(*points[i], vehicle_type=vehicle_type, k=self.candidates,
+                                                    max_radius_km=self.max_radius_km)
+                continue
+            engine = DistanceEngine(drivers, coords)
+            matches = engine.top_k_many([points[i] for i in members], self.candidates, self.max_radius_km)
+            for i, row in zip(members, matches):
+                results[i] = row
+        return results
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+
+        columns = {}
+        drivers = []
+        edges = []
+        for matches in self._candidates(batch):
+            row = {}
+            for distance, driver in matches:
+                if driver["id"] not in columns:
+                    columns[driver["id"]] = len(drivers)
+                    drivers.append(driver)
+                row[columns[driver["id"]]] = distance
+            edges.append(row)
+
+        assignment = solve_assignment(edges, len(drivers))
+        solve_ms = (time.perf_counter() - started) * 1000
+
+        dispatch_info = {
+            "window_seconds": self.window,
+            "batch_size": len(batch),
+            "solve_ms": round(solve_ms, 3),
+        }
+        matched = 0
+        now = time.time()
+        taken = {j for j in assignment if j is not None}
+        for item, j, row in zip(batch, assignment, edges):
+            # Nếu mất tài xế được gán (bị yêu cầu khác giữ trước) thì thử ứng viên kế tiếp
+            choices = [j] if j is not None else []
+            choices += sorted((c for c in row if c not in taken), key=row.get)
+            # Giữ khóa của yêu cầu suốt lúc giữ tài xế: người gọi hết giờ chờ
+            # hoặc hủy trước khi ta bắt đầu, hoặc chờ ta xong và nhận kết quả
+            with item.lock:
+                if item.cancelled:
+                    choices = []
+                for c in choices:
+                    if self.reserve(drivers[c], item.ride):
+                        taken.add(c)
+                        item.result = {"driver": drivers[c], "distance": row[c], "dispatch": dispatch_info}
+                        matched += 1
+                        break
+                item.finish()
+
+        with self._cond:
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(batch)
+            self._stats["matched"] += matched
+            self._stats["last_batch_size"] = len(batch)
+            self._stats["last_solve_ms"] = round(solve_ms, 3)
+            self._stats["max_solve_ms"] = max(self._stats["max_solve_ms"], round(solve_ms, 3))
+            self._stats["total_wait_ms"] += sum((now - item.submitted_at) * 1000 for item in batch)
+        MATCH_SECONDS.observe(solve_ms / 1000, mode="batch")
+        logger.debug("Batch dispatch: %d/%d matched in %.2f ms", matched, len(batch), solve_ms)
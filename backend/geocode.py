@@ -0,0 +1,220 @@
+import asyncio
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # tùy chọn: thiếu thì chế độ async gọi fetch đồng bộ trong thread pool
+    httpx = None
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+
+
+def normalize_query(text):
+    """Chuẩn hóa chuỗi tìm kiếm: chữ thường, bỏ dấu tiếng Việt, gộp khoảng trắng."""
+    text = unicodedata.normalize("NFD", str(text).lower().replace("đ", "d"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+class LRUTTLCache:
+    """Cache LRU có giới hạn kích thước, mỗi mục hết hạn sau ttl giây."""
+
+    def __init__(self, maxsize=1024, ttl=3600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < self.clock():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class AddressIndex:
+    """
+    Chỉ mục trigram trên các địa chỉ đã xuất hiện trong rides.json
+    (pickup/dropoff), dùng để trả lời gợi ý địa điểm mà không gọi ra ngoài.
+    """
+
+    def __init__(self):
+        self._entries = []  # [display_name, lat, lng, normalized, số lần xuất hiện]
+        self._by_name = {}
+        self._trigrams = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _grams(text):
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, location):
+        if not hasattr(location, "get") or not location.get("address"):
+            return
+        name = location["address"]
+        with self._lock:
+            entry_id = self._by_name.get(name)
+            if entry_id is not None:
+                self._entries[entry_id][4] += 1
+                return
+            normalized = normalize_query(name)
+            entry_id = len(self._entries)
+            self._entries.append([name, location.get("lat"), location.get("lng", location.get("lon")), normalized, 1])
+            self._by_name[name] = entry_id
+            for gram in self._grams(normalized):
+                self._trigrams.setdefault(gram, set()).add(entry_id)
+
+    def add_ride(self, ride):
+        self.add(ride.get("pickup"))
+        self.add(ride.get("dropoff"))
+
+    def search(self, query, limit=5):
+        """Trả về kết quả theo định dạng Nominatim (display_name, lat, lon)."""
+        normalized = normalize_query(query)
+        if len(normalized) < 3:
+            return []
+        tokens = normalized.split()
+        with self._lock:
+            # Chọn tập trigram hiếm nhất làm ứng viên rồi kiểm tra từng token
+            grams = [g for g in self._grams(normalized) if not g.endswith(" ") and not g.startswith("  ")]
+            postings = [self._trigrams.get(gram) for gram in grams]
+            if not postings or any(p is None for p in postings):
+                return []
+            candidates = min(postings, key=len)
+            matched = [self._entries[i] for i in candidates
+                       if all(token in self._entries[i][3] for token in tokens)]
+        matched.sort(key=lambda e: (-e[4], len(e[0])))
+        return [
+            {"display_name": name, "lat": str(lat), "lon": str(lng), "source": "local"}
+            for name, lat, lng, _, _ in matched[:limit]
+        ]
+
+
+class Geocoder:
+    """
+    Gợi ý địa điểm: cache LRU+TTL theo truy vấn đã chuẩn hóa, chỉ mục địa
+    chỉ cục bộ, và cuối cùng mới gọi Nominatim qua session có pool kết nối
+    và timeout. fetch có thể được thay bằng hàm giả lập khi kiểm thử.
+    search_async dùng cho chế độ asyncio: fetch_async (mặc định httpx nếu có)
+    và gộp các truy vấn trùng nhau đang chờ thành một lần gọi ra ngoài.
+    """
+
+    def __init__(self, index=None, fetch=None, cache=None, limit=5, local_min=3,
+                 timeout=(2, 5), pool_size=10, fetch_async=None):
+        self.index = index or AddressIndex()
+        self.cache = cache or LRUTTLCache()
+        self.limit = limit
+        self.local_min = local_min
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = "SmartRideApp/1.0"
+        self.fetch = fetch or self._fetch_nominatim
+        self.pool_size = pool_size
+        if fetch_async is None and fetch is None and httpx is not None:
+            fetch_async = self._fetch_nominatim_async
+        self.fetch_async = fetch_async
+        self._async_client = None
+        self._inflight = {}
+
+    def _fetch_nominatim(self, query):
+        response = self.session.get(NOMINATIM_URL, params=self._params(query), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _params(self, query):
+        return {
+            "q": query,
+            "format": "json",
+            "addressdetails": 1,
+            "limit": self.limit,
+            "countrycodes": "vn"
+        }
+
+    async def _fetch_nominatim_async(self, query):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                headers={"User-Agent": "SmartRideApp/1.0"},
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+            )
+        response = await self._async_client.get(NOMINATIM_URL, params=self._params(query))
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def lookup_local(self, query):
+        """Trả về (key, kết quả) nếu trả lời được từ cache/chỉ mục, ngược lại (key, None)."""
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return key, cached
+        local = self.index.search(query, self.limit)
+        if len(local) >= self.local_min:
+            self.cache.set(key, local)
+            return key, local
+        return key, None
+
+    def search(self, query):
+        key, results = self.lookup_local(query)
+        if results is not None:
+            return results
+        results = self.fetch(query)
+        self.cache.set(key, results)
+        return results
+
+    async def _fetch_and_cache(self, key, query):
+        if self.fetch_async is not None:
+            results = await self.fetch_async(query)
+        else:
+            results = await asyncio.get_running_loop().run_in_executor(None, self.fetch, query)
+        self.cache.set(key, results)
+        return results
+
+    async def search_async(self, query):
+        key, results = self.lookup_local(query)
+        if results is not None:
+            return results
+        # Nhiều người gõ cùng truy vấn cùng lúc chỉ tạo một lần gọi Nominatim
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_cache(key, query))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
@@ -0,0 +1,375 @@
+"""
+Chia pool tài xế theo thành phố/vùng (geofence).
+
+Mỗi vùng là một đa giác [[lat, lng], ...] thuộc một thành phố, đọc từ
+zones.json (GEOFENCE_FILE):
+  {"cities": [{"name": "hanoi", "zones": [{"name": "hanoi-central", "polygon": [[lat, lng], ...]}]}]}
+Các vùng không được chồng lên nhau; điểm nằm ngoài mọi vùng thuộc vùng
+OUTSIDE. Không có file thì chỉ có OUTSIDE, tức một chỉ mục như trước.
+
+locate() tra một lưới thô: mỗi ô giữ các vùng có bounding box chạm ô đó,
+nên mỗi điểm chỉ thử ray casting trên một hai đa giác.
+
+ShardedDriverIndex giữ một spatial.DriverIndex (cùng vị trí GPS trực tiếp)
+cho mỗi vùng. Tìm tài xế xét vùng chứa điểm đón, cộng thêm các vùng có biên
+cách điểm đón không quá spill_km (tràn qua biên); chưa đủ k tài xế trong bán
+kính đó thì mở rộng ra các vùng còn lại của thành phố, gần trước. Một worker có thể
+chỉ phục vụ một số vùng (SHARD_ZONES): chỉ mục khi đó chỉ giữ các vùng đó
+và các vùng kề trong phạm vi spill_km; yêu cầu đặt xe ở vùng khác được
+chuyển tới worker phụ trách (app.py). Giữ tài xế bằng compare-and-set
+trên store dùng chung nên hai worker cùng thấy một tài xế gần biên vẫn
+không giữ trùng.
+
+Chạy tay:
+  python geofence.py locate LAT LNG     vùng chứa điểm và các vùng lân cận
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+from math import cos, radians
+
+from models import RideMatchingService
+from spatial import DriverIndex, KM_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+OUTSIDE = "outside"
+# Vùng là cấu hình đi kèm mã nguồn, không đổi theo SMART_RIDE_DATA_DIR
+GEOFENCE_FILE = os.environ.get("GEOFENCE_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "zones.json")
+
+
+def _segment_km(lat, lng, a, b):
+    """Khoảng cách (km) từ điểm tới đoạn thẳng ab, xấp xỉ phẳng quanh điểm."""
+    kx = KM_PER_DEGREE * cos(radians(lat))
+    ax, ay = (a[1] - lng) * kx, (a[0] - lat) * KM_PER_DEGREE
+    bx, by = (b[1] - lng) * kx, (b[0] - lat) * KM_PER_DEGREE
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    t = 0.0 if length == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length))
+    x, y = ax + t * dx, ay + t * dy
+    return (x * x + y * y) ** 0.5
+
+
+class Zone:
+    def __init__(self, name, city, polygon):
+        self.name = name
+        self.city = city
+        self.polygon = [(float(lat), float(lng)) for lat, lng in polygon]
+        if len(self.polygon) < 3:
+            raise ValueError(f"Vùng {name} cần ít nhất 3 đỉnh")
+        lats = [p[0] for p in self.polygon]
+        lngs = [p[1] for p in self.polygon]
+        self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+
+    def edges(self):
+        return zip(self.polygon, self.polygon[1:] + self.polygon[:1])
+
+    def contains(self, lat, lng):
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        # Ray casting theo chiều kinh độ
+        inside = False
+        for (lat1, lng1), (lat2, lng2) in self.edges():
+            if (lat1 > lat) != (lat2 > lat) and lng < (lng2 - lng1) * (lat - lat1) / (lat2 - lat1) + lng1:
+                inside = not inside
+        return inside
+
+    def distance_km(self, lat, lng):
+        """0 nếu điểm nằm trong vùng, ngược lại khoảng cách tới biên gần nhất."""
+        if self.contains(lat, lng):
+            return 0.0
+        return min(_segment_km(lat, lng, a, b) for a, b in self.edges())
+
+    def to_dict(self):
+        return {"name": self.name, "city": self.city, "polygon": [list(p) for p in self.polygon]}
+
+
+class Geofence:
+    def __init__(self, zones=(), grid_size=0.05):
+        self.zones = list(zones)
+        self.grid_size = grid_size
+        self._by_name = {}
+        for zone in self.zones:
+            if zone.name in self._by_name or zone.name == OUTSIDE:
+                raise ValueError(f"Tên vùng trùng hoặc không hợp lệ: {zone.name}")
+            self._by_name[zone.name] = zone
+        # ô lưới -> các vùng có bounding box chạm ô
+        self._grid = {}
+        for zone in self.zones:
+            min_lat, min_lng, max_lat, max_lng = zone.bbox
+            for i in range(self._index(min_lat), self._index(max_lat) + 1):
+                for j in range(self._index(min_lng), self._index(max_lng) + 1):
+                    self._grid.setdefault((i, j), []).append(zone)
+
+    @classmethod
+    def load(cls, path=GEOFENCE_FILE):
+        if not os.path.exists(path):
+            logger.info("Không có file vùng %s: mọi tài xế chung một chỉ mục", path)
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        zones = [Zone(zone["name"], city["name"], zone["polygon"])
+                 for city in data.get("cities", []) for zone in city.get("zones", [])]
+        logger.info("Đã nạp %d vùng từ %s", len(zones), path)
+        return cls(zones)
+
+    def _index(self, value):
+        return int(value // self.grid_size)
+
+    def zone(self, name):
+        return self._by_name.get(name)
+
+    def locate(self, lat, lng):
+        """Vùng chứa điểm, hoặc None nếu điểm nằm ngoài mọi vùng."""
+        for zone in self._grid.get((self._index(lat), self._index(lng)), ()):
+            if zone.contains(lat, lng):
+                return zone
+        return None
+
+    def shard_name(self, lat, lng):
+        zone = self.locate(lat, lng)
+        return zone.name if zone else OUTSIDE
+
+    def near(self, lat, lng, radius_km):
+        """Các cặp (khoảng cách km, vùng) có biên cách điểm không quá radius_km, gần nhất trước."""
+        lat_span = radius_km / KM_PER_DEGREE
+        lng_span = radius_km / (KM_PER_DEGREE * max(cos(radians(lat)), 0.01))
+        candidates = {}
+        for i in range(self._index(lat - lat_span), self._index(lat + lat_span) + 1):
+            for j in range(self._index(lng - lng_span), self._index(lng + lng_span) + 1):
+                for zone in self._grid.get((i, j), ()):
+                    candidates[zone.name] = zone
+        result = [(zone.distance_km(lat, lng), zone) for zone in candidates.values()]
+        return sorted((item for item in result if item[0] <= radius_km), key=lambda item: item[0])
+
+    def adjacent(self, zone, radius_km):
+        """Các vùng khác có biên cách biên của zone không quá radius_km."""
+        result = []
+        for other in self.zones:
+            if other is zone:
+                continue
+            # Khoảng cách giữa hai đa giác đạt tại một đỉnh của một trong hai
+            distance = min(min(other.distance_km(lat, lng) for lat, lng in zone.polygon),
+                           min(zone.distance_km(lat, lng) for lat, lng in other.polygon))
+            if distance <= radius_km:
+                result.append(other)
+        return result
+
+    def select(self, names):
+        """Tên vùng hoặc tên thành phố (và OUTSIDE) -> tập tên vùng; ném ValueError nếu không có."""
+        selected = set()
+        for name in names:
+            matched = [zone.name for zone in self.zones if name in (zone.name, zone.city)]
+            if name == OUTSIDE:
+                matched.append(OUTSIDE)
+            if not matched:
+                raise ValueError(f"Không có vùng hoặc thành phố {name}")
+            selected.update(matched)
+        return selected
+
+
+class ShardedDriverIndex:
+    """
+    Cùng giao diện với spatial.DriverIndex, dữ liệu chia theo vùng.
+    served: các vùng/thành phố worker này phục vụ (None: mọi vùng).
+    lookup(driver_id): lấy bản ghi tài xế khi GPS đưa tài xế vào một vùng
+    mà trước đó worker không giữ.
+    """
+
+    def __init__(self, geofence, cell_size=0.01, spill_km=2.0, served=None, lookup=None):
+        self.geofence = geofence
+        self.cell_size = cell_size
+        self.spill_km = spill_km
+        self.lookup = lookup
+        names = [zone.name for zone in geofence.zones] + [OUTSIDE]
+        self.served = set(names) if served is None else geofence.select(served)
+        loaded = set(self.served)
+        for name in self.served:
+            zone = geofence.zone(name)
+            if zone is not None:
+                loaded.update(other.name for other in geofence.adjacent(zone, spill_km))
+        self._shards = {name: DriverIndex(cell_size) for name in names if name in loaded}
+        # driver_id -> (tên vùng, vùng lấy theo GPS trực tiếp hay theo bản ghi); kể cả vùng không giữ
+        self._assigned = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards.values())
+
+    def serves(self, lat, lng):
+        return self.geofence.shard_name(lat, lng) in self.served
+
+    def sizes(self):
+        """Số tài xế rảnh trong từng vùng đang giữ."""
+        return {name: len(shard) for name, shard in self._shards.items()}
+
+    def rebuild(self, drivers):
+        with self._lock:
+            for shard in self._shards.values():
+                shard.rebuild(())
+            self._assigned = {driver_id: entry for driver_id, entry in self._assigned.items() if entry[1]}
+            for driver in drivers:
+                self.update(driver)
+
+    def update(self, driver):
+        with self._lock:
+            driver_id = driver["id"]
+            entry = self._assigned.get(driver_id)
+            if entry and entry[1]:
+                # Vùng theo GPS trực tiếp; shard giữ luôn vị trí đó
+                name = entry[0]
+            else:
+                coords = RideMatchingService.get_driver_coordinates(driver)
+                name = self.geofence.shard_name(*coords) if coords else None
+                if entry and entry[0] != name and entry[0] in self._shards:
+                    self._shards[entry[0]].remove(driver_id)
+                if name is None:
+                    self._assigned.pop(driver_id, None)
+                    return
+                self._assigned[driver_id] = (name, False)
+            shard = self._shards.get(name)
+            if shard is not None:
+                shard.update(driver)
+
+    def move(self, driver_id, lat, lng):
+        with self._lock:
+            name = self.geofence.shard_name(lat, lng)
+            entry = self._assigned.get(driver_id)
+            old = entry[0] if entry else None
+            self._assigned[driver_id] = (name, True)
+            shard = self._shards.get(name)
+            if name == old:
+                if shard is not None:
+                    shard.move(driver_id, lat, lng)
+                return
+            # Tài xế qua biên: chuyển bản ghi (nếu đang rảnh) và vị trí sang shard mới
+            old_shard = self._shards.get(old)
+            driver = old_shard.get(driver_id) if old_shard else None
+            if old_shard is not None:
+                old_shard.forget(driver_id)
+            if shard is None:
+                return
+            shard.move(driver_id, lat, lng)
+            if driver is None and old_shard is None and self.lookup is not None:
+                driver = self.lookup(driver_id)
+            if driver is not None:
+                shard.update(driver)
+
+    def _shard_of(self, driver_id):
+        entry = self._assigned.get(driver_id)
+        return self._shards.get(entry[0]) if entry else None
+
+    def position(self, driver_id):
+        shard = self._shard_of(driver_id)
+        return shard.position(driver_id) if shard else None
+
+    def remove(self, driver_id):
+        with self._lock:
+            shard = self._shard_of(driver_id)
+            if shard is not None:
+                shard.remove(driver_id)
+
+    def _search(self, lat, lng, radius_km):
+        """
+        Các cặp (khoảng cách tới vùng, shard): shard chứa điểm rồi các shard
+        có biên trong bán kính radius_km, gần trước.
+        """
+        home = self.geofence.shard_name(lat, lng)
+        shards = [(0.0, self._shards[home])] if home in self._shards else []
+        for distance, zone in self.geofence.near(lat, lng, radius_km):
+            if zone.name != home and zone.name in self._shards:
+                shards.append((distance, self._shards[zone.name]))
+        return shards
+
+    def _widen(self, lat, lng, searched):
+        """
+        Các cặp (khoảng cách tới vùng, shard) chưa tìm: mọi vùng cùng thành phố
+        và OUTSIDE (điểm ngoài mọi vùng thì xét mọi vùng), gần trước.
+        """
+        home = self.geofence.locate(lat, lng)
+        shards = []
+        for name, shard in self._shards.items():
+            if shard in searched:
+                continue
+            zone = self.geofence.zone(name)
+            if zone is None:
+                # Không biết khoảng cách tới OUTSIDE: xét trước, không cắt tỉa
+                shards.append((0.0, shard))
+            elif home is None or zone.city == home.city:
+                shards.append((zone.distance_km(lat, lng), shard))
+        shards.sort(key=lambda item: item[0])
+        return shards
+
+    def _collect(self, results, shards, lat, lng, vehicle_type, k, max_radius_km, searched):
+        for distance, shard in shards:
+            # Mọi tài xế của vùng đều cách điểm đón ít nhất bằng khoảng cách tới biên vùng
+            if len(results) >= k and distance >= results[k - 1][0]:
+                break
+            if max_radius_km is not None and distance > max_radius_km:
+                break
+            searched.add(shard)
+            results += shard.nearest(lat, lng, vehicle_type=vehicle_type, k=k, max_radius_km=max_radius_km)
+            results.sort(key=lambda item: item[0])
+            del results[k:]
+
+    def nearest(self, lat, lng, vehicle_type=None, k=1, max_radius_km=None):
+        spill = self.spill_km if max_radius_km is None else min(self.spill_km, max_radius_km)
+        results = []
+        searched = set()
+        # Đường nhanh: vùng chứa điểm đón và các vùng có biên trong bán kính tràn
+        self._collect(results, self._search(lat, lng, spill), lat, lng, vehicle_type, k, max_radius_km, searched)
+        if len(results) >= k and results[k - 1][0] <= spill:
+            return results
+        # Chưa đủ k tài xế trong bán kính tràn: xét tiếp các vùng xa hơn của thành
+        # phố (tài xế cách vài km ở vùng bên cạnh vẫn được ghép)
+        self._collect(results, self._widen(lat, lng, searched), lat, lng, vehicle_type, k, max_radius_km, searched)
+        return results
+
+    def region(self, lat, lng):
+        """
+        Tên các vùng mà nearest() có thể xét cho điểm: vùng chứa điểm, các vùng
+        trong bán kính tràn và các vùng _widen() mở rộng tới.
+        """
+        home = self.geofence.locate(lat, lng)
+        names = {self.geofence.shard_name(lat, lng)}
+        names.update(zone.name for _, zone in self.geofence.near(lat, lng, self.spill_km))
+        for name in self._shards:
+            zone = self.geofence.zone(name)
+            if zone is None or home is None or zone.city == home.city:
+                names.add(name)
+        return frozenset(name for name in names if name in self._shards)
+
+    def available(self, vehicle_type=None, region=None):
+        with self._lock:
+            drivers, coords = [], []
+            for name in self._shards if region is None else region:
+                shard_drivers, shard_coords = self._shards[name].available(vehicle_type)
+                drivers += shard_drivers
+                coords += shard_coords
+            return drivers, coords
+
+    def within(self, lat, lng, radius_km, vehicle_type=None):
+        results = []
+        for _, shard in self._search(lat, lng, radius_km):
+            results += shard.within(lat, lng, radius_km, vehicle_type=vehicle_type)
+        results.sort(key=lambda item: item[0])
+        return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tra vùng (geofence) của một điểm")
+    parser.add_argument("command", choices=("locate",))
+    parser.add_argument("lat", type=float)
+    parser.add_argument("lng", type=float)
+    parser.add_argument("--radius", type=float, default=2.0, help="bán kính (km) tìm vùng lân cận")
+    args = parser.parse_args()
+    geofence = Geofence.load()
+    zone = geofence.locate(args.lat, args.lng)
+    print(json.dumps({
+        "zone": zone.name if zone else OUTSIDE,
+        "city": zone.city if zone else None,
+        "near": [{"zone": z.name, "distance_km": round(d, 3)} for d, z in geofence.near(args.lat, args.lng, args.radius)],
+    }, ensure_ascii=False))
@@ -0,0 +1,324 @@
+"""
+Hàng đợi công việc nền cho phần việc sau chuyến đi: thu tiền, cập nhật
+thống kê tài xế, gửi thông báo, chuyển chuyến cũ sang kho lưu trữ, gom WAL.
+
+Endpoint chỉ ghi thay đổi trạng thái cốt lõi rồi enqueue(); một nhóm
+thread worker chạy handler đã đăng ký cho từng loại công việc. Handler ném
+ngoại lệ thì công việc được thử lại sau backoff * 2^(lần thử - 1) giây
+(cộng thêm một ít ngẫu nhiên, hẹn giờ trên timers.TimerQueue); quá
+max_attempts lần thì chuyển sang failed và được giữ lại để xem qua stats().
+
+Idempotency key: enqueue() với key đã gặp (đang chờ, đang chạy hoặc đã
+kết thúc trong số `keep` công việc gần nhất) trả về công việc cũ thay vì
+tạo mới, nên gửi lại cùng một yêu cầu không thu tiền hai lần. Công việc có
+thể chạy lại nếu tiến trình dừng giữa lúc chạy (at-least-once) nên handler
+phải idempotent: truyền job.idempotency_key xuống nhà cung cấp, ghi bằng
+compare-and-set thay vì cộng dồn mù.
+
+Với journal (jobs.log), mỗi lần thêm/thử lại/kết thúc ghi một dòng JSON;
+khi mở, công việc chưa xong được xếp hàng lại và key của công việc đã xong
+vẫn được nhớ. Journal được viết gọn lại lúc mở và khi dài quá nhiều lần
+số công việc đang giữ.
+
+Dùng thread chứ không dùng process pool: handler đọc/ghi store nằm trong
+bộ nhớ của tiến trình.
+"""
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import JOBS, JOB_SECONDS
+from timers import TimerQueue
+from utils import dumps
+
+logger = logging.getLogger(__name__)
+
+JOBS_FILE = "jobs.log"
+FINISHED = ("done", "failed")
+
+
+class Job:
+    __slots__ = ("id", "kind", "payload", "key", "status", "attempts", "error", "result",
+                 "created_at", "finished_at")
+
+    def __init__(self, job_id, kind, payload=None, key=None, created_at=None):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.key = key
+        self.status = "queued"  # queued -> running -> done | failed (hoặc quay lại queued để thử lại)
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self.created_at = created_at or time.time()
+        self.finished_at = None
+
+    @property
+    def idempotency_key(self):
+        """Key truyền xuống nhà cung cấp bên ngoài; công việc không có key dùng id."""
+        return self.key if self.key is not None else f"job:{self.id}"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "key": self.key,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "result": self.result,
+            "payload": self.payload,
+            "created_at": round(self.created_at, 3),
+            "finished_at": round(self.finished_at, 3) if self.finished_at else None,
+        }
+
+    def _journal_entry(self):
+        return {"op": "add", "id": self.id, "kind": self.kind, "payload": self.payload, "key": self.key,
+                "attempts": self.attempts, "created_at": self.created_at}
+
+
+class JobQueue:
+    def __init__(self, workers=2, path=None, timers=None, max_attempts=5, backoff=1.0, keep=10000,
+                 fsync=False):
+        self.workers = workers
+        self.path = path
+        self.timers = timers or TimerQueue("job-timers")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.keep = keep
+        self.fsync = fsync
+        self._handlers = {}
+        # Công việc chưa kết thúc và tối đa keep công việc đã kết thúc gần nhất
+        self._jobs = {}
+        self._keys = {}
+        self._finished = deque()
+        self._ready = deque()
+        self._unfinished = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._journal = None
+        self._journal_lines = 0
+        self._threads = []
+
+    def register(self, kind, handler=None, max_attempts=None):
+        """
+        Đăng ký handler(job) cho một loại công việc; dùng được như decorator.
+        Giá trị trả về (JSON được) lưu vào job.result.
+        """
+        def decorator(fn):
+            self._handlers[kind] = (fn, max_attempts or self.max_attempts)
+            return fn
+        return decorator(handler) if handler is not None else decorator
+
+    def open(self):
+        """Phát lại journal: công việc chưa xong được xếp hàng lại. Gọi sau khi đã register."""
+        if self.path is None:
+            return self
+        jobs = self._replay() if os.path.exists(self.path) else {}
+        with self._lock:
+            finished = [job for job in jobs.values() if job.status in FINISHED]
+            for job in finished[-self.keep:]:
+                self._track(job)
+                self._finished.append(job)
+            pending = [job for job in jobs.values() if job.status not in FINISHED]
+            for job in pending:
+                job.status = "queued"
+                self._track(job)
+                self._ready.append(job)
+            self._unfinished += len(pending)
+            self._ids = itertools.count(max(jobs, default=0) + 1)
+            self._rewrite_journal()
+        if pending:
+            logger.info("Xếp hàng lại %d công việc nền chưa xong từ %s", len(pending), self.path)
+        return self
+
+    def _replay(self):
+        jobs = {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Dòng cuối có thể bị ghi dở khi tiến trình bị dừng đột ngột
+                    logger.warning("Bỏ qua dòng journal hỏng: %r", line[:80])
+                    continue
+                if entry["op"] == "add":
+                    job = Job(entry["id"], entry["kind"], entry.get("payload"), entry.get("key"),
+                              entry.get("created_at"))
+                    job.attempts = entry.get("attempts", 0)
+                    jobs[job.id] = job
+                    continue
+                job = jobs.get(entry["id"])
+                if job is None:
+                    continue
+                job.error = entry.get("error")
+                if entry["op"] == "retry":
+                    job.attempts = entry["attempts"]
+                else:
+                    job.status = entry["op"]
+                    job.result = entry.get("result")
+                    job.finished_at = entry.get("finished_at")
+        return jobs
+
+    def start(self):
+        self.timers.start()
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads) + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def enqueue(self, kind, payload=None, key=None):
+        """
+        Thêm công việc; trả về Job. Nếu key đã có công việc (chưa bị quên)
+        thì trả về công việc đó và không thêm gì.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Không có handler cho công việc {kind}")
+        with self._lock:
+            if key is not None:
+                job = self._keys.get(key)
+                if job is not None:
+                    JOBS.inc(kind=kind, outcome="deduplicated")
+                    return job
+            job = Job(next(self._ids), kind, payload, key)
+            self._track(job)
+            self._write(job._journal_entry())
+            self._unfinished += 1
+            self._ready.append(job)
+            self._has_work.notify()
+        JOBS.inc(kind=kind, outcome="enqueued")
+        return job
+
+    def every(self, interval, kind, payload=None):
+        """Thêm công việc kind ngay bây giờ rồi cứ mỗi interval giây; bỏ qua lượt nếu lần trước chưa xong."""
+        def tick(previous):
+            if previous is None or previous.status in FINISHED:
+                previous = self.enqueue(kind, payload)
+            self.timers.call_later(interval, tick, previous)
+        tick(None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def join(self, timeout=None):
+        """Chờ tới khi mọi công việc (kể cả đang chờ thử lại) kết thúc; trả về False nếu hết giờ."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def stats(self, failures=20):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == "running")
+            return {
+                "workers": len(self._threads),
+                "queued": len(self._ready),
+                "running": running,
+                # Đang chờ hẹn giờ thử lại
+                "retrying": self._unfinished - len(self._ready) - running,
+                "recent_failures": [job.to_dict() for job in reversed(self._finished)
+                                    if job.status == "failed"][:failures],
+            }
+
+    def _track(self, job):
+        self._jobs[job.id] = job
+        if job.key is not None:
+            self._keys[job.key] = job
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._ready:
+                    self._has_work.wait()
+                job = self._ready.popleft()
+                job.status = "running"
+                job.attempts += 1
+            handler, max_attempts = self._handlers.get(job.kind, (None, 0))
+            try:
+                if handler is None:
+                    raise LookupError(f"Không có handler cho công việc {job.kind}")
+                with JOB_SECONDS.time(kind=job.kind):
+                    result = handler(job)
+            except Exception as e:
+                self._failed(job, e, max_attempts)
+            else:
+                self._finish(job, "done", result=result)
+
+    def _failed(self, job, error, max_attempts):
+        job.error = f"{type(error).__name__}: {error}"
+        if job.attempts >= max_attempts:
+            logger.error("Công việc %s #%d thất bại sau %d lần thử", job.kind, job.id, job.attempts,
+                         exc_info=error)
+            self._finish(job, "failed")
+            return
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        delay += random.uniform(0, delay / 2)
+        logger.warning("Công việc %s #%d lỗi (lần %d/%d), thử lại sau %.1fs: %s",
+                       job.kind, job.id, job.attempts, max_attempts, delay, job.error)
+        with self._lock:
+            job.status = "queued"
+            self._write({"op": "retry", "id": job.id, "attempts": job.attempts, "error": job.error})
+        JOBS.inc(kind=job.kind, outcome="retried")
+        self.timers.call_later(delay, self._requeue, job)
+
+    def _requeue(self, job):
+        with self._lock:
+            self._ready.append(job)
+            self._has_work.notify()
+
+    def _finish(self, job, status, result=None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.finished_at = time.time()
+            self._write({"op": status, "id": job.id, "error": job.error, "result": result,
+                         "finished_at": job.finished_at})
+            self._finished.append(job)
+            while len(self._finished) > self.keep:
+                old = self._finished.popleft()
+                self._jobs.pop(old.id, None)
+                if old.key is not None and self._keys.get(old.key) is old:
+                    del self._keys[old.key]
+            self._unfinished -= 1
+            if self._unfinished == 0:
+                self._idle.notify_all()
+        JOBS.inc(kind=job.kind, outcome=status)
+
+    def _write(self, entry):
+        # Gọi khi đang giữ _lock
+        if self._journal is None:
+            return
+        self._journal.write(dumps(entry) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_lines += 1
+        if self._journal_lines >= max(1000, 4 * len(self._jobs)):
+            self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        # Gọi khi đang giữ _lock. Công việc đã xong mà không có key thì không cần nhớ nữa
+        tmp_path = self.path + ".tmp"
+        lines = 0
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for job in sorted(self._jobs.values(), key=lambda job: job.id):
+                if job.status in FINISHED and job.key is None:
+                    continue
+                f.write(dumps(job._journal_entry()) + "\n")
+                lines += 1
+                if job.status in FINISHED:
+                    f.write(dumps({"op": job.status, "id": job.id, "error": job.error, "result": job.result,
+                                   "finished_at": job.finished_at}) + "\n")
+                    lines += 1
+        os.replace(tmp_path, self.path)
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.path, "a", encoding="utf-8")
+        self._journal_lines = lines
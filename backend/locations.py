@@ -0,0 +1,204 @@
+import asyncio
+import json
+import threading
+import time
+
+ALL_DRIVERS = ("all",)
+
+
+def driver_topic(driver_id):
+    return ("driver", int(driver_id))
+
+
+class Subscription:
+    """
+    Hàng đợi của một người theo dõi. Chỉ giữ vị trí mới nhất của mỗi tài xế
+    (coalescing) và không gửi nhanh hơn min_interval giây (rate limit), nên
+    người theo dõi chậm không làm đầy bộ nhớ.
+    """
+
+    def __init__(self, hub, topic, min_interval=1.0):
+        self.hub = hub
+        self.topic = topic
+        self.min_interval = min_interval
+        self.closed = False
+        self._pending = {}
+        self._last_sent = 0.0
+        self._cond = threading.Condition()
+
+    def offer(self, driver_id, update):
+        with self._cond:
+            self._pending[driver_id] = update
+            self._cond.notify()
+
+    def next_batch(self, timeout=15.0):
+        """Chờ và trả về list cập nhật đã gộp; list rỗng nếu hết thời gian chờ."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not self.closed:
+                now = time.monotonic()
+                ready_at = self._last_sent + self.min_interval
+                if self._pending and now >= ready_at:
+                    batch = list(self._pending.values())
+                    self._pending = {}
+                    self._last_sent = now
+                    return batch
+                if now >= deadline:
+                    return []
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, ready_at - now)
+                self._cond.wait(wait)
+            return []
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self.hub.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """
+    Subscription cho chế độ asyncio: offer() được gọi từ thread bất kỳ và
+    đánh thức coroutine đang chờ qua call_soon_threadsafe, nên mỗi người
+    theo dõi chỉ tốn một coroutine thay vì một thread.
+    """
+
+    def __init__(self, hub, topic, min_interval=1.0, loop=None):
+        super().__init__(hub, topic, min_interval)
+        self.loop = loop or asyncio.get_running_loop()
+        self._event = asyncio.Event()
+
+    def _wake(self):
+        self.loop.call_soon_threadsafe(self._event.set)
+
+    def offer(self, driver_id, update):
+        with self._cond:
+            self._pending[driver_id] = update
+        self._wake()
+
+    async def next_batch_async(self, timeout=15.0):
+        """Như next_batch nhưng chờ trên event loop."""
+        deadline = time.monotonic() + timeout
+        while not self.closed:
+            # Xóa cờ trước khi kiểm tra để không bỏ lỡ offer() chen vào giữa
+            self._event.clear()
+            with self._cond:
+                now = time.monotonic()
+                ready_at = self._last_sent + self.min_interval
+                if self._pending and now >= ready_at:
+                    batch = list(self._pending.values())
+                    self._pending = {}
+                    self._last_sent = now
+                    return batch
+                wait = deadline - now
+                if self._pending:
+                    wait = min(wait, ready_at - now)
+            if now >= deadline:
+                return []
+            try:
+                await asyncio.wait_for(self._event.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        return []
+
+    def close(self):
+        super().close()
+        self._wake()
+
+
+class LocationHub:
+    """Lưu vị trí mới nhất của mỗi tài xế trong bộ nhớ và phát tới người theo dõi."""
+
+    def __init__(self):
+        self._latest = {}
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def get(self, driver_id):
+        return self._latest.get(int(driver_id))
+
+    def ingest(self, driver_id, pings):
+        """
+        Nhận một lô điểm GPS {"lat", "lng", "ts"} của một tài xế.
+        Chỉ điểm có ts mới nhất được giữ lại và phát đi; trả về điểm đó.
+        """
+        driver_id = int(driver_id)
+        latest = None
+        for ping in pings:
+            point = {
+                "driver_id": driver_id,
+                "lat": float(ping["lat"]),
+                "lng": float(ping.get("lng", ping.get("lon"))),
+                "ts": float(ping.get("ts") or time.time()),
+            }
+            if latest is None or point["ts"] >= latest["ts"]:
+                latest = point
+        if latest is None:
+            return None
+        with self._lock:
+            current = self._latest.get(driver_id)
+            if current is not None and current["ts"] > latest["ts"]:
+                return current
+            self._latest[driver_id] = latest
+            subscribers = list(self._subscribers.get(driver_topic(driver_id), ()))
+            subscribers += self._subscribers.get(ALL_DRIVERS, ())
+        for subscription in subscribers:
+            subscription.offer(driver_id, latest)
+        return latest
+
+    def subscribe(self, topic, min_interval=1.0, loop=None):
+        """loop: event loop của coroutine theo dõi (chế độ asyncio); None cho thread thường."""
+        if loop is not None:
+            subscription = AsyncSubscription(self, topic, min_interval, loop)
+        else:
+            subscription = Subscription(self, topic, min_interval)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subscribers.values())
+
+
+def sse_stream(subscription, initial=(), event="location", heartbeat=15.0, extra=None):
+    """Sinh các sự kiện Server-Sent Events cho một subscription cho tới khi client ngắt."""
+    try:
+        batch = list(initial)
+        while True:
+            if batch:
+                for update in batch:
+                    payload = dict(update, **extra) if extra else update
+                    yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            else:
+                # Dòng chú thích giữ kết nối khi không có cập nhật
+                yield ": keep-alive\n\n"
+            batch = subscription.next_batch(heartbeat)
+    finally:
+        subscription.close()
+
+
+async def sse_stream_async(subscription, initial=(), event="location", heartbeat=15.0, extra=None):
+    """Phiên bản async của sse_stream cho AsyncSubscription."""
+    try:
+        batch = list(initial)
+        while True:
+            if batch:
+                for update in batch:
+                    payload = dict(update, **extra) if extra else update
+                    yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            batch = await subscription.next_batch_async(heartbeat)
+    finally:
+        subscription.close()
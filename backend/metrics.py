@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Mốc (giây) mặc định của histogram độ trễ
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class JsonFormatter(logging.Formatter):
+    """Mỗi bản ghi log là một dòng JSON; các trường truyền qua extra={...} được giữ nguyên."""
+
+    _reserved = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        payload = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._reserved:
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    Cấu hình log cho toàn ứng dụng.
+    LOG_LEVEL: DEBUG/INFO/WARNING/... (mặc định INFO); LOG_FORMAT: text hoặc json.
+    """
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.environ.get("LOG_FORMAT", "text")
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Histogram với các mốc cố định; mỗi bộ nhãn giữ [số đếm theo mốc, tổng, số mẫu]."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, ([*s[0]], s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """
+    Tập các metric của tiến trình, xuất theo định dạng text của Prometheus.
+    detail (METRICS_DETAIL=1) bật các metric chi tiết trên đường nóng
+    (đọc store, số ứng viên ghép chuyến...); khi tắt, nơi gọi chỉ tốn một
+    phép kiểm tra thuộc tính.
+    """
+
+    def __init__(self, detail=False):
+        self.detail = detail
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(detail=os.environ.get("METRICS_DETAIL", "0").lower() in ("1", "true", "yes"))
+
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request theo route",
+    ("method", "route", "status"))
+STORAGE_OPS = registry.counter(
+    "storage_operations_total", "Số thao tác đọc/ghi store theo collection (chi tiết)",
+    ("op", "collection"))
+STORAGE_SECONDS = registry.histogram(
+    "storage_write_duration_seconds", "Thời gian ghi WAL, snapshot và file JSON",
+    ("target",))
+STORAGE_BYTES = registry.counter(
+    "storage_bytes_serialized_total", "Số byte JSON đã ghi/đọc",
+    ("target", "direction"))
+MATCH_CANDIDATES = registry.counter(
+    "matching_candidates_examined_total", "Số tài xế được tính khoảng cách khi ghép chuyến (chi tiết)")
+MATCH_SECONDS = registry.histogram(
+    "matching_solve_duration_seconds", "Thời gian tìm/ghép tài xế",
+    ("mode",))
+JOBS = registry.counter(
+    "jobs_total", "Số công việc nền theo loại và kết quả (enqueued, deduplicated, retried, done, failed)",
+    ("kind", "outcome"))
+JOB_SECONDS = registry.histogram(
+    "job_duration_seconds", "Thời gian chạy một lần công việc nền",
+    ("kind",))
@@ -1,88 +1,396 @@
+import heapq
+import logging
 import random
-from math import radians, sin, cos, sqrt, atan2
-
-class Customer:
-    def __init__(self, id, name, phone, email, password):
-        self.id = id
-        self.name = name        
-        self.phone = phone
-        self.email = email
-        self.password = password
-
-class Driver:
-    def __init__(self, id, name, vehicle_info, phone, email, password):
-        self.id = id
-        self.name = name
-        self.phone = phone
-        self.email = email
-        self.password = password
-        self.vehicle_info = vehicle_info
-        self.status = "available"
-
-class RideRequest:
-    def __init__(self, id, pickup, dropoff, vehicle_type, estimated_price=None, estimated_distance=None, estimated_duration=None):
-        self.id = id
-        self.pickup = pickup
-        self.dropoff = dropoff
-        self.vehicle_type = vehicle_type
-        self.estimated_price = estimated_price
-        self.estimated_distance = estimated_distance
-        self.estimated_duration = estimated_duration
-        self.status = "pending"
-        self.driver_id = None
-        self.fare = estimated_price
+import sys
+import time
+from array import array
+from datetime import datetime
+from math import radians, sin, cos, sqrt, atan2, asin
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn, thiếu thì dùng vòng lặp Python
+    np = None
+
+from metrics import registry, MATCH_CANDIDATES, MATCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371  # Bán kính trái đất (km)
+# Số ô tối đa của một khối ma trận khoảng cách tính cùng lúc (giới hạn bộ nhớ tạm)
+MATRIX_BLOCK_CELLS = 1 << 22
+
+def _intern(value):
+    # Trạng thái, loại xe, địa chỉ lặp lại rất nhiều lần: dùng chung một đối tượng chuỗi
+    return sys.intern(value) if type(value) is str else value
+
+
+def _int_or_none(value):
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _float_or_none(value):
+    return None if value is None else float(value)
 
-class RideMatchingService:
-    @staticmethod
-    def find_closest_driver(drivers, pickup_location, vehicle_type=None):
-        closest_driver = None
-        min_distance = float('inf')
 
+class Location:
+    """Tọa độ (và địa chỉ nếu có); đọc được như dict {"lat", "lng", "address"}."""
+
+    __slots__ = ("lat", "lng", "address")
+
+    def __init__(self, lat, lng, address=None):
+        self.lat = lat
+        self.lng = lng
+        self.address = address
+
+    @classmethod
+    def from_value(cls, value):
+        """Nhận Location, dict {"lat", "lng"|"lon", "address"} hoặc None."""
+        if value is None or isinstance(value, cls):
+            return value
+        lng = value.get("lng")
+        if lng is None:
+            lng = value.get("lon")
+        return cls(float(value["lat"]), float(lng), _intern(value.get("address")))
+
+    def to_dict(self):
+        if self.address is None:
+            return {"lat": self.lat, "lng": self.lng}
+        return {"lat": self.lat, "lng": self.lng, "address": self.address}
+
+    def __getitem__(self, key):
+        if key == "lat":
+            return self.lat
+        if key == "lng":
+            return self.lng
+        if key == "address" and self.address is not None:
+            return self.address
+        raise KeyError(key)
+
+    def get(self, key, default=None):
         try:
-            pickup_lat = float(pickup_location.get("lat", 0))
-            pickup_lng = float(pickup_location.get("lng", 0))
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def __eq__(self, other):
+        if isinstance(other, Location):
+            return (self.lat, self.lng, self.address) == (other.lat, other.lng, other.address)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Location({self.lat!r}, {self.lng!r}, {self.address!r})"
+
+
+class Record:
+    """
+    Bản ghi với schema cố định: mỗi trường trong FIELDS là một slot, trường
+    lạ (không thuộc schema) nằm trong extra. Đọc/ghi được như dict
+    (record["x"], get, update, dict(record)) nên các chỗ dùng bản ghi cũ
+    không phải đổi; JSON đi qua to_dict() (utils.dumps, jsonify).
+    CONVERTERS chuẩn hóa giá trị khi gán (kiểu số, Location, intern chuỗi).
+    """
+
+    __slots__ = ("extra",)
+    FIELDS = ()
+    CONVERTERS = {}
+    _field_set = frozenset()
+    _row_slots = ("extra",)
+    _location_fields = ()
+    _location_positions = ()
+
+    def __init__(self, **fields):
+        converters = self.CONVERTERS
+        for name in self.FIELDS:
+            value = fields.pop(name, None)
+            converter = converters.get(name)
+            if converter is not None and value is not None:
+                value = converter(value)
+            setattr(self, name, value)
+        self.extra = fields or None
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Tạo bản ghi từ dict đã lưu (kể cả dạng cũ); bản ghi cùng loại được
+        dùng lại. Không áp giá trị mặc định của __init__ (dành cho bản ghi mới).
+        """
+        if isinstance(data, cls):
+            return data
+        record = cls.__new__(cls)
+        Record.__init__(record, **cls.normalize(dict(data)))
+        return record
+
+    @staticmethod
+    def normalize(data):
+        """Đổi các khóa/giá trị kiểu cũ sang schema hiện tại (lớp con ghi đè)."""
+        return data
+
+    def to_row(self):
+        """
+        Tuple giá trị theo thứ tự FIELDS rồi tới extra (dạng lưu của
+        snapshot.py); Location được ghi thành tuple (lat, lng, address).
+        Chiều ngược lại là cls.from_row(row), sinh sẵn cho từng lớp con.
+        """
+        row = [getattr(self, name) for name in self.FIELDS]
+        for i in self._location_positions:
+            value = row[i]
+            if value is not None:
+                row[i] = (value.lat, value.lng, value.address)
+        row.append(self.extra)
+        return tuple(row)
+
+    def to_dict(self):
+        data = {}
+        for name in self.FIELDS:
+            value = getattr(self, name)
+            data[name] = value.to_dict() if isinstance(value, Location) else value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._field_set:
+            return getattr(self, key)
+        if self.extra:
+            return self.extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        if key in self._field_set:
+            converter = self.CONVERTERS.get(key)
+            if converter is not None and value is not None:
+                value = converter(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in self._field_set or bool(self.extra and key in self.extra)
+
+    def update(self, changes):
+        for key, value in changes.items():
+            self[key] = value
+
+    def keys(self):
+        if self.extra:
+            return list(self.FIELDS) + list(self.extra)
+        return list(self.FIELDS)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.FIELDS) + (len(self.extra) if self.extra else 0)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Record) else other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
 
-            print(f"Looking for drivers near ({pickup_lat}, {pickup_lng})")
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.FIELDS)
+        cls._row_slots = tuple(cls.FIELDS) + ("extra",)
+        cls._location_fields = tuple(name for name in cls.FIELDS
+                                     if cls.CONVERTERS.get(name) == Location.from_value)
+        cls._location_positions = tuple(cls.FIELDS.index(name) for name in cls._location_fields)
+        cls.from_row = staticmethod(_row_reader(cls))
 
-            # Lọc trước các tài xế hợp lệ
-            available_drivers = [
-                d for d in drivers
-                if d.get("status") == "available" and 
-                (not vehicle_type or d.get("vehicle_type") == vehicle_type)
-            ]
 
-            for driver in available_drivers:
-                driver_location = driver.get("current_location", driver.get("location", {}))
+def _row_reader(cls):
+    """
+    Sinh hàm row -> bản ghi (ngược với to_row) cho một lớp Record, viết thẳng
+    từng phép gán như namedtuple/dataclasses: nhanh hơn vòng lặp setattr vài
+    lần khi nạp hàng triệu bản ghi từ snapshot. row phải theo đúng FIELDS
+    hiện tại và không qua CONVERTERS.
+    """
+    lines = [
+        "def from_row(row):",
+        "    record = new(cls)",
+        "    " + ", ".join(f"record.{name}" for name in cls._row_slots) + ", = row",
+    ]
+    for name in cls._location_fields:
+        lines += [
+            f"    value = record.{name}",
+            "    if value is not None:",
+            "        location = new(Location)",
+            "        location.lat, location.lng, location.address = value",
+            f"        record.{name} = location",
+        ]
+    lines.append("    return record")
+    namespace = {"new": object.__new__, "cls": cls, "Location": Location}
+    exec("\n".join(lines), namespace)
+    return namespace["from_row"]
 
-                if not driver_location or not isinstance(driver_location, dict):
-                    print(f"- No valid location data for driver {driver.get('id')}")
-                    continue
 
-                try:
-                    driver_lat = float(driver_location.get("lat", 0))
-                    driver_lng = float(driver_location.get("lng", driver_location.get("lon", 0)))
+class Customer(Record):
+    __slots__ = ("id", "name", "phone", "email", "password")
+    FIELDS = __slots__
+    CONVERTERS = {"id": int}
 
-                    distance = RideMatchingService.calculate_distance(
-                        driver_lat, driver_lng, pickup_lat, pickup_lng
-                    )
+    def __init__(self, id=None, name=None, phone=None, email=None, password=None, **extra):
+        super().__init__(id=id, name=name, phone=phone, email=email, password=password, **extra)
 
-                    if distance < min_distance:
-                        min_distance = distance
-                        closest_driver = driver
 
-                except (ValueError, TypeError) as e:
-                    print(f"- Error calculating distance for driver {driver.get('id')}: {e}")
-                    continue
+class Driver(Record):
+    __slots__ = ("id", "name", "phone", "email", "password", "vehicle_type", "vehicle_info",
+                 "status", "available", "rating", "total_rides", "current_location")
+    FIELDS = __slots__
+    CONVERTERS = {"id": int, "vehicle_type": _intern, "status": _intern, "available": bool,
+                  "rating": float, "total_rides": int, "current_location": Location.from_value}
 
+    def __init__(self, id=None, name=None, vehicle_info=None, phone=None, email=None, password=None,
+                 vehicle_type=None, status="available", available=None, rating=None, total_rides=None,
+                 current_location=None, **extra):
+        if available is None:
+            available = status == "available"
+        super().__init__(id=id, name=name, vehicle_info=vehicle_info, phone=phone, email=email,
+                         password=password, vehicle_type=vehicle_type, status=status, available=available,
+                         rating=rating, total_rides=total_rides, current_location=current_location, **extra)
+
+    @staticmethod
+    def normalize(data):
+        # Bản ghi cũ lưu vị trí ở "location", hoặc chỉ có một trong hai cờ status/available
+        location = data.pop("location", None)
+        if data.get("current_location") is None:
+            data["current_location"] = location
+        if data.get("status") is None:
+            data["status"] = "available" if data.get("available", True) else "busy"
+        if data.get("available") is None:
+            data["available"] = data["status"] == "available"
+        return data
+
+
+class Ride(Record):
+    __slots__ = ("id", "customer_id", "driver_id", "pickup", "dropoff", "vehicle_type", "status",
+                 "estimated_price", "estimated_distance", "estimated_duration", "fare", "rating",
+                 "created_at", "completed_at", "payment_method", "payment_status", "charge_id",
+                 "driver_counted")
+    FIELDS = __slots__
+    CONVERTERS = {"id": int, "customer_id": _int_or_none, "driver_id": _int_or_none,
+                  "pickup": Location.from_value, "dropoff": Location.from_value,
+                  "vehicle_type": _intern, "status": _intern,
+                  "estimated_distance": _float_or_none, "estimated_duration": _float_or_none,
+                  "payment_method": _intern, "payment_status": _intern}
+
+    def __init__(self, id=None, pickup=None, dropoff=None, vehicle_type=None, estimated_price=None,
+                 estimated_distance=None, estimated_duration=None, status="pending", driver_id=None,
+                 customer_id=None, fare=None, rating=None, created_at=None, completed_at=None,
+                 payment_method=None, payment_status=None, charge_id=None, driver_counted=None, **extra):
+        if fare is None:
+            fare = estimated_price
+        if created_at is None:
+            created_at = datetime.now().isoformat(timespec="seconds")
+        super().__init__(id=id, customer_id=customer_id, driver_id=driver_id, pickup=pickup,
+                         dropoff=dropoff, vehicle_type=vehicle_type, status=status,
+                         estimated_price=estimated_price, estimated_distance=estimated_distance,
+                         estimated_duration=estimated_duration, fare=fare, rating=rating,
+                         created_at=created_at, completed_at=completed_at, payment_method=payment_method,
+                         payment_status=payment_status, charge_id=charge_id, driver_counted=driver_counted,
+                         **extra)
+
+
+# Model của từng collection trong store
+MODELS = {"customers": Customer, "drivers": Driver, "rides": Ride}
+
+
+class RideMatchingService:
+    @staticmethod
+    def get_driver_coordinates(driver):
+        """Trả về (lat, lng) của tài xế hoặc None nếu không có vị trí hợp lệ."""
+        driver_location = driver.get("current_location", driver.get("location", {}))
+        if not driver_location or not hasattr(driver_location, "get"):
+            return None
+        try:
+            return (
+                float(driver_location.get("lat", 0)),
+                float(driver_location.get("lng", driver_location.get("lon", 0)))
+            )
+        except (ValueError, TypeError):
+            return None
+
+    @staticmethod
+    def find_candidate_drivers(pickup_location, vehicle_type=None, index=None, k=5, eta=None):
+        """
+        Trả về tối đa k tài xế rảnh gần điểm đón nhất, gần nhất đứng đầu.
+        Nếu có eta(driver, pickup) thì xếp lại theo thời gian tới điểm đón.
+        """
+        try:
+            pickup_lat = float(pickup_location.get("lat", 0))
+            pickup_lng = float(pickup_location.get("lng", 0))
+        except (ValueError, TypeError, AttributeError):
+            return []
+        with MATCH_SECONDS.time(mode="candidates"):
+            drivers = [driver for _, driver in index.nearest(pickup_lat, pickup_lng, vehicle_type=vehicle_type, k=k)]
+            if eta is not None:
+                drivers.sort(key=lambda driver: eta(driver, pickup_location))
+        return drivers
+
+    @staticmethod
+    def find_closest_driver(drivers, pickup_location, vehicle_type=None, index=None, eta=None, k=5):
+        """
+        Tìm tài xế rảnh gần điểm đón nhất.
+        Nếu có index (spatial.DriverIndex) thì chỉ xét các ô lưới lân cận,
+        ngược lại duyệt toàn bộ danh sách drivers.
+        Nếu có eta(driver, pickup) thì chọn trong k tài xế gần nhất người tới
+        điểm đón sớm nhất thay vì người gần nhất theo đường chim bay.
+        """
+        closest_driver = None
+        min_distance = float('inf')
+
+        started = time.perf_counter()
+        try:
+            pickup_lat = float(pickup_location.get("lat", 0))
+            pickup_lng = float(pickup_location.get("lng", 0))
+
+            limit = k if eta is not None else 1
+            if index is not None:
+                matches = index.nearest(pickup_lat, pickup_lng, vehicle_type=vehicle_type, k=limit)
+            else:
+                engine = DistanceEngine.from_drivers(drivers, vehicle_type=vehicle_type)
+                if registry.detail:
+                    MATCH_CANDIDATES.inc(len(engine.records))
+                matches = engine.top_k(pickup_lat, pickup_lng, limit)
+            if eta is not None:
+                matches.sort(key=lambda match: eta(match[1], pickup_location))
+            if matches:
+                min_distance, closest_driver = matches[0]
+
+            MATCH_SECONDS.observe(time.perf_counter() - started, mode="closest")
             if closest_driver:
-                print(f"Found closest driver: {closest_driver.get('id')} at distance: {min_distance:.2f} km")
+                logger.debug("Found closest driver: %s at distance: %.2f km", closest_driver.get("id"), min_distance)
             else:
-                print("No available drivers found")
+                logger.debug("No available drivers found")
 
             return closest_driver
 
-        except Exception as e:
-            print(f"Error in find_closest_driver: {e}")
+        except Exception:
+            logger.exception("Error in find_closest_driver")
             return None
 
 
@@ -92,7 +400,7 @@ class RideMatchingService:
         Tính khoảng cách giữa hai điểm dựa trên tọa độ
         Sử dụng công thức Haversine
         """
-        R = 6371  # Bán kính trái đất (km)
+        R = EARTH_RADIUS_KM
         
         lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
         
@@ -105,10 +413,125 @@ class RideMatchingService:
         
         return distance
 
-class Payment:
-    @staticmethod
-    def process(amount, method="credit_card"):
-        return {
-            "success": True,
-            "message": f"Thanh toán {amount}$ bằng {method} thành công."
-        }
+def _unit_vectors(lat_r, lng_r, cos_lat):
+    """Tọa độ (radian) -> vector đơn vị trên mặt cầu, mỗi điểm một hàng."""
+    return np.column_stack((cos_lat * np.cos(lng_r), cos_lat * np.sin(lng_r), np.sin(lat_r)))
+
+
+def haversine_rad(lat, lng, cos_lat, lat_r, lng_r, cos_r):
+    """Haversine với tọa độ đã đổi sang radian và cos(lat) đã tính sẵn."""
+    if np is not None:
+        a = np.sin((lat_r - lat) / 2) ** 2 + cos_lat * cos_r * np.sin((lng_r - lng) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    out = []
+    for la, ln, cl in zip(lat_r, lng_r, cos_r):
+        a = sin((la - lat) / 2) ** 2 + cos_lat * cl * sin((ln - lng) / 2) ** 2
+        out.append(2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0))))
+    return out
+
+
+class DistanceEngine:
+    """
+    Bộ tính khoảng cách hàng loạt.
+    Giữ tọa độ các ứng viên trong mảng float64 liên tục (radian, kèm cos(lat)
+    tính sẵn) để tính khoảng cách từ một hay nhiều điểm đón trong một lượt.
+    """
+
+    def __init__(self, records=(), coords=()):
+        self.records = list(records)
+        lats = array("d", (radians(lat) for lat, _ in coords))
+        lngs = array("d", (radians(lng) for _, lng in coords))
+        if np is not None:
+            self.lat_r = np.frombuffer(lats, dtype=np.float64)
+            self.lng_r = np.frombuffer(lngs, dtype=np.float64)
+            self.cos_lat = np.cos(self.lat_r)
+            # Vector đơn vị 3 chiều: khoảng cách càng nhỏ thì tích vô hướng càng lớn
+            self.unit = _unit_vectors(self.lat_r, self.lng_r, self.cos_lat)
+        else:
+            self.lat_r = lats
+            self.lng_r = lngs
+            self.cos_lat = array("d", (cos(x) for x in lats))
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_drivers(cls, drivers, vehicle_type=None):
+        """Tạo engine từ các tài xế rảnh (đúng loại xe) có vị trí hợp lệ."""
+        records, coords = [], []
+        for driver in drivers:
+            if driver.get("status") != "available":
+                continue
+            if vehicle_type and driver.get("vehicle_type") != vehicle_type:
+                continue
+            point = RideMatchingService.get_driver_coordinates(driver)
+            if point is not None:
+                records.append(driver)
+                coords.append(point)
+        return cls(records, coords)
+
+    def distances_from(self, lat, lng):
+        """Khoảng cách (km) từ một điểm tới mọi ứng viên."""
+        lat, lng = float(lat), float(lng)
+        return haversine_rad(radians(lat), radians(lng), cos(radians(lat)),
+                              self.lat_r, self.lng_r, self.cos_lat)
+
+    def top_k(self, lat, lng, k):
+        """Trả về k cặp (khoảng cách, record) gần nhất, tăng dần theo khoảng cách."""
+        if not self.records or k <= 0:
+            return []
+        distances = self.distances_from(lat, lng)
+        if np is not None:
+            k = min(k, len(distances))
+            idx = np.argpartition(distances, k - 1)[:k]
+            idx = idx[np.argsort(distances[idx])]
+        else:
+            idx = heapq.nsmallest(k, range(len(distances)), key=distances.__getitem__)
+        return [(float(distances[i]), self.records[i]) for i in idx]
+
+    def distance_matrix(self, points):
+        """Ma trận khoảng cách (km): mỗi hàng ứng với một điểm (lat, lng) trong points."""
+        if np is not None and len(points) and len(self):
+            pts = np.radians(np.asarray(points, dtype=np.float64)).reshape(-1, 2)
+            lat = pts[:, 0:1]
+            lng = pts[:, 1:2]
+            return haversine_rad(lat, lng, np.cos(lat), self.lat_r, self.lng_r, self.cos_lat)
+        return [self.distances_from(lat, lng) for lat, lng in points]
+
+    def top_k_many(self, points, k, max_radius_km=None):
+        """
+        top_k cho nhiều điểm cùng lúc: với mỗi điểm trong points trả về tối đa
+        k cặp (khoảng cách, record) gần nhất, bỏ các ứng viên xa hơn max_radius_km.
+        """
+        if not self.records or k <= 0:
+            return [[] for _ in points]
+        k = min(k, len(self.records))
+        if np is None:
+            results = []
+            for distances in self.distance_matrix(points):
+                idx = heapq.nsmallest(k, range(len(distances)), key=distances.__getitem__)
+                results.append([(distances[i], self.records[i]) for i in idx
+                                 if max_radius_km is None or distances[i] <= max_radius_km])
+            return results
+        # Chọn k ứng viên theo tích vô hướng (một phép nhân ma trận) rồi chỉ tính
+        # haversine cho các cặp đã chọn thay vì cho cả ma trận
+        pts = np.radians(np.asarray(points, dtype=np.float64)).reshape(-1, 2)
+        lat = pts[:, 0:1]
+        lng = pts[:, 1:2]
+        cos_lat = np.cos(lat)
+        unit = _unit_vectors(lat[:, 0], lng[:, 0], cos_lat[:, 0])
+        results = []
+        step = max(1, MATRIX_BLOCK_CELLS // len(self.records))
+        for start in range(0, len(points), step):
+            rows = slice(start, start + step)
+            dots = unit[rows] @ self.unit.T
+            idx = np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            nearest = haversine_rad(lat[rows], lng[rows], cos_lat[rows],
+                                    self.lat_r[idx], self.lng_r[idx], self.cos_lat[idx])
+            order = np.argsort(nearest, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            for row_idx, row_distances in zip(idx.tolist(), nearest.tolist()):
+                results.append([(d, self.records[i]) for i, d in zip(row_idx, row_distances)
+                                if max_radius_km is None or d <= max_radius_km])
+        return results
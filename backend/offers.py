@@ -0,0 +1,381 @@
+"""
+Ghép chuyến qua lời mời (DISPATCH_MODE=offer).
+
+Thay vì giữ ngay tài xế gần nhất, yêu cầu đặt xe được gửi lần lượt tới
+các tài xế ứng viên dưới dạng lời mời. Mỗi tài xế có một hộp thư lời mời
+(long-poll qua GET /api/driver/<id>/offers). Tài xế nhận thì chuyến đi
+được tạo và tài xế chuyển sang bận; tài xế từ chối hoặc để quá hạn thì
+lời mời chuyển sang ứng viên kế tiếp từ chỉ mục không gian.
+
+Mọi hạn chờ của lời mời nằm trong một heap hẹn giờ (timers.TimerQueue)
+do một thread duy nhất xử lý, nên hàng nghìn lời mời đang chờ không tốn
+thread nào. Khách hàng chờ kết quả qua submit() (chặn thread, tối đa
+max_wait giây) hoặc submit_async() (một coroutine, chế độ ASGI).
+
+Khóa chung chỉ giữ khi đọc/ghi trạng thái lời mời; tìm ứng viên (search)
+và giữ tài xế (reserve) chạy ngoài khóa để một lần tìm hay ghi store chậm
+không chặn mọi tài xế và khách hàng khác.
+
+Trạng thái nằm trong bộ nhớ của từng worker: tài xế cần long-poll về cùng
+worker đã nhận yêu cầu đặt xe (sticky session), giống stream vị trí.
+"""
+import asyncio
+import itertools
+import logging
+import threading
+import time
+
+from timers import TimerQueue
+
+logger = logging.getLogger(__name__)
+
+
+class _Offer:
+    def __init__(self, offer_id, dispatch, driver, timeout):
+        self.id = offer_id
+        self.dispatch = dispatch
+        self.driver = driver
+        self.status = "pending"  # pending -> accepted | declined | expired | withdrawn
+        self.expires_at = time.time() + timeout
+        self.timer = None
+
+    def to_dict(self):
+        ride = self.dispatch.ride
+        return {
+            "id": self.id,
+            "ride_id": ride["id"],
+            "expires_at": round(self.expires_at, 3),
+            "expires_in": max(0.0, round(self.expires_at - time.time(), 1)),
+            "pickup": ride["pickup"],
+            "dropoff": ride["dropoff"],
+            "vehicle_type": ride["vehicle_type"],
+            "fare": ride["fare"],
+            "estimated_distance": ride["estimated_distance"],
+            "estimated_duration": ride["estimated_duration"],
+        }
+
+
+class _Dispatch:
+    """Một yêu cầu đặt xe đang được mời lần lượt các tài xế."""
+
+    def __init__(self, pickup, vehicle_type, ride):
+        self.pickup = pickup
+        self.vehicle_type = vehicle_type
+        self.ride = ride
+        self.submitted_at = time.time()
+        self.tried = set()
+        self.queue = []
+        self.offer = None
+        self.offers_sent = 0
+        self.cancelled = False
+        self.result = None
+        self.done = threading.Event()
+        # Giữ khi hủy và khi giữ tài xế để hai việc không chen nhau
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def finish(self, result=None):
+        self.result = result
+        self.done.set()
+        for callback in self.callbacks:
+            callback(self)
+
+
+class _Inbox:
+    """Hộp thư lời mời của một tài xế: các lời mời đang chờ và người đang long-poll."""
+
+    def __init__(self, lock):
+        self.offers = {}
+        self.cond = threading.Condition(lock)
+        self.callbacks = set()
+
+    def notify(self):
+        self.cond.notify_all()
+        for callback in list(self.callbacks):
+            callback()
+
+
+class OfferDispatcher:
+    """
+    Máy trạng thái ghép chuyến qua lời mời, cùng giao diện submit/
+    submit_async/stats với dispatch.BatchDispatcher.
+
+    search(pickup, vehicle_type, k) -> list tài xế rảnh, tốt nhất đứng đầu.
+    reserve(driver, ride) -> bool: giữ tài xế và tạo chuyến đi (compare-and-set).
+    Mỗi tài xế chỉ giữ một lời mời tại một thời điểm; mỗi yêu cầu mời tối đa
+    max_offers tài xế, mỗi lời mời chờ timeout giây. submit() chặn thread
+    gọi tối đa max_wait giây (None: tới khi mời hết max_offers tài xế).
+    """
+
+    def __init__(self, search, reserve, timeout=15.0, candidates=5, max_offers=10, timers=None, max_wait=None):
+        self.search = search
+        self.reserve = reserve
+        self.timeout = timeout
+        self.candidates = candidates
+        self.max_offers = max_offers
+        self.max_wait = max_wait
+        self.timers = timers or TimerQueue("offer-timers")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._offers = {}
+        self._inboxes = {}
+        self._stats = {
+            "requests": 0,
+            "matched": 0,
+            "unmatched": 0,
+            "offers_sent": 0,
+            "accepted": 0,
+            "declined": 0,
+            "expired": 0,
+            "total_wait_ms": 0.0,
+        }
+
+    def start(self):
+        self.timers.start()
+        return self
+
+    # ------------------------------------------------------------------
+    # Phía khách hàng
+    # ------------------------------------------------------------------
+
+    def _default_timeout(self):
+        return self.timeout * self.max_offers + 5
+
+    def _begin(self, dispatch):
+        with self._lock:
+            self._stats["requests"] += 1
+        self._offer_next(dispatch)
+        return dispatch
+
+    def submit(self, pickup, vehicle_type, ride=None, timeout=None):
+        """
+        Mời lần lượt các tài xế và chờ tới khi có người nhận.
+        Trả về dict {"driver", "ride_id", "dispatch"} hoặc None nếu không ai nhận.
+        """
+        if timeout is None:
+            timeout = self._default_timeout()
+            if self.max_wait is not None:
+                timeout = min(timeout, self.max_wait)
+        dispatch = self._begin(_Dispatch(pickup, vehicle_type, ride))
+        if not dispatch.done.wait(timeout):
+            self.cancel(dispatch)
+        return dispatch.result
+
+    async def submit_async(self, pickup, vehicle_type, ride=None, timeout=None):
+        """Như submit nhưng chờ trên event loop thay vì chặn một thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve(dispatch):
+            if not future.done():
+                future.set_result(dispatch.result)
+
+        dispatch = _Dispatch(pickup, vehicle_type, ride)
+        dispatch.callbacks.append(lambda dispatch: loop.call_soon_threadsafe(resolve, dispatch))
+        self._begin(dispatch)
+        try:
+            return await asyncio.wait_for(future, self._default_timeout() if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.cancel(dispatch)
+            return dispatch.result
+
+    def cancel(self, dispatch):
+        """
+        Khách hàng thôi chờ: rút lời mời đang chờ (nếu chưa có tài xế nhận).
+        Đang giữ tài xế cho lời mời vừa được nhận thì chờ việc đó xong.
+        """
+        with dispatch.lock, self._lock:
+            if dispatch.done.is_set():
+                return
+            dispatch.cancelled = True
+            if dispatch.offer is not None:
+                self._close_offer(dispatch.offer, "withdrawn")
+            self._finish(dispatch, None)
+
+    # ------------------------------------------------------------------
+    # Phía tài xế
+    # ------------------------------------------------------------------
+
+    def _inbox(self, driver_id):
+        inbox = self._inboxes.get(driver_id)
+        if inbox is None:
+            inbox = self._inboxes[driver_id] = _Inbox(self._lock)
+        return inbox
+
+    def pending(self, driver_id):
+        """Các lời mời đang chờ tài xế trả lời."""
+        with self._lock:
+            return [offer.to_dict() for offer in self._inbox(int(driver_id)).offers.values()]
+
+    def wait(self, driver_id, timeout=25.0):
+        """Long-poll: trả về ngay nếu có lời mời, nếu không chờ tối đa timeout giây."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            inbox = self._inbox(int(driver_id))
+            while not inbox.offers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                inbox.cond.wait(remaining)
+            return [offer.to_dict() for offer in inbox.offers.values()]
+
+    async def wait_async(self, driver_id, timeout=25.0):
+        """Như wait nhưng chờ trên event loop."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(event.set)
+
+        driver_id = int(driver_id)
+        with self._lock:
+            inbox = self._inbox(driver_id)
+            if inbox.offers:
+                return [offer.to_dict() for offer in inbox.offers.values()]
+            inbox.callbacks.add(wake)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                inbox.callbacks.discard(wake)
+        return self.pending(driver_id)
+
+    def accept(self, driver_id, offer_id):
+        """
+        Tài xế nhận lời mời. Trả về kết quả ghép {"driver", "ride_id", "dispatch"} hoặc
+        None nếu lời mời không còn hiệu lực (hết hạn, đã bị rút) hoặc tài xế
+        không còn rảnh - khi đó yêu cầu được chuyển cho ứng viên kế tiếp.
+        """
+        with self._lock:
+            offer = self._offers.get(int(offer_id))
+            if offer is None or offer.driver["id"] != int(driver_id) or offer.status != "pending":
+                return None
+            dispatch = offer.dispatch
+            self._close_offer(offer, "accepted")
+        # Giữ tài xế ngoài khóa chung; khóa của yêu cầu ngăn khách hàng hủy giữa chừng
+        with dispatch.lock:
+            if dispatch.cancelled:
+                return None
+            reserved = self.reserve(offer.driver, dispatch.ride)
+            if reserved:
+                with self._lock:
+                    self._stats["accepted"] += 1
+                    result = {
+                        "driver": offer.driver,
+                        "ride_id": dispatch.ride["id"],
+                        "dispatch": {
+                            "mode": "offer",
+                            "offers_sent": dispatch.offers_sent,
+                            "wait_ms": round((time.time() - dispatch.submitted_at) * 1000, 1),
+                        },
+                    }
+                    self._finish(dispatch, result)
+                return result
+        logger.info("Driver %s accepted offer %s but is no longer available", driver_id, offer_id)
+        self._offer_next(dispatch)
+        return None
+
+    def decline(self, driver_id, offer_id):
+        """Tài xế từ chối; trả về False nếu lời mời không còn hiệu lực."""
+        with self._lock:
+            offer = self._offers.get(int(offer_id))
+            if offer is None or offer.driver["id"] != int(driver_id) or offer.status != "pending":
+                return False
+            self._stats["declined"] += 1
+            self._close_offer(offer, "declined")
+        self._offer_next(offer.dispatch)
+        return True
+
+    def _expire(self, offer):
+        # Chạy trên thread của TimerQueue
+        with self._lock:
+            if offer.status != "pending":
+                return
+            logger.debug("Offer %s to driver %s expired", offer.id, offer.driver["id"])
+            self._stats["expired"] += 1
+            self._close_offer(offer, "expired")
+        self._offer_next(offer.dispatch)
+
+    # ------------------------------------------------------------------
+    # Máy trạng thái (gọi khi đang giữ _lock, trừ _offer_next)
+    # ------------------------------------------------------------------
+
+    def _close_offer(self, offer, status):
+        offer.status = status
+        if offer.timer is not None:
+            offer.timer.cancel()
+        self._offers.pop(offer.id, None)
+        self._inbox(offer.driver["id"]).offers.pop(offer.id, None)
+        if offer.dispatch.offer is offer:
+            offer.dispatch.offer = None
+
+    def _next_candidate(self, dispatch):
+        """Ứng viên kế tiếp trong hàng đợi của yêu cầu, hoặc None nếu hàng đợi đã hết."""
+        while dispatch.queue:
+            driver = dispatch.queue.pop(0)
+            dispatch.tried.add(driver["id"])
+            # Tài xế đang cân nhắc lời mời khác hoặc vừa bận thì bỏ qua
+            if self._inbox(driver["id"]).offers or driver.get("status") != "available":
+                continue
+            return driver
+        return None
+
+    def _offer_next(self, dispatch):
+        """
+        Gửi lời mời tới ứng viên kế tiếp (gọi khi không giữ _lock). Hết ứng
+        viên thì tìm thêm ngoài khóa; không còn ai thì kết thúc yêu cầu.
+        Mỗi yêu cầu chỉ có một lời mời đang chờ nên không có hai lời gọi
+        chạy song song cho cùng một yêu cầu.
+        """
+        while True:
+            with self._lock:
+                if dispatch.cancelled or dispatch.done.is_set():
+                    return
+                driver = None
+                if dispatch.offers_sent < self.max_offers:
+                    driver = self._next_candidate(dispatch)
+                if driver is not None:
+                    self._send_offer(dispatch, driver)
+                    return
+                if dispatch.offers_sent >= self.max_offers or len(dispatch.tried) >= self.max_offers * 2:
+                    self._finish(dispatch, None)
+                    return
+                # Mở rộng tìm kiếm không gian, bỏ các tài xế đã mời/bỏ qua
+                k = len(dispatch.tried) + self.candidates
+            drivers = self.search(dispatch.pickup, dispatch.vehicle_type, k)
+            with self._lock:
+                if dispatch.cancelled or dispatch.done.is_set():
+                    return
+                dispatch.queue = [driver for driver in drivers if driver["id"] not in dispatch.tried]
+                if not dispatch.queue:
+                    self._finish(dispatch, None)
+                    return
+
+    def _send_offer(self, dispatch, driver):
+        offer = _Offer(next(self._ids), dispatch, driver, self.timeout)
+        dispatch.offer = offer
+        dispatch.offers_sent += 1
+        self._stats["offers_sent"] += 1
+        self._offers[offer.id] = offer
+        inbox = self._inbox(driver["id"])
+        inbox.offers[offer.id] = offer
+        offer.timer = self.timers.call_later(self.timeout, self._expire, offer)
+        inbox.notify()
+        logger.debug("Offered ride %s to driver %s (offer %s)", dispatch.ride["id"], driver["id"], offer.id)
+
+    def _finish(self, dispatch, result):
+        self._stats["matched" if result else "unmatched"] += 1
+        self._stats["total_wait_ms"] += (time.time() - dispatch.submitted_at) * 1000
+        dispatch.finish(result)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["outstanding_offers"] = len(self._offers)
+        finished = stats["matched"] + stats["unmatched"]
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / finished, 2) if finished else 0
+        stats["offer_timeout_seconds"] = self.timeout
+        stats["timers"] = len(self.timers)
+        return stats
@@ -0,0 +1,109 @@
+import base64
+import json
+from itertools import islice
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def encode_cursor(key):
+    raw = json.dumps(list(key), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Giải mã con trỏ thành khóa (created_at, id); ném ValueError nếu không hợp lệ."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, ride_id = json.loads(raw.decode("utf-8"))
+        return (str(created_at), int(ride_id))
+    except Exception:
+        raise ValueError("Con trỏ phân trang không hợp lệ")
+
+
+def parse_ride_filters(args, statuses=None):
+    """
+    Đọc bộ lọc từ query string: status (phân tách bởi dấu phẩy), driver_id,
+    customer_id, vehicle_type, from/to (ngày ISO), cursor và order (asc|desc).
+    """
+    filters = {"statuses": statuses}
+    if args.get("status"):
+        requested = [s for s in args["status"].split(",") if s]
+        filters["statuses"] = [s for s in requested if not statuses or s in statuses]
+    for field in ("driver_id", "customer_id"):
+        if args.get(field):
+            filters[field] = int(args[field])
+    if args.get("vehicle_type"):
+        filters["vehicle_type"] = args["vehicle_type"]
+    if args.get("from"):
+        filters["date_from"] = args["from"]
+    if args.get("to"):
+        filters["date_to"] = args["to"]
+    if args.get("cursor"):
+        filters["after"] = decode_cursor(args["cursor"])
+    filters["descending"] = args.get("order", "desc") != "asc"
+    return filters
+
+
+def parse_limit(args):
+    limit = int(args.get("limit", DEFAULT_LIMIT))
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def query_rides(rides, statuses=None, driver_id=None, customer_id=None, vehicle_type=None,
+                date_from=None, date_to=None, after=None, descending=True):
+    """
+    Sinh lười các chuyến đi thỏa bộ lọc theo thứ tự (created_at, id).
+    Nếu một chỉ mục băm (driver, customer, status) thu hẹp đủ nhiều thì chỉ
+    sắp xếp nhóm đó; ngược lại duyệt chỉ mục có thứ tự và lọc dần.
+    """
+    sources = []
+    if driver_id is not None:
+        sources.append((rides.count("driver_id", driver_id), lambda: rides.find("driver_id", driver_id)))
+    if customer_id is not None:
+        sources.append((rides.count("customer_id", customer_id), lambda: rides.find("customer_id", customer_id)))
+    if statuses is not None:
+        sources.append((
+            sum(rides.count("status", s) for s in statuses),
+            lambda: [r for s in statuses for r in rides.find("status", s)]
+        ))
+
+    def matches(ride):
+        if statuses is not None and ride.get("status") not in statuses:
+            return False
+        if driver_id is not None and ride.get("driver_id") != driver_id:
+            return False
+        if customer_id is not None and ride.get("customer_id") != customer_id:
+            return False
+        if vehicle_type and ride.get("vehicle_type") != vehicle_type:
+            return False
+        return True
+
+    if sources:
+        size, load = min(sources, key=lambda item: item[0])
+        if size * 4 <= len(rides):
+            candidates = sorted(load(), key=rides.order_key, reverse=descending)
+            for ride in candidates:
+                key = rides.order_key(ride)
+                if after is not None and (key >= after if descending else key <= after):
+                    continue
+                if date_from and key[0] < date_from:
+                    continue
+                if date_to and key[0] > date_to + "\uffff":
+                    continue
+                if matches(ride):
+                    yield ride
+            return
+
+    for ride in rides.scan(after=after, descending=descending, low=date_from, high=date_to):
+        if matches(ride):
+            yield ride
+
+
+def paginate(rides, iterator, limit):
+    """Lấy một trang; trả về (items, next_cursor hoặc None nếu đã hết)."""
+    items = list(islice(iterator, limit + 1))
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor(rides.order_key(items[-1]))
+    return items, None
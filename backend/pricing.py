@@ -0,0 +1,133 @@
+from functools import lru_cache
+
+from models import RideMatchingService
+
+# Biểu giá theo loại xe (trước đây nằm trong RideRequestForm.jsx)
+VEHICLE_TYPES = {
+    "bike": {"name": "Xe máy", "baseFare": 8000, "pricePerKm": 4000, "speed_kmh": 25},
+    "car": {"name": "Ô tô 4 chỗ", "baseFare": 15000, "pricePerKm": 8000, "speed_kmh": 30},
+    "van": {"name": "Ô tô 7 chỗ", "baseFare": 20000, "pricePerKm": 10000, "speed_kmh": 28},
+}
+
+# Giá trị mặc định khi chưa có dữ liệu hiệu chỉnh
+DEFAULT_DETOUR = 1.3
+DEFAULT_SPEED_KMH = 30
+# Tốc độ tham chiếu của dữ liệu hiệu chỉnh (tuyến đường ô tô)
+REFERENCE_SPEED_KMH = 30
+# Chuyến ngắn hơn (đường chim bay, m) bị bỏ qua: tỉ lệ đường vòng của chúng quá nhiễu
+MIN_SAMPLE_STRAIGHT_M = 1000
+# Khoảng hợp lý của hệ số đường vòng và tốc độ hiệu chỉnh
+DETOUR_RANGE = (1.0, 2.0)
+SPEED_RANGE_KMH = (10, 50)
+
+
+def _coords(location):
+    return float(location["lat"]), float(location.get("lng", location.get("lon")))
+
+
+class TravelTimeMatrix:
+    """
+    Ước lượng quãng đường và thời gian đi đường bộ theo cặp ô lưới.
+    Mỗi cặp (ô đi, ô đến) có hệ số đường vòng (đường bộ / đường chim bay) và
+    tốc độ trung bình, hiệu chỉnh từ estimated_distance/estimated_duration
+    của các chuyến cũ; cặp chưa có dữ liệu dùng giá trị chung toàn bộ.
+    Cả hai đều lấy trung bình theo quãng đường (tổng đường bộ / tổng đường
+    chim bay, tổng đường bộ / tổng thời gian) nên chuyến ngắn không lấn át,
+    và được kẹp trong DETOUR_RANGE/SPEED_RANGE_KMH.
+    Hệ số theo cặp ô được cache LRU.
+    """
+
+    def __init__(self, cell_size=0.05, cache_size=4096):
+        self.cell_size = cell_size
+        self._pairs = {}  # (ô đi, ô đến) -> [tổng đường bộ m, tổng đường chim bay m, tổng thời gian s]
+        self._global = [0.0, 0.0, 0.0]
+        self._factors = lru_cache(maxsize=cache_size)(self._compute_factors)
+
+    def cell(self, lat, lng):
+        return (int(lat // self.cell_size), int(lng // self.cell_size))
+
+    def calibrate(self, rides):
+        for ride in rides:
+            self.add_sample(ride)
+        self._factors.cache_clear()
+
+    def add_sample(self, ride):
+        road_m = ride.get("estimated_distance")
+        duration_s = ride.get("estimated_duration")
+        try:
+            o_lat, o_lng = _coords(ride["pickup"])
+            d_lat, d_lng = _coords(ride["dropoff"])
+            road_m = float(road_m)
+            duration_s = float(duration_s)
+        except (KeyError, TypeError, ValueError):
+            return
+        straight_m = RideMatchingService.calculate_distance(o_lat, o_lng, d_lat, d_lng) * 1000
+        if straight_m < MIN_SAMPLE_STRAIGHT_M or road_m <= 0 or duration_s <= 0:
+            return
+        key = (self.cell(o_lat, o_lng), self.cell(d_lat, d_lng))
+        for bucket in (self._pairs.setdefault(key, [0.0, 0.0, 0.0]), self._global):
+            bucket[0] += road_m
+            bucket[1] += straight_m
+            bucket[2] += duration_s
+
+    def _compute_factors(self, origin_cell, dest_cell):
+        for key in ((origin_cell, dest_cell), (dest_cell, origin_cell), None):
+            bucket = self._global if key is None else self._pairs.get(key)
+            if bucket and bucket[1]:
+                detour = min(max(bucket[0] / bucket[1], DETOUR_RANGE[0]), DETOUR_RANGE[1])
+                speed_kmh = min(max(bucket[0] / bucket[2] * 3.6, SPEED_RANGE_KMH[0]), SPEED_RANGE_KMH[1])
+                return detour, speed_kmh / 3.6
+        return DEFAULT_DETOUR, DEFAULT_SPEED_KMH / 3.6
+
+    def estimate(self, o_lat, o_lng, d_lat, d_lng, speed_kmh=REFERENCE_SPEED_KMH):
+        """Trả về (quãng đường m, thời gian s) ước lượng theo đường bộ."""
+        detour, speed = self._factors(self.cell(o_lat, o_lng), self.cell(d_lat, d_lng))
+        distance_m = RideMatchingService.calculate_distance(o_lat, o_lng, d_lat, d_lng) * 1000 * detour
+        duration_s = distance_m / (speed * speed_kmh / REFERENCE_SPEED_KMH)
+        return distance_m, duration_s
+
+
+class PricingEngine:
+    """Tính giá và ETA phía máy chủ cho mọi loại xe."""
+
+    def __init__(self, matrix=None, tariffs=None, surge=None):
+        self.matrix = matrix or TravelTimeMatrix()
+        self.tariffs = tariffs or VEHICLE_TYPES
+        # surge(lat, lng) -> hệ số tăng giá tại điểm đón (mặc định 1.0)
+        self.surge = surge
+
+    def quote(self, pickup, dropoff, vehicle_type):
+        tariff = self.tariffs.get(vehicle_type)
+        if tariff is None:
+            raise ValueError(f"Loại xe không hợp lệ: {vehicle_type}")
+        o_lat, o_lng = _coords(pickup)
+        d_lat, d_lng = _coords(dropoff)
+        distance_m, duration_s = self.matrix.estimate(o_lat, o_lng, d_lat, d_lng, tariff["speed_kmh"])
+        multiplier = self.surge(o_lat, o_lng) if self.surge else 1.0
+        fare = (tariff["baseFare"] + distance_m / 1000 * tariff["pricePerKm"]) * multiplier
+        return {
+            "vehicle_type": vehicle_type,
+            "name": tariff["name"],
+            "distance": round(distance_m, 1),
+            "duration": round(duration_s, 1),
+            "surge": multiplier,
+            "fare": round(fare)
+        }
+
+    def quote_all(self, pickup, dropoff, vehicle_types=None):
+        """Báo giá cho nhiều loại xe trong một lần gọi."""
+        return [self.quote(pickup, dropoff, v) for v in (vehicle_types or self.tariffs)]
+
+    def eta(self, driver, pickup, coords=None):
+        """
+        Thời gian (giây) để tài xế tới điểm đón, hoặc inf nếu không có vị trí.
+        coords cho phép truyền vị trí GPS trực tiếp thay cho vị trí trong bản ghi.
+        """
+        coords = coords or RideMatchingService.get_driver_coordinates(driver)
+        if coords is None:
+            return float("inf")
+        tariff = self.tariffs.get(driver.get("vehicle_type"), {})
+        p_lat, p_lng = _coords(pickup)
+        _, duration_s = self.matrix.estimate(coords[0], coords[1], p_lat, p_lng,
+                                             tariff.get("speed_kmh", REFERENCE_SPEED_KMH))
+        return duration_s
@@ -0,0 +1,96 @@
+"""
+Nhà cung cấp bên ngoài (cổng thanh toán, gửi thông báo) - bản giả lập chạy
+cục bộ, được gọi từ các công việc nền (jobs.py).
+
+Cả hai nhận idempotency key giống API của nhà cung cấp thật: gọi lại với
+cùng key (khi công việc được thử lại) trả về đúng kết quả lần trước thay vì
+thu tiền hay gửi tin lần nữa. Key chỉ được nhớ trong bộ nhớ; nhà cung cấp
+thật giữ chúng phía máy chủ của họ.
+
+PAYMENT_STUB_LATENCY và PAYMENT_STUB_FAILURE_RATE giả lập độ trễ và lỗi
+tạm thời của cổng thanh toán để thử cơ chế thử lại.
+"""
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Độ trễ (giây) của mỗi lần gọi và xác suất lỗi tạm thời của cổng thanh toán giả lập
+PAYMENT_STUB_LATENCY = float(os.environ.get("PAYMENT_STUB_LATENCY", "0.2"))
+PAYMENT_STUB_FAILURE_RATE = float(os.environ.get("PAYMENT_STUB_FAILURE_RATE", "0"))
+
+
+class ProviderError(Exception):
+    """Lỗi tạm thời từ nhà cung cấp; công việc nền sẽ thử lại."""
+
+
+class _IdempotencyCache:
+    """Kết quả theo idempotency key, chỉ giữ `keep` key gần nhất."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._items.get(key)
+
+    def setdefault(self, key, value):
+        """Lưu value nếu key chưa có; trả về giá trị đang được lưu cho key."""
+        with self._lock:
+            current = self._items.setdefault(key, value)
+            while len(self._items) > self.keep:
+                self._items.popitem(last=False)
+            return current
+
+
+class StubPaymentProvider:
+    def __init__(self, latency=PAYMENT_STUB_LATENCY, failure_rate=PAYMENT_STUB_FAILURE_RATE, keep=100000):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._charges = _IdempotencyCache(keep)
+        self._ids = itertools.count(1)
+
+    def capture(self, amount, method, idempotency_key):
+        """Thu amount bằng method; trả về giao dịch {"id", "amount", "method", "status", "captured_at"}."""
+        charge = self._charges.get(idempotency_key)
+        if charge is not None:
+            return charge
+        if amount is None or amount < 0:
+            raise ValueError(f"Số tiền không hợp lệ: {amount}")
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ProviderError("Cổng thanh toán tạm thời không phản hồi")
+        charge = self._charges.setdefault(idempotency_key, {
+            "id": f"ch_{next(self._ids):08d}",
+            "amount": round(amount),
+            "method": method,
+            "status": "captured",
+            "captured_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        logger.info("Đã thu %s bằng %s (giao dịch %s)", charge["amount"], method, charge["id"])
+        return charge
+
+
+class StubNotifier:
+    """Thay cho SMS/push: ghi log và giữ các tin đã gửi gần nhất trong sent."""
+
+    def __init__(self, keep=1000):
+        self.sent = deque(maxlen=keep)
+        self._delivered = _IdempotencyCache(keep * 10)
+
+    def send(self, recipient, message, idempotency_key):
+        """Gửi message tới recipient (vd. "customer:12"); trả về True nếu tin mới được gửi lần này."""
+        delivery = {"recipient": recipient, "message": message, "sent_at": time.time()}
+        if self._delivered.setdefault(idempotency_key, delivery) is not delivery:
+            return False
+        self.sent.append(delivery)
+        logger.info("Thông báo tới %s: %s", recipient, message)
+        return True
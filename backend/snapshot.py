@@ -0,0 +1,255 @@
+"""
+Snapshot nhị phân của toàn bộ dữ liệu (customers, drivers, rides).
+
+Thay cho các file JSON thụt lề: mỗi bản ghi là một tuple giá trị theo thứ
+tự FIELDS của model (Record.to_row), các tuple được gom thành từng khối và
+mã hóa bằng pickle giao thức PICKLE_PROTOCOL: giải mã nhanh ngang marshal,
+không phải dựng dict tạm cho từng bản ghi như json, nhưng định dạng ổn định
+giữa các phiên bản Python (marshal thì không). Khối chỉ chứa kiểu cơ bản nên
+khi đọc mọi tham chiếu tới class/hàm đều bị từ chối.
+
+Bố cục file (số nguyên little-endian):
+  header   MAGIC (8 byte), FORMAT_VERSION (u16), giao thức pickle (u16)
+  khối     pickle.dumps(list các row), nối tiếp nhau
+  mục lục  JSON {"sections": {tên: {"fields", "locations", "rows",
+           "chunks": [[offset, độ dài, crc32, số row], ...]}}}
+  footer   offset mục lục (u64), độ dài (u32), crc32 mục lục (u32), MAGIC
+
+Mục lục nằm ở cuối nên khi ghi chỉ giữ một khối trong bộ nhớ; khi đọc,
+file được memory-map và chỉ giải mã các collection được yêu cầu. Mọi khối
+đều có crc32: file hỏng hoặc ghi dở bị từ chối thay vì nạp dữ liệu sai.
+Mục lục lưu tên các trường nên snapshot cũ vẫn đọc được khi model đổi
+schema (qua from_dict, chậm hơn). Phiên bản định dạng hoặc giao thức pickle
+không đọc được thì ném SnapshotVersionError và storage quay về các file
+JSON cũ cộng WAL.
+
+Chạy tay:
+  python snapshot.py info                kiểm tra checksum, in số bản ghi
+  python snapshot.py export [--out DIR]  xuất lại customers.json, drivers.json, rides.json
+"""
+import argparse
+import gc
+import json
+import io
+import logging
+import mmap
+import os
+import pickle
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from itertools import islice
+
+from metrics import STORAGE_BYTES
+from models import MODELS
+from utils import DATA_DIR, save_data
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.bin"
+MAGIC = b"SRSNAP\r\n"
+FORMAT_VERSION = 2
+# Giao thức 4 đọc được trên mọi Python từ 3.4
+PICKLE_PROTOCOL = 4
+HEADER = struct.Struct("<8sHH")
+FOOTER = struct.Struct("<QII8s")
+CHUNK_ROWS = 50000
+
+# Tên file JSON khi xuất (giữ đúng định dạng cũ: drivers nằm trong {"drivers": [...]})
+JSON_FILES = {
+    "customers": "customers.json",
+    "drivers": "drivers.json",
+    "rides": "rides.json",
+}
+
+
+class SnapshotError(ValueError):
+    """File snapshot sai định dạng, khác phiên bản hoặc sai checksum."""
+
+
+class SnapshotVersionError(SnapshotError):
+    """File snapshot còn nguyên nhưng Python hiện tại không giải mã được."""
+
+
+class _RowUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Snapshot không được chứa tham chiếu {module}.{name}")
+
+
+def _decode(chunk):
+    return _RowUnpickler(io.BytesIO(chunk)).load()
+
+
+@contextmanager
+def gc_paused():
+    """
+    Tắt GC trong khi dựng hàng triệu object sống lâu: mỗi lần GC thế hệ già
+    chạy là một lần quét toàn bộ heap, chiếm phần lớn thời gian nạp.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def write_snapshot(path, collections, chunk_rows=CHUNK_ROWS, fsync=False):
+    """
+    Ghi {tên collection: các bản ghi} ra path (qua file tạm rồi os.replace
+    nên không bao giờ để lại snapshot ghi dở). Bản ghi là model hoặc dict.
+    Trả về số byte đã ghi.
+    """
+    tmp_path = path + ".tmp"
+    sections = {}
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, PICKLE_PROTOCOL))
+        for name, records in collections.items():
+            model = MODELS[name]
+            records = iter(records)
+            chunks = []
+            while True:
+                rows = [model.from_dict(record).to_row() for record in islice(records, chunk_rows)]
+                if not rows:
+                    break
+                data = pickle.dumps(rows, protocol=PICKLE_PROTOCOL)
+                chunks.append([f.tell(), len(data), zlib.crc32(data), len(rows)])
+                f.write(data)
+            sections[name] = {
+                "fields": list(model.FIELDS),
+                "locations": list(model._location_fields),
+                "rows": sum(chunk[3] for chunk in chunks),
+                "chunks": chunks,
+            }
+        table = json.dumps({"sections": sections}).encode("utf-8")
+        offset = f.tell()
+        f.write(table)
+        f.write(FOOTER.pack(offset, len(table), zlib.crc32(table), MAGIC))
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    STORAGE_BYTES.inc(size, target="snapshot", direction="write")
+    return size
+
+
+def _read_table(data):
+    """Kiểm tra header/footer; trả về mục lục."""
+    if len(data) < HEADER.size + FOOTER.size:
+        raise SnapshotError("File snapshot quá ngắn")
+    magic, version, codec_version = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SnapshotError("Không phải file snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotVersionError(f"Không hỗ trợ snapshot phiên bản {version}")
+    if codec_version > pickle.HIGHEST_PROTOCOL:
+        raise SnapshotVersionError(f"Snapshot ghi bằng pickle giao thức {codec_version} mới hơn Python hiện tại")
+    offset, length, crc, magic = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+    if magic != MAGIC or offset + length > len(data) - FOOTER.size:
+        raise SnapshotError("Snapshot bị ghi dở")
+    raw = data[offset:offset + length]
+    if zlib.crc32(raw) != crc:
+        raise SnapshotError("Sai checksum mục lục snapshot")
+    return json.loads(raw)["sections"]
+
+
+def _record_from_row(model, fields, locations, row):
+    # Snapshot ghi với schema khác model hiện tại: đi đường chậm qua from_dict
+    data = dict(zip(fields, row))
+    for name in locations:
+        value = data.get(name)
+        if value is not None:
+            data[name] = {"lat": value[0], "lng": value[1], "address": value[2]}
+    if row[-1]:
+        data.update(row[-1])
+    return model.from_dict(data)
+
+
+def _read_sections(data, names):
+    sections = _read_table(data)
+    result = {}
+    for name, section in sections.items():
+        if names is not None and name not in names:
+            continue
+        model = MODELS[name]
+        fast = section["fields"] == list(model.FIELDS)
+        records = []
+        for offset, length, crc, count in section["chunks"]:
+            chunk = data[offset:offset + length]
+            if zlib.crc32(chunk) != crc:
+                raise SnapshotError(f"Sai checksum khối dữ liệu {name} tại offset {offset}")
+            rows = _decode(chunk)
+            if fast:
+                records.extend(map(model.from_row, rows))
+            else:
+                records.extend(_record_from_row(model, section["fields"], section["locations"], row)
+                               for row in rows)
+        result[name] = records
+    return result
+
+
+def read_snapshot(path, names=None):
+    """
+    Đọc snapshot, trả về {tên collection: list model}. names: chỉ giải mã
+    các collection này. Ném SnapshotError nếu file hỏng.
+    """
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            raise SnapshotError("File snapshot rỗng")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        with gc_paused():
+            result = _read_sections(data, names)
+    except SnapshotError:
+        raise
+    except (ValueError, EOFError, TypeError, KeyError, pickle.UnpicklingError) as e:
+        raise SnapshotError(f"Snapshot không đọc được: {e}") from e
+    finally:
+        data.close()
+    elapsed = time.perf_counter() - started
+    STORAGE_BYTES.inc(size, target="snapshot", direction="read")
+    logger.info("Đã nạp snapshot %s (%d byte) trong %.3fs", path, size, elapsed)
+    return result
+
+
+def snapshot_info(path):
+    """Số bản ghi của từng collection; kiểm tra checksum mọi khối nhưng không giải mã."""
+    with open(path, "rb") as f:
+        data = f.read()
+    sections = _read_table(data)
+    for name, section in sections.items():
+        for offset, length, crc, count in section["chunks"]:
+            if zlib.crc32(data[offset:offset + length]) != crc:
+                raise SnapshotError(f"Sai checksum khối dữ liệu {name} tại offset {offset}")
+    return {name: section["rows"] for name, section in sections.items()}
+
+
+def export_json(path, out_dir):
+    """Xuất snapshot thành các file JSON định dạng cũ (để xem/sửa tay khi gỡ lỗi)."""
+    collections = read_snapshot(path)
+    for name, records in collections.items():
+        records = sorted((record.to_dict() for record in records), key=lambda r: r["id"])
+        save_data(os.path.join(out_dir, JSON_FILES[name]), {"drivers": records} if name == "drivers" else records)
+    return {name: len(records) for name, records in collections.items()}
+
+
+if __name__ == "__main__":
+    from metrics import configure_logging
+
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Kiểm tra hoặc xuất snapshot nhị phân")
+    parser.add_argument("command", choices=("info", "export"))
+    parser.add_argument("--snapshot", default=os.path.join(DATA_DIR, SNAPSHOT_FILE))
+    parser.add_argument("--out", default=DATA_DIR, help="thư mục ghi các file JSON (export)")
+    args = parser.parse_args()
+    if args.command == "info":
+        print(json.dumps(snapshot_info(args.snapshot)))
+    else:
+        out = os.path.abspath(args.out)
+        os.makedirs(out, exist_ok=True)
+        print(json.dumps(export_json(args.snapshot, out)))
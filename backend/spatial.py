@@ -0,0 +1,226 @@
+import heapq
+import threading
+from math import cos, radians
+
+try:
+    import numpy as np
+except ImportError:  # numpy là tùy chọn, thiếu thì dùng vòng lặp Python
+    np = None
+
+from metrics import registry, MATCH_CANDIDATES
+from models import RideMatchingService, haversine_rad
+
+KM_PER_DEGREE = 111.195
+
+
+def _position(vehicle_type, cell, lat, lng):
+    lat_r = radians(lat)
+    return (vehicle_type, cell, lat, lng, lat_r, radians(lng), cos(lat_r))
+
+
+class DriverIndex:
+    """
+    Chỉ mục lưới (grid) cho các tài xế đang rảnh, chia theo vehicle_type.
+    Mỗi ô có kích thước cell_size độ; tìm kiếm mở rộng dần theo vòng ô
+    quanh điểm đón nên chỉ xét các tài xế ở gần thay vì toàn bộ danh sách.
+    """
+
+    def __init__(self, cell_size=0.01):
+        self.cell_size = cell_size
+        # vehicle_type -> {(ô lat, ô lng): {driver_id: driver}}
+        self._cells = {}
+        # driver_id -> (vehicle_type, ô, lat, lng, lat radian, lng radian, cos(lat)); phần
+        # radian/cos tính sẵn khi tài xế di chuyển thay vì ở mỗi lần tìm kiếm
+        self._positions = {}
+        # driver_id -> (lat, lng) từ GPS trực tiếp, ưu tiên hơn vị trí trong bản ghi
+        self._live = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, lat, lng):
+        return (int(lat // self.cell_size), int(lng // self.cell_size))
+
+    def rebuild(self, drivers):
+        with self._lock:
+            self._cells = {}
+            self._positions = {}
+            for driver in drivers:
+                self.update(driver)
+
+    def update(self, driver):
+        """Thêm, di chuyển hoặc gỡ một tài xế tùy theo vị trí và trạng thái hiện tại."""
+        with self._lock:
+            driver_id = driver["id"]
+            coords = self._live.get(driver_id) or RideMatchingService.get_driver_coordinates(driver)
+            if driver.get("status") != "available" or coords is None:
+                self.remove(driver_id)
+                return
+            lat, lng = coords
+            vehicle_type = driver.get("vehicle_type")
+            cell = self._cell(lat, lng)
+            old = self._positions.get(driver_id)
+            if old and (old[0], old[1]) != (vehicle_type, cell):
+                self.remove(driver_id)
+            self._cells.setdefault(vehicle_type, {}).setdefault(cell, {})[driver_id] = driver
+            self._positions[driver_id] = _position(vehicle_type, cell, lat, lng)
+
+    def move(self, driver_id, lat, lng):
+        """Cập nhật vị trí GPS trực tiếp của tài xế mà không cần ghi vào store."""
+        with self._lock:
+            self._live[driver_id] = (lat, lng)
+            old = self._positions.get(driver_id)
+            if old is None:
+                return
+            driver = self._cells[old[0]][old[1]][driver_id]
+            cell = self._cell(lat, lng)
+            if cell != old[1]:
+                self.remove(driver_id)
+                self._cells.setdefault(old[0], {}).setdefault(cell, {})[driver_id] = driver
+            self._positions[driver_id] = _position(old[0], cell, lat, lng)
+
+    def get(self, driver_id):
+        """Bản ghi của tài xế nếu đang có trong chỉ mục (đang rảnh), ngược lại None."""
+        with self._lock:
+            old = self._positions.get(driver_id)
+            return self._cells[old[0]][old[1]][driver_id] if old else None
+
+    def forget(self, driver_id):
+        """Gỡ tài xế cùng vị trí GPS trực tiếp (khi tài xế chuyển sang chỉ mục khác)."""
+        with self._lock:
+            self.remove(driver_id)
+            self._live.pop(driver_id, None)
+
+    def position(self, driver_id):
+        """(lat, lng) mà chỉ mục đang dùng cho tài xế, hoặc None nếu không có trong chỉ mục."""
+        old = self._positions.get(driver_id)
+        return (old[2], old[3]) if old else None
+
+    def remove(self, driver_id):
+        with self._lock:
+            old = self._positions.pop(driver_id, None)
+            if not old:
+                return
+            vehicle_type, cell = old[0], old[1]
+            cells = self._cells.get(vehicle_type, {})
+            members = cells.get(cell)
+            if members is not None:
+                members.pop(driver_id, None)
+                if not members:
+                    del cells[cell]
+
+    def region(self, lat, lng):
+        """Khóa nhóm các điểm dùng chung tập ứng viên: một chỉ mục là một vùng."""
+        return None
+
+    def available(self, vehicle_type=None, region=None):
+        """(các tài xế rảnh, tọa độ (lat, lng) chỉ mục đang dùng) để tính khoảng cách hàng loạt."""
+        with self._lock:
+            drivers, coords = [], []
+            for partition in self._partitions(vehicle_type):
+                for members in partition.values():
+                    for driver_id, driver in members.items():
+                        position = self._positions[driver_id]
+                        drivers.append(driver)
+                        coords.append((position[2], position[3]))
+            return drivers, coords
+
+    def _partitions(self, vehicle_type):
+        if vehicle_type:
+            return [self._cells.get(vehicle_type, {})]
+        return list(self._cells.values())
+
+    def _ring(self, center, r):
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for dj in range(-r, r + 1):
+            yield (ci - r, cj + dj)
+            yield (ci + r, cj + dj)
+        for di in range(-r + 1, r):
+            yield (ci + di, cj - r)
+            yield (ci + di, cj + r)
+
+    def _candidates(self, partition, cells, lat, lng):
+        """Tính khoảng cách cho mọi tài xế trong các ô đã chọn trong một lượt vector hóa."""
+        ids, drivers, lats, lngs, coss = [], [], [], [], []
+        for cell in cells:
+            members = partition.get(cell)
+            if not members:
+                continue
+            for driver_id, driver in members.items():
+                position = self._positions[driver_id]
+                ids.append(driver_id)
+                drivers.append(driver)
+                lats.append(position[4])
+                lngs.append(position[5])
+                coss.append(position[6])
+        if not ids:
+            return []
+        if registry.detail:
+            MATCH_CANDIDATES.inc(len(ids))
+        if np is not None:
+            lats, lngs, coss = np.array(lats), np.array(lngs), np.array(coss)
+        distances = haversine_rad(radians(lat), radians(lng), cos(radians(lat)), lats, lngs, coss)
+        return zip((float(d) for d in distances), ids, drivers)
+
+    def nearest(self, lat, lng, vehicle_type=None, k=1, max_radius_km=None):
+        """Trả về tối đa k cặp (khoảng cách km, driver) gần nhất, tăng dần theo khoảng cách."""
+        with self._lock:
+            best = []  # max-heap theo khoảng cách: (-distance, driver_id, driver)
+            # Khoảng cách nhỏ nhất tới vòng ô thứ r+1 ít nhất là r ô theo chiều hẹp
+            cell_km = self.cell_size * KM_PER_DEGREE * max(cos(radians(lat)), 0.01)
+            center = self._cell(lat, lng)
+
+            for partition in self._partitions(vehicle_type):
+                if not partition:
+                    continue
+                r = 0
+                seen = 0
+                while seen < len(partition):
+                    if (2 * r + 1) ** 2 >= len(partition):
+                        # Vòng tìm kiếm đã rộng hơn số ô có tài xế: duyệt thẳng các ô còn lại
+                        cells = [c for c in partition
+                                 if max(abs(c[0] - center[0]), abs(c[1] - center[1])) >= r]
+                        seen = len(partition)
+                    else:
+                        cells = list(self._ring(center, r))
+                        seen += sum(1 for c in cells if c in partition)
+                    for distance, driver_id, driver in self._candidates(partition, cells, lat, lng):
+                        if max_radius_km is not None and distance > max_radius_km:
+                            continue
+                        if len(best) < k:
+                            heapq.heappush(best, (-distance, driver_id, driver))
+                        elif distance < -best[0][0]:
+                            heapq.heapreplace(best, (-distance, driver_id, driver))
+                    ring_km = r * cell_km
+                    if max_radius_km is not None and ring_km > max_radius_km:
+                        break
+                    if len(best) >= k and ring_km > -best[0][0]:
+                        break
+                    r += 1
+
+            return [(-d, driver) for d, _, driver in sorted(best, reverse=True)]
+
+    def within(self, lat, lng, radius_km, vehicle_type=None):
+        """Trả về các cặp (khoảng cách km, driver) nằm trong bán kính radius_km."""
+        with self._lock:
+            lat_span = int(radius_km / (self.cell_size * KM_PER_DEGREE)) + 1
+            lng_span = int(radius_km / (self.cell_size * KM_PER_DEGREE * max(cos(radians(lat)), 0.01))) + 1
+            ci, cj = self._cell(lat, lng)
+            results = []
+            for partition in self._partitions(vehicle_type):
+                if (2 * lat_span + 1) * (2 * lng_span + 1) > len(partition):
+                    cells = [c for c in partition
+                             if abs(c[0] - ci) <= lat_span and abs(c[1] - cj) <= lng_span]
+                else:
+                    cells = [(ci + di, cj + dj)
+                             for di in range(-lat_span, lat_span + 1)
+                             for dj in range(-lng_span, lng_span + 1)]
+                for distance, _, driver in self._candidates(partition, cells, lat, lng):
+                    if distance <= radius_km:
+                        results.append((distance, driver))
+            results.sort(key=lambda item: item[0])
+            return results
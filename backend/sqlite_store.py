@@ -0,0 +1,466 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from metrics import registry, STORAGE_BYTES, STORAGE_OPS, STORAGE_SECONDS
+from models import MODELS
+from stats import ACTIVE_STATUSES, DRIVER_SHARE
+from utils import DATA_DIR, IdAllocator, dumps, loads
+
+logger = logging.getLogger(__name__)
+
+DB_FILE = "smartride.db"
+
+# PRAGMA user_version: 1 = cột data đã theo schema của models.py
+SCHEMA_VERSION = 1
+
+# Mỗi bảng lưu bản ghi đầy đủ dạng JSON (cột data) cùng các cột được tách
+# ra để đánh chỉ mục; các cột này luôn được tính lại từ bản ghi khi ghi.
+SCHEMA = {
+    "customers": ("email", "phone"),
+    "drivers": ("email", "phone", "status", "vehicle_type"),
+    "rides": ("driver_id", "customer_id", "status", "vehicle_type", "created_at", "fare", "rating"),
+}
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER PRIMARY KEY, email TEXT, phone TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS customers_email ON customers(email);
+CREATE INDEX IF NOT EXISTS customers_phone ON customers(phone);
+
+CREATE TABLE IF NOT EXISTS drivers (
+    id INTEGER PRIMARY KEY, email TEXT, phone TEXT, status TEXT, vehicle_type TEXT,
+    data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS drivers_email ON drivers(email);
+CREATE INDEX IF NOT EXISTS drivers_phone ON drivers(phone);
+CREATE INDEX IF NOT EXISTS drivers_status ON drivers(status);
+
+CREATE TABLE IF NOT EXISTS rides (
+    id INTEGER PRIMARY KEY, driver_id INTEGER, customer_id INTEGER, status TEXT,
+    vehicle_type TEXT, created_at TEXT NOT NULL DEFAULT '', fare REAL, rating REAL,
+    data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS rides_driver ON rides(driver_id, created_at, id);
+CREATE INDEX IF NOT EXISTS rides_customer ON rides(customer_id, created_at, id);
+CREATE INDEX IF NOT EXISTS rides_status ON rides(status);
+CREATE INDEX IF NOT EXISTS rides_created ON rides(created_at, id);
+
+CREATE TABLE IF NOT EXISTS id_counters (id_type TEXT PRIMARY KEY, next_id INTEGER NOT NULL);
+"""
+
+
+def _row_values(name, record):
+    values = []
+    for column in SCHEMA[name]:
+        value = record.get(column)
+        if column == "created_at":
+            value = value or ""
+        elif isinstance(value, (dict, list)):
+            value = dumps(value)
+        values.append(value)
+    return values
+
+
+class SqliteCollection:
+    """Cùng giao diện với storage.Collection nhưng đọc thẳng từ SQLite."""
+
+    def __init__(self, store, name, order_by=None):
+        self.store = store
+        self.name = name
+        self.order_by = order_by
+        self.model = MODELS[name]
+        self.columns = SCHEMA[name]
+        placeholders = ", ".join("?" * (len(self.columns) + 2))
+        # Câu lệnh cố định để sqlite3 dùng lại bản đã biên dịch trong cache của kết nối
+        self._sql_get = f"SELECT data FROM {name} WHERE id = ?"
+        self._sql_all = f"SELECT data FROM {name} ORDER BY id"
+        self._sql_len = f"SELECT COUNT(*) FROM {name}"
+        self._sql_put = f"INSERT OR REPLACE INTO {name} (id, {', '.join(self.columns)}, data) VALUES ({placeholders})"
+
+    def order_key(self, record):
+        return (record.get(self.order_by) or "", int(record["id"]))
+
+    def _load(self, data):
+        return self.model.from_dict(loads(data))
+
+    def _query(self, sql, params=()):
+        return [self._load(row[0]) for row in self.store.connection().execute(sql, params)]
+
+    def get(self, record_id):
+        if registry.detail:
+            STORAGE_OPS.inc(op="get", collection=self.name)
+        try:
+            row = self.store.connection().execute(self._sql_get, (int(record_id),)).fetchone()
+        except (TypeError, ValueError):
+            return None
+        return self._load(row[0]) if row else None
+
+    def _check_field(self, field):
+        if field not in self.columns:
+            raise KeyError(field)
+
+    def find(self, field, value):
+        """Các bản ghi có record[field] == value, tra cứu qua chỉ mục của cột."""
+        if registry.detail:
+            STORAGE_OPS.inc(op="find", collection=self.name)
+        self._check_field(field)
+        return self._query(f"SELECT data FROM {self.name} WHERE {field} = ?", (value,))
+
+    def find_one(self, field, value):
+        if registry.detail:
+            STORAGE_OPS.inc(op="find", collection=self.name)
+        self._check_field(field)
+        row = self.store.connection().execute(
+            f"SELECT data FROM {self.name} WHERE {field} = ? LIMIT 1", (value,)).fetchone()
+        return self._load(row[0]) if row else None
+
+    def count(self, field, value):
+        self._check_field(field)
+        return self.store.connection().execute(
+            f"SELECT COUNT(*) FROM {self.name} WHERE {field} = ?", (value,)).fetchone()[0]
+
+    def scan(self, after=None, descending=True, low=None, high=None, chunk=256):
+        """Duyệt theo (order_by, id) bằng phân trang keyset trên chỉ mục, mỗi lần chunk dòng."""
+        column = self.order_by
+        where, params = [], []
+        if low:
+            where.append(f"{column} >= ?")
+            params.append(low)
+        if high:
+            where.append(f"{column} < ?")
+            params.append(high + "\uffff")
+        direction = "DESC" if descending else "ASC"
+        compare = "<" if descending else ">"
+        base = f"SELECT {column}, id, data FROM {self.name}"
+        last = tuple(after) if after is not None else None
+        while True:
+            clauses = list(where)
+            args = list(params)
+            if last is not None:
+                clauses.append(f"({column}, id) {compare} (?, ?)")
+                args += [last[0], last[1]]
+            sql = base + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            sql += f" ORDER BY {column} {direction}, id {direction} LIMIT ?"
+            rows = self.store.connection().execute(sql, args + [chunk]).fetchall()
+            if not rows:
+                return
+            for _, _, data in rows:
+                yield self._load(data)
+            last = (rows[-1][0], rows[-1][1])
+
+    def all(self):
+        return self._query(self._sql_all)
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def __len__(self):
+        return self.store.connection().execute(self._sql_len).fetchone()[0]
+
+    def _write(self, conn, record):
+        data = dumps(record)
+        conn.execute(self._sql_put, [int(record["id"])] + _row_values(self.name, record) + [data])
+        return len(data)
+
+
+class SqliteStore:
+    """
+    Kho dữ liệu SQLite, cùng giao diện với storage.DataStore (collection,
+    commit có compare-and-set, on_change). Dùng WAL mode nên nhiều tiến
+    trình đọc song song với một người ghi; mỗi thread giữ một kết nối riêng.
+    """
+
+    def __init__(self, path=None, data_dir=DATA_DIR, busy_timeout=5000):
+        self.data_dir = data_dir
+        self.path = path or os.path.join(data_dir, DB_FILE)
+        self.busy_timeout = busy_timeout
+        self.customers = SqliteCollection(self, "customers")
+        self.drivers = SqliteCollection(self, "drivers")
+        self.rides = SqliteCollection(self, "rides", order_by="created_at")
+        self._local = threading.local()
+        self._connections = []
+        self._pool_lock = threading.Lock()
+        self._listeners = []
+        self._remove_listeners = []
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   cached_statements=256)
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+            with self._pool_lock:
+                self._connections.append(conn)
+        return conn
+
+    def collection(self, name):
+        return getattr(self, name)
+
+    def on_change(self, listener):
+        """Đăng ký hàm listener(name, record) được gọi sau mỗi thay đổi."""
+        self._listeners.append(listener)
+        return listener
+
+    def on_remove(self, listener):
+        """
+        Đăng ký hàm listener(name, record_id) được gọi sau mỗi lần xóa (vd.
+        chuyến đi được chuyển sang kho lưu trữ). Tách khỏi on_change vì bản
+        ghi bị xóa không còn để các chỉ mục cập nhật theo.
+        """
+        self._remove_listeners.append(listener)
+        return listener
+
+    def _notify(self, name, record):
+        for listener in self._listeners:
+            listener(name, record)
+
+    def _notify_remove(self, name, record_id):
+        for listener in self._remove_listeners:
+            listener(name, record_id)
+
+    def open(self):
+        """Tạo schema; nếu CSDL còn trống thì chuyển dữ liệu từ các file JSON cũ sang."""
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.executescript(SCHEMA_SQL)
+        empty = not any(conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone() for name in SCHEMA)
+        if empty and any(os.path.exists(os.path.join(self.data_dir, f)) for f in
+                         ("customers.json", "drivers.json", "rides.json")):
+            migrate_json(self, self.data_dir)
+        elif conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            normalize_records(self)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        return self
+
+    def close(self):
+        with self._pool_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def commit(self, ops, expect=()):
+        """
+        Áp dụng nhiều thao tác trong một transaction (BEGIN IMMEDIATE).
+        ops/expect giống storage.DataStore.commit; trả về None nếu điều kiện
+        compare-and-set không khớp hoặc bản ghi cần sửa không tồn tại.
+        """
+        conn = self.connection()
+        written = 0
+        with STORAGE_SECONDS.time(target="sqlite"):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name, record_id, fields in expect:
+                    record = self.collection(name).get(record_id)
+                    if record is None or any(record.get(k) != v for k, v in fields.items()):
+                        conn.execute("ROLLBACK")
+                        return None
+                changed = []
+                removed = []
+                for op in ops:
+                    collection = self.collection(op[1])
+                    if op[0] == "del":
+                        if conn.execute(f"DELETE FROM {op[1]} WHERE id = ?", (int(op[2]),)).rowcount:
+                            removed.append((op[1], int(op[2])))
+                        continue
+                    if op[0] == "put":
+                        record = collection.model.from_dict(op[2])
+                    else:
+                        record = collection.get(op[2])
+                        if record is None:
+                            conn.execute("ROLLBACK")
+                            return None
+                        record.update(op[3])
+                    written += collection._write(conn, record)
+                    changed.append((op[1], record))
+                    if registry.detail:
+                        STORAGE_OPS.inc(op=op[0], collection=op[1])
+                conn.execute("COMMIT")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+        STORAGE_BYTES.inc(written, target="sqlite", direction="write")
+        for name, record in changed:
+            self._notify(name, record)
+        for name, record_id in removed:
+            self._notify_remove(name, record_id)
+        return [record for _, record in changed]
+
+    def insert(self, name, record):
+        return self.commit([("put", name, record)])[0]
+
+    def update(self, name, record_id, changes):
+        result = self.commit([("set", name, record_id, changes)])
+        return result[0] if result else None
+
+    def compare_and_set(self, name, record_id, expected, changes):
+        """Cập nhật bản ghi chỉ khi các trường hiện tại khớp expected."""
+        result = self.commit([("set", name, record_id, changes)], expect=[(name, record_id, expected)])
+        return result[0] if result else None
+
+    def compact(self):
+        """Dồn WAL của SQLite vào file CSDL chính."""
+        self.connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class SqliteIdAllocator(IdAllocator):
+    """Cấp ID theo khối như utils.IdAllocator nhưng mốc cao nhất nằm trong bảng id_counters."""
+
+    def __init__(self, store, block_size=100):
+        super().__init__(block_size=block_size)
+        self.store = store
+
+    def _lease(self, id_type):
+        conn = self.store.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT next_id FROM id_counters WHERE id_type = ?", (id_type,)).fetchone()
+            start = row[0] if row else 1
+            conn.execute("INSERT OR REPLACE INTO id_counters (id_type, next_id) VALUES (?, ?)",
+                         (id_type, start + self.block_size))
+            conn.execute("COMMIT")
+            return start
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class SqliteDriverStats:
+    """
+    Thống kê theo tài xế tính bằng truy vấn GROUP BY trên bảng rides, thay
+    cho stats.DriverStats khi dùng SQLite (dữ liệu dùng chung giữa các worker).
+    """
+
+    _SELECT = f"""
+        SELECT driver_id,
+               COUNT(*),
+               SUM(status = 'completed'),
+               SUM(status = 'cancelled'),
+               SUM(status IN ({", ".join(f"'{s}'" for s in ACTIVE_STATUSES)})),
+               COALESCE(SUM(CASE WHEN status = 'completed' THEN fare END), 0),
+               COALESCE(SUM(CASE WHEN status = 'completed' THEN rating END), 0),
+               COUNT(CASE WHEN status = 'completed' THEN rating END)
+        FROM rides WHERE driver_id IS NOT NULL"""
+
+    def __init__(self, store, recent_size=10):
+        self.store = store
+        self.recent_size = recent_size
+
+    def rebuild(self, rides):
+        pass
+
+    def update(self, ride):
+        pass
+
+    @staticmethod
+    def _summary(row):
+        _, total, completed, cancelled, ongoing, fare_sum, rating_sum, rating_count = row
+        return {
+            "total_rides": total,
+            "completed": completed or 0,
+            "cancelled": cancelled or 0,
+            "ongoing": ongoing or 0,
+            "earnings": fare_sum * DRIVER_SHARE,
+            "rating_sum": rating_sum,
+            "rating_count": rating_count,
+        }
+
+    def summary(self, driver_id):
+        row = self.store.connection().execute(
+            self._SELECT + " AND driver_id = ? GROUP BY driver_id", (int(driver_id),)).fetchone()
+        return self._summary(row) if row else self._summary((driver_id, 0, 0, 0, 0, 0, 0, 0))
+
+    def summaries(self):
+        """Thống kê của mọi tài xế trong một truy vấn: {driver_id: summary}."""
+        rows = self.store.connection().execute(self._SELECT + " GROUP BY driver_id")
+        return {row[0]: self._summary(row) for row in rows}
+
+    def recent_ride_ids(self, driver_id):
+        rows = self.store.connection().execute(
+            "SELECT id FROM rides WHERE driver_id = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (int(driver_id), self.recent_size))
+        return [row[0] for row in rows]
+
+
+def normalize_records(store, chunk=1000):
+    """Ghi lại cột data của mọi bản ghi theo schema của model (một transaction mỗi bảng)."""
+    conn = store.connection()
+    for name in SCHEMA:
+        collection = store.collection(name)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            changed, last = 0, 0
+            while True:
+                # Đọc theo từng đoạn id rồi mới ghi, không sửa bảng khi cursor còn mở
+                batch = conn.execute(f"SELECT id, data FROM {name} WHERE id > ? ORDER BY id LIMIT ?",
+                                     (last, chunk)).fetchall()
+                if not batch:
+                    break
+                last = batch[-1][0]
+                for _, data in batch:
+                    raw = loads(data)
+                    record = collection.model.from_dict(raw)
+                    if record != raw:
+                        collection._write(conn, record)
+                        changed += 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if changed:
+            logger.info("Chuẩn hóa %d bản ghi %s theo schema mới", changed, name)
+
+
+def migrate_json(store, data_dir=DATA_DIR):
+    """
+    Chuyển customers/drivers/rides (snapshot JSON + wal.log) và id_tracker.json
+    sang SQLite trong một transaction. Trả về số bản ghi mỗi bảng.
+    """
+    # Nạp qua DataStore để có cả các thay đổi còn nằm trong wal.log
+    from storage import DataStore
+    source = DataStore(data_dir, compact_every=0)
+    source.open()
+    source.close()
+
+    conn = store.connection()
+    counts = {}
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name in SCHEMA:
+            collection = store.collection(name)
+            records = source.collection(name).all()
+            for record in records:
+                collection._write(conn, record)
+            counts[name] = len(records)
+        tracker = os.path.join(data_dir, "id_tracker.json")
+        if os.path.exists(tracker):
+            with open(tracker, "r", encoding="utf-8") as f:
+                for id_type, next_id in json.load(f).items():
+                    conn.execute("INSERT OR REPLACE INTO id_counters (id_type, next_id) VALUES (?, ?)",
+                                 (id_type, int(next_id)))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info("Đã chuyển dữ liệu JSON sang %s: %s", store.path, counts)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chuyển dữ liệu JSON của SmartRide sang SQLite")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--db", help=f"đường dẫn file CSDL (mặc định <data-dir>/{DB_FILE})")
+    args = parser.parse_args()
+    target = SqliteStore(args.db, data_dir=args.data_dir)
+    if os.path.exists(target.path):
+        parser.error(f"{target.path} đã tồn tại")
+    conn = target.connection()
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(SCHEMA_SQL)
+    print(migrate_json(target, args.data_dir))
+    target.close()
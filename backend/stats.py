@@ -0,0 +1,121 @@
+import heapq
+import threading
+
+ACTIVE_STATUSES = ("pending", "accepted", "in_progress", "ongoing")
+
+# Tài xế nhận 70% giá chuyến đi
+DRIVER_SHARE = 0.7
+
+
+class _DriverAggregate:
+    __slots__ = ("total", "completed", "cancelled", "ongoing", "fare_sum",
+                 "rating_sum", "rating_count", "recent")
+
+    def __init__(self):
+        self.total = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.ongoing = 0
+        self.fare_sum = 0.0
+        self.rating_sum = 0.0
+        self.rating_count = 0
+        self.recent = []  # min-heap (created_at, ride_id) giữ k chuyến mới nhất
+
+
+class DriverStats:
+    """
+    Thống kê theo tài xế được cập nhật dần mỗi khi chuyến đi được tạo,
+    hoàn thành hoặc bị hủy, thay vì quét toàn bộ rides ở mỗi request.
+    """
+
+    def __init__(self, recent_size=10):
+        self.recent_size = recent_size
+        self._drivers = {}
+        # ride_id -> phần đóng góp hiện tại (driver_id, status, fare, rating)
+        self._rides = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self, rides):
+        with self._lock:
+            self._drivers = {}
+            self._rides = {}
+        for ride in rides:
+            self.update(ride)
+
+    def update(self, ride):
+        contribution = (
+            ride.get("driver_id"),
+            ride.get("status"),
+            ride.get("fare") or 0,
+            ride.get("rating"),
+        )
+        with self._lock:
+            old = self._rides.get(ride["id"])
+            if old == contribution:
+                return
+            if old is not None:
+                self._apply(old, -1)
+            else:
+                self._track_recent(ride)
+            self._rides[ride["id"]] = contribution
+            self._apply(contribution, 1)
+
+    def _aggregate(self, driver_id):
+        agg = self._drivers.get(driver_id)
+        if agg is None:
+            agg = self._drivers[driver_id] = _DriverAggregate()
+        return agg
+
+    def _apply(self, contribution, sign):
+        driver_id, status, fare, rating = contribution
+        if driver_id is None:
+            return
+        agg = self._aggregate(driver_id)
+        agg.total += sign
+        if status == "completed":
+            agg.completed += sign
+            agg.fare_sum += sign * fare
+            if rating is not None:
+                agg.rating_sum += sign * rating
+                agg.rating_count += sign
+        elif status == "cancelled":
+            agg.cancelled += sign
+        elif status in ACTIVE_STATUSES:
+            agg.ongoing += sign
+
+    def _track_recent(self, ride):
+        driver_id = ride.get("driver_id")
+        if driver_id is None:
+            return
+        recent = self._aggregate(driver_id).recent
+        item = (ride.get("created_at") or "", ride["id"])
+        if len(recent) < self.recent_size:
+            heapq.heappush(recent, item)
+        elif item > recent[0]:
+            heapq.heapreplace(recent, item)
+
+    def summary(self, driver_id):
+        """Trả về dict thống kê của tài xế (các giá trị 0 nếu chưa có chuyến nào)."""
+        with self._lock:
+            agg = self._drivers.get(driver_id) or _DriverAggregate()
+            return {
+                "total_rides": agg.total,
+                "completed": agg.completed,
+                "cancelled": agg.cancelled,
+                "ongoing": agg.ongoing,
+                "earnings": agg.fare_sum * DRIVER_SHARE,
+                "rating_sum": agg.rating_sum,
+                "rating_count": agg.rating_count,
+            }
+
+    def summaries(self):
+        """Thống kê của mọi tài xế đã có chuyến: {driver_id: summary}."""
+        return {driver_id: self.summary(driver_id) for driver_id in list(self._drivers)}
+
+    def recent_ride_ids(self, driver_id):
+        """Id các chuyến gần đây nhất của tài xế, mới nhất đứng đầu."""
+        with self._lock:
+            agg = self._drivers.get(driver_id)
+            if agg is None:
+                return []
+            return [ride_id for _, ride_id in sorted(agg.recent, reverse=True)]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module backend nằm phẳng trong backend/ và được import theo tên trần
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,111 @@
+import itertools
+import random
+
+import pytest
+
+import dispatch
+import models
+from dispatch import BatchDispatcher, _PendingRequest, solve_assignment
+from geofence import Geofence, ShardedDriverIndex, Zone
+from spatial import DriverIndex
+
+
+def _geofence():
+    # Hai thành phố: hcmc chia hai vùng tại kinh độ 106.68, hanoi một vùng
+    return Geofence([
+        Zone("hcmc-west", "hcmc", [[10.95, 106.5], [10.95, 106.68], [10.6, 106.68], [10.6, 106.5]]),
+        Zone("hcmc-east", "hcmc", [[10.95, 106.68], [10.95, 106.9], [10.6, 106.9], [10.6, 106.68]]),
+        Zone("hanoi-central", "hanoi", [[21.1, 105.7], [21.1, 105.95], [20.9, 105.95], [20.9, 105.7]]),
+    ])
+
+
+def _drivers(rng, count):
+    drivers = []
+    for i in range(1, count + 1):
+        # Một phần nhỏ tài xế ở Hà Nội
+        lat, lng = (21.0, 105.8) if i % 50 == 0 else (rng.uniform(10.6, 10.95), rng.uniform(106.5, 106.9))
+        drivers.append({"id": i, "status": "available", "vehicle_type": rng.choice(("car", "bike")),
+                        "current_location": {"lat": lat, "lng": lng}})
+    return drivers
+
+
+def _batch(rng, count):
+    return [_PendingRequest({"lat": rng.uniform(10.6, 10.95), "lng": rng.uniform(106.5, 106.9)},
+                            rng.choice(("car", "bike", None)), None)
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize("index", [DriverIndex(), ShardedDriverIndex(_geofence(), spill_km=2.0)],
+                         ids=["grid", "sharded"])
+@pytest.mark.parametrize("max_radius_km", [None, 3.0])
+@pytest.mark.parametrize("matrix_max_drivers", [dispatch.MATRIX_MAX_DRIVERS, 10])
+def test_matrix_candidates_match_index(monkeypatch, index, max_radius_km, matrix_max_drivers):
+    monkeypatch.setattr(dispatch, "MATRIX_MAX_DRIVERS", matrix_max_drivers)
+    rng = random.Random(7)
+    index.rebuild(_drivers(rng, 400))
+    dispatcher = BatchDispatcher(index, reserve=None, candidates=5, max_radius_km=max_radius_km)
+    batch = _batch(rng, 60)
+    for item, matches in zip(batch, dispatcher._candidates(batch)):
+        expected = index.nearest(item.pickup["lat"], item.pickup["lng"], vehicle_type=item.vehicle_type,
+                                 k=5, max_radius_km=max_radius_km)
+        assert [driver["id"] for _, driver in matches] == [driver["id"] for _, driver in expected]
+        assert [d for d, _ in matches] == pytest.approx([d for d, _ in expected])
+
+
+def test_matrix_candidates_stay_in_city():
+    index = ShardedDriverIndex(_geofence(), spill_km=2.0)
+    index.rebuild([{"id": 1, "status": "available", "vehicle_type": "car",
+                    "current_location": {"lat": 21.0, "lng": 105.8}}])
+    dispatcher = BatchDispatcher(index, reserve=None)
+    batch = [_PendingRequest({"lat": 10.77, "lng": 106.70}, "car", None)]
+    assert dispatcher._candidates(batch) == [[]]
+
+
+def test_top_k_many_without_numpy(monkeypatch):
+    rng = random.Random(3)
+    drivers = _drivers(rng, 50)
+    engine = models.DistanceEngine.from_drivers(drivers)
+    points = [(rng.uniform(10.6, 10.95), rng.uniform(106.5, 106.9)) for _ in range(10)]
+    expected = engine.top_k_many(points, 4, max_radius_km=10.0)
+    monkeypatch.setattr(models, "np", None)
+    engine = models.DistanceEngine.from_drivers(drivers)
+    result = engine.top_k_many(points, 4, max_radius_km=10.0)
+    assert [[driver["id"] for _, driver in row] for row in result] == \
+        [[driver["id"] for _, driver in row] for row in expected]
+
+
+def _brute_force(edges, m):
+    """(số hàng được ghép, tổng chi phí) tốt nhất qua mọi cách gán."""
+    best = (0, 0.0)
+    rows = range(len(edges))
+    for columns in itertools.permutations(list(range(m)) + [None] * len(edges), len(edges)):
+        if any(j is not None and j not in edges[i] for i, j in zip(rows, columns)):
+            continue
+        pairs = [(i, j) for i, j in zip(rows, columns) if j is not None]
+        score = (len(pairs), -sum(edges[i][j] for i, j in pairs))
+        if score > (best[0], -best[1]):
+            best = (score[0], -score[1])
+    return best
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_solve_assignment_is_optimal(seed):
+    rng = random.Random(seed)
+    n, m = rng.randint(1, 5), rng.randint(1, 5)
+    edges = [{j: round(rng.uniform(0.1, 10), 3) for j in rng.sample(range(m), rng.randint(0, m))}
+             for _ in range(n)]
+    assignment = solve_assignment(edges, m)
+    taken = [j for j in assignment if j is not None]
+    assert len(taken) == len(set(taken))
+    assert all(j is None or j in row for row, j in zip(edges, assignment))
+    matched, cost = _brute_force(edges, m)
+    assert len(taken) == matched
+    assert sum(row[j] for row, j in zip(edges, assignment) if j is not None) == pytest.approx(cost)
+
+
+def test_solve_assignment_prefers_global_optimum():
+    # Tham lam theo hàng sẽ gán hàng 0 cho cột 0 và bỏ đói hàng 1
+    edges = [{0: 1.0, 1: 2.0}, {0: 1.5}]
+    assert solve_assignment(edges, 2) == [1, 0]
+    assert solve_assignment([], 3) == []
+    assert solve_assignment([{}, {0: 4.0}], 1) == [None, 0]
@@ -0,0 +1,51 @@
+from geofence import Geofence, ShardedDriverIndex, Zone
+from spatial import DriverIndex
+
+
+def _hcmc():
+    # Hai vùng cùng thành phố, chia nhau tại kinh độ 106.68
+    return Geofence([
+        Zone("hcmc-west", "hcmc", [[10.95, 106.5], [10.95, 106.68], [10.6, 106.68], [10.6, 106.5]]),
+        Zone("hcmc-east", "hcmc", [[10.95, 106.68], [10.95, 106.9], [10.6, 106.9], [10.6, 106.68]]),
+    ])
+
+
+def _driver(driver_id, lat, lng, vehicle_type="car"):
+    return {"id": driver_id, "status": "available", "vehicle_type": vehicle_type,
+            "current_location": {"lat": lat, "lng": lng}}
+
+
+def test_locate():
+    geofence = _hcmc()
+    assert geofence.shard_name(10.77, 106.60) == "hcmc-west"
+    assert geofence.shard_name(10.77, 106.75) == "hcmc-east"
+    assert geofence.shard_name(21.0, 105.8) == "outside"
+
+
+def test_nearest_matches_driver_across_zone_boundary_beyond_spill():
+    index = ShardedDriverIndex(_hcmc(), spill_km=2.0)
+    # Điểm đón ở hcmc-west cách biên khoảng 1 km, tài xế duy nhất ở hcmc-east cách khoảng 4 km
+    index.rebuild([_driver(1, 10.77, 106.707)])
+    result = index.nearest(10.77, 106.671, vehicle_type="car", k=1)
+    assert [driver["id"] for _, driver in result] == [1]
+    assert 3.5 < result[0][0] < 4.5
+
+
+def test_nearest_respects_max_radius_when_widening():
+    index = ShardedDriverIndex(_hcmc(), spill_km=2.0)
+    index.rebuild([_driver(1, 10.77, 106.707)])
+    assert index.nearest(10.77, 106.671, vehicle_type="car", k=1, max_radius_km=3.0) == []
+
+
+def test_nearest_agrees_with_single_index():
+    import random
+    rng = random.Random(7)
+    drivers = [_driver(i, rng.uniform(10.6, 10.95), rng.uniform(106.5, 106.9)) for i in range(60)]
+    sharded = ShardedDriverIndex(_hcmc(), spill_km=2.0)
+    sharded.rebuild(drivers)
+    single = DriverIndex()
+    single.rebuild(drivers)
+    for _ in range(100):
+        lat, lng = rng.uniform(10.6, 10.95), rng.uniform(106.5, 106.9)
+        expected = [d["id"] for _, d in single.nearest(lat, lng, vehicle_type="car", k=3)]
+        assert [d["id"] for _, d in sharded.nearest(lat, lng, vehicle_type="car", k=3)] == expected
@@ -0,0 +1,70 @@
+from jobs import JobQueue
+
+
+def _queue(path=None, **kwargs):
+    calls = []
+    queue = JobQueue(workers=2, path=path, backoff=0.01, **kwargs)
+    queue.register("charge", lambda job: calls.append(job.payload) or {"charged": job.payload})
+    return queue, calls
+
+
+def test_enqueue_deduplicates_by_key():
+    queue, calls = _queue()
+    queue.start()
+    first = queue.enqueue("charge", 100, key="ride:1:charge")
+    assert queue.join(5)
+    second = queue.enqueue("charge", 100, key="ride:1:charge")
+    assert second is first
+    assert queue.join(5)
+    assert calls == [100]
+    assert first.status == "done" and first.result == {"charged": 100}
+
+
+def test_failed_job_is_retried_then_succeeds():
+    queue = JobQueue(workers=1, backoff=0.01)
+    attempts = []
+
+    def flaky(job):
+        attempts.append(job.attempts)
+        if len(attempts) < 3:
+            raise ConnectionError("cổng thanh toán không phản hồi")
+        return "ok"
+
+    queue.register("charge", flaky)
+    job = queue.start().enqueue("charge", key="ride:2:charge")
+    assert queue.join(5)
+    assert attempts == [1, 2, 3]
+    assert job.status == "done" and job.result == "ok"
+
+
+def test_job_fails_after_max_attempts():
+    queue = JobQueue(workers=1, backoff=0.01)
+
+    def broken(job):
+        raise ValueError("thẻ bị từ chối")
+
+    queue.register("charge", broken, max_attempts=2)
+    job = queue.start().enqueue("charge")
+    assert queue.join(5)
+    assert job.status == "failed" and job.attempts == 2
+    assert [failure["id"] for failure in queue.stats()["recent_failures"]] == [job.id]
+
+
+def test_journal_keeps_keys_and_requeues_unfinished(tmp_path):
+    path = str(tmp_path / "jobs.log")
+    queue, calls = _queue(path)
+    queue.open().start()
+    done = queue.enqueue("charge", 100, key="ride:1:charge")
+    assert queue.join(5)
+
+    # Tiến trình thứ hai: chưa start nên công việc còn nằm trong journal
+    queue, _ = _queue(path)
+    queue.open()
+    pending = queue.enqueue("charge", 200, key="ride:2:charge")
+
+    queue, calls = _queue(path)
+    queue.open().start()
+    assert queue.enqueue("charge", 100, key="ride:1:charge").id == done.id
+    assert queue.join(5)
+    assert calls == [200]
+    assert queue.enqueue("charge", 200, key="ride:2:charge").id == pending.id
@@ -0,0 +1,91 @@
+import threading
+
+from offers import OfferDispatcher
+
+
+def _driver(driver_id):
+    return {"id": driver_id, "status": "available"}
+
+
+def _ride(ride_id):
+    return {"id": ride_id, "pickup": {"lat": 10.77, "lng": 106.70}, "dropoff": {"lat": 10.78, "lng": 106.71},
+            "vehicle_type": "car", "fare": 50000, "estimated_distance": 2.0, "estimated_duration": 6.0}
+
+
+def _submit(dispatcher, ride, **kwargs):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        dispatcher.submit(ride["pickup"], "car", ride=ride, **kwargs)))
+    thread.start()
+    return thread, results
+
+
+def test_accept_reserves_driver():
+    reserved = []
+    dispatcher = OfferDispatcher(lambda pickup, vehicle_type, k: [_driver(1), _driver(2)],
+                                 lambda driver, ride: reserved.append((driver["id"], ride["id"])) or True).start()
+    thread, results = _submit(dispatcher, _ride(10), timeout=5)
+    offers = dispatcher.wait(1, timeout=5)
+    assert dispatcher.decline(1, offers[0]["id"])
+    offers = dispatcher.wait(2, timeout=5)
+    assert dispatcher.accept(2, offers[0]["id"])["ride_id"] == 10
+    thread.join(5)
+    assert results[0]["driver"]["id"] == 2
+    assert reserved == [(2, 10)]
+
+
+def test_search_runs_outside_lock():
+    searching = threading.Event()
+    release = threading.Event()
+
+    def search(pickup, vehicle_type, k):
+        searching.set()
+        release.wait(5)
+        return [_driver(1)]
+
+    dispatcher = OfferDispatcher(search, lambda driver, ride: True).start()
+    thread, results = _submit(dispatcher, _ride(10), timeout=5)
+    assert searching.wait(5)
+    # Một lần tìm chậm không giữ khóa chung của các tài xế và khách hàng khác
+    assert dispatcher._lock.acquire(timeout=1)
+    dispatcher._lock.release()
+    assert dispatcher.pending(7) == []
+    assert dispatcher.stats()["requests"] == 1
+    release.set()
+    offers = dispatcher.wait(1, timeout=5)
+    dispatcher.accept(1, offers[0]["id"])
+    thread.join(5)
+    assert results[0]["driver"]["id"] == 1
+
+
+def test_cancel_waits_for_reserve():
+    reserving = threading.Event()
+    release = threading.Event()
+
+    def reserve(driver, ride):
+        reserving.set()
+        release.wait(5)
+        return True
+
+    dispatcher = OfferDispatcher(lambda pickup, vehicle_type, k: [_driver(1)], reserve).start()
+    thread, results = _submit(dispatcher, _ride(10), timeout=0.5)
+    offers = dispatcher.wait(1, timeout=5)
+    accept = threading.Thread(target=dispatcher.accept, args=(1, offers[0]["id"]))
+    accept.start()
+    assert reserving.wait(5)
+    # Khách hàng hết giờ chờ trong lúc giữ tài xế: vẫn nhận được kết quả
+    thread.join(1)
+    assert thread.is_alive()
+    release.set()
+    thread.join(5)
+    accept.join(5)
+    assert results[0]["driver"]["id"] == 1
+
+
+def test_sync_submit_wait_is_capped():
+    dispatcher = OfferDispatcher(lambda pickup, vehicle_type, k: [_driver(1)], lambda driver, ride: True,
+                                 timeout=15, max_offers=10, max_wait=0.2).start()
+    thread, results = _submit(dispatcher, _ride(10))
+    thread.join(5)
+    assert results == [None]
+    assert dispatcher.pending(1) == []
@@ -0,0 +1,41 @@
+from pricing import DETOUR_RANGE, SPEED_RANGE_KMH, PricingEngine, TravelTimeMatrix
+
+
+def _ride(lat, lng, d_lat, d_lng, road_m, duration_s):
+    return {"pickup": {"lat": lat, "lng": lng}, "dropoff": {"lat": d_lat, "lng": d_lng},
+            "estimated_distance": road_m, "estimated_duration": duration_s}
+
+
+def test_short_trips_are_ignored():
+    matrix = TravelTimeMatrix()
+    # Khoảng 166 m đường chim bay với tỉ lệ đường vòng gần 6
+    matrix.calibrate([_ride(10.77, 106.70, 10.7715, 106.70, 950, 120)])
+    assert matrix._global == [0.0, 0.0, 0.0]
+
+
+def test_factors_are_weighted_by_distance():
+    matrix = TravelTimeMatrix()
+    # 1.11 km với hệ số 1.8 và 11.1 km với hệ số 1.2: trung bình theo quãng đường gần 1.25
+    matrix.calibrate([
+        _ride(10.70, 106.70, 10.71, 106.70, 1.8 * 1112, 240),
+        _ride(10.70, 106.70, 10.80, 106.70, 1.2 * 11120, 1800),
+    ])
+    detour, _ = matrix._compute_factors((0, 0), (1, 1))
+    assert 1.24 < detour < 1.27
+
+
+def test_factors_are_clamped():
+    matrix = TravelTimeMatrix()
+    # Đường bộ gấp 5 lần đường chim bay, tốc độ 200 km/h
+    matrix.calibrate([_ride(10.70, 106.70, 10.75, 106.70, 5 * 5560, 5 * 5560 / (200 / 3.6))])
+    detour, speed = matrix._compute_factors((0, 0), (1, 1))
+    assert detour == DETOUR_RANGE[1]
+    assert speed * 3.6 == SPEED_RANGE_KMH[1]
+
+
+def test_quote_stays_bounded_after_calibration():
+    pricing = PricingEngine()
+    pricing.matrix.calibrate([_ride(10.77, 106.70, 10.7715, 106.70, 950, 20)] * 50)
+    quote = pricing.quote({"lat": 10.77, "lng": 106.70}, {"lat": 10.77, "lng": 106.755}, "car")
+    # 6 km đường chim bay: giá không vượt quá giá với hệ số đường vòng lớn nhất
+    assert quote["fare"] <= 15000 + 6.0 * DETOUR_RANGE[1] * 8000
@@ -0,0 +1,63 @@
+import os
+import struct
+
+import pytest
+
+from snapshot import HEADER, MAGIC, SnapshotError, SnapshotVersionError, read_snapshot, write_snapshot
+
+
+def _collections():
+    return {
+        "drivers": [{"id": 1, "name": "An", "vehicle_type": "bike", "status": "available",
+                     "current_location": {"lat": 10.77, "lng": 106.70}}],
+        "rides": [{"id": i, "customer_id": 1, "driver_id": 1, "status": "completed",
+                   "pickup": {"lat": 10.77, "lng": 106.70, "address": "Quận 1"},
+                   "dropoff": {"lat": 10.80, "lng": 106.66}, "fare": 50000 + i,
+                   "payment_method": "cash", "note": "trường phụ"} for i in range(1, 8)],
+    }
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    collections = _collections()
+    write_snapshot(path, collections, chunk_rows=3)
+    loaded = read_snapshot(path)
+    assert [r.to_dict()["fare"] for r in loaded["rides"]] == [r["fare"] for r in collections["rides"]]
+    ride = loaded["rides"][0]
+    assert ride["pickup"].address == "Quận 1"
+    assert ride.payment_method == "cash"
+    assert ride.extra == {"note": "trường phụ"}
+    assert loaded["drivers"][0]["current_location"].lat == 10.77
+    assert list(read_snapshot(path, names={"drivers"})) == ["drivers"]
+
+
+def test_crc_mismatch_is_rejected(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, _collections())
+    with open(path, "r+b") as f:
+        # Lật một byte trong khối dữ liệu đầu tiên
+        f.seek(HEADER.size + 10)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(SnapshotError, match="checksum"):
+        read_snapshot(path)
+
+
+def test_unknown_version_is_rejected(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, _collections())
+    with open(path, "r+b") as f:
+        f.write(HEADER.pack(MAGIC, 1, 4))
+    with pytest.raises(SnapshotVersionError):
+        read_snapshot(path)
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    write_snapshot(path, _collections())
+    size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        f.truncate(size - struct.calcsize("<Q"))
+    with pytest.raises(SnapshotError):
+        read_snapshot(path)
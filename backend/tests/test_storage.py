@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from storage import DataStore
+
+
+def _store(path, **kwargs):
+    return DataStore(str(path), compact_every=0, **kwargs).open()
+
+
+def _driver(driver_id, status="available"):
+    return {"id": driver_id, "name": f"Tài xế {driver_id}", "phone": f"09{driver_id:08d}",
+            "email": f"d{driver_id}@example.com", "status": status, "vehicle_type": "car"}
+
+
+def test_wal_replay_after_restart(tmp_path):
+    store = _store(tmp_path)
+    store.insert("drivers", _driver(1))
+    store.insert("drivers", _driver(2))
+    store.update("drivers", 1, {"status": "busy"})
+    store.commit([("del", "drivers", 2)])
+    store.close()
+
+    store = _store(tmp_path)
+    assert store.drivers.get(1)["status"] == "busy"
+    assert store.drivers.get(2) is None
+    assert store.drivers.find_one("email", "d1@example.com")["id"] == 1
+    store.close()
+
+
+def test_wal_replay_skips_torn_last_line(tmp_path):
+    store = _store(tmp_path)
+    store.insert("drivers", _driver(1))
+    store.close()
+    with open(tmp_path / "wal.log", "a", encoding="utf-8") as f:
+        f.write('{"op": "set", "c": "drivers", "id": 1, "da')
+
+    store = _store(tmp_path)
+    assert store.drivers.get(1)["status"] == "available"
+    store.close()
+
+
+@pytest.mark.parametrize("snapshot_format", ["binary", "json"])
+def test_compact_then_replay(tmp_path, snapshot_format):
+    store = _store(tmp_path, snapshot_format=snapshot_format)
+    store.insert("drivers", _driver(1))
+    store.compact()
+    store.update("drivers", 1, {"status": "busy"})
+    store.close()
+
+    store = _store(tmp_path, snapshot_format=snapshot_format)
+    assert store.drivers.get(1)["status"] == "busy"
+    store.close()
+
+
+def test_data_dir_is_locked(tmp_path):
+    store = _store(tmp_path)
+    with pytest.raises(RuntimeError):
+        _store(tmp_path)
+    store.close()
+    _store(tmp_path).close()
+
+
+def test_compare_and_set(tmp_path):
+    store = _store(tmp_path)
+    store.insert("drivers", _driver(1))
+    assert store.compare_and_set("drivers", 1, {"status": "available"}, {"status": "busy"})["status"] == "busy"
+    assert store.compare_and_set("drivers", 1, {"status": "available"}, {"status": "busy"}) is None
+    assert store.compare_and_set("drivers", 99, {"status": "available"}, {"status": "busy"}) is None
+    store.close()
+
+
+def test_failed_expectation_applies_nothing(tmp_path):
+    store = _store(tmp_path)
+    store.insert("drivers", _driver(1, status="busy"))
+    ride = {"id": 10, "driver_id": 1, "status": "ongoing"}
+    result = store.commit([("put", "rides", ride), ("set", "drivers", 1, {"status": "busy"})],
+                          expect=[("drivers", 1, {"status": "available"})])
+    assert result is None
+    assert store.rides.get(10) is None
+    store.close()
+    # Giao dịch bị từ chối cũng không được ghi vào WAL
+    store = _store(tmp_path)
+    assert store.rides.get(10) is None
+    store.close()
+
+
+def test_concurrent_reservations_pick_one_winner(tmp_path):
+    store = _store(tmp_path)
+    store.insert("drivers", _driver(1))
+    winners = []
+
+    def reserve(ride_id):
+        ride = {"id": ride_id, "driver_id": 1, "status": "ongoing"}
+        if store.commit([("put", "rides", ride), ("set", "drivers", 1, {"status": "busy"})],
+                        expect=[("drivers", 1, {"status": "available"})]):
+            winners.append(ride_id)
+
+    threads = [threading.Thread(target=reserve, args=(ride_id,)) for ride_id in range(100, 120)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(winners) == 1
+    assert [ride["id"] for ride in store.rides.find("driver_id", 1)] == winners
+    store.close()
@@ -0,0 +1,78 @@
+"""
+Hẹn giờ dùng chung: một heap với một thread xử lý (lời mời ghép chuyến,
+thử lại công việc nền).
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Timer:
+    __slots__ = ("when", "seq", "callback", "args", "cancelled")
+
+    def __init__(self, when, seq, callback, args):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+
+class TimerQueue:
+    """
+    Hẹn giờ trên một heap (theo time.monotonic) với một thread xử lý.
+    cancel() chỉ đánh dấu, hẹn giờ đã hủy bị bỏ qua khi tới lượt (xóa lười),
+    nên cả đặt lẫn hủy đều O(log n).
+    """
+
+    def __init__(self, name="timer-queue"):
+        self.name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def call_later(self, delay, callback, *args):
+        """Gọi callback(*args) sau delay giây trên thread của hàng đợi; trả về hẹn giờ để hủy."""
+        timer = _Timer(time.monotonic() + delay, next(self._seq), callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, timer)
+            # Chỉ cần đánh thức thread khi hẹn giờ mới đứng đầu heap
+            if self._heap[0] is timer:
+                self._cond.notify()
+        return timer
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0].when <= time.monotonic():
+                        timer = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0].when - time.monotonic() if self._heap else None)
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                logger.exception("Error in timer callback %r", timer.callback)
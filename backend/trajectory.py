@@ -0,0 +1,149 @@
+import threading
+from array import array
+from math import cos, radians
+
+METERS_PER_DEGREE = 111195.0
+
+
+def douglas_peucker(ts, lats, lngs, epsilon_m):
+    """
+    Giản lược quỹ đạo bằng Douglas–Peucker (không đệ quy).
+    Khoảng cách được tính trên phép chiếu phẳng cục bộ (mét).
+    Trả về danh sách chỉ số các điểm được giữ lại, luôn gồm điểm đầu và cuối.
+    """
+    n = len(ts)
+    if n <= 2:
+        return list(range(n))
+    k = cos(radians(lats[0]))
+    xs = [lng * METERS_PER_DEGREE * k for lng in lngs]
+    ys = [lat * METERS_PER_DEGREE for lat in lats]
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1, x2, y2 = xs[first], ys[first], xs[last], ys[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            if length_sq == 0:
+                dist_sq = (xs[i] - x1) ** 2 + (ys[i] - y1) ** 2
+            else:
+                cross = dx * (y1 - ys[i]) - dy * (x1 - xs[i])
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist:
+                max_dist, index = dist_sq, i
+        if index is not None and max_dist > epsilon_m * epsilon_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in range(n) if keep[i]]
+
+
+class Trajectory:
+    """
+    Quỹ đạo của một tài xế: các điểm gần đây nằm trong ring buffer cố định
+    (mảng float64 ts/lat/lng); khi đầy, nửa cũ được giản lược bằng
+    Douglas–Peucker rồi chuyển sang phần lịch sử nén, cũng có giới hạn.
+    """
+
+    __slots__ = ("capacity", "history_limit", "epsilon_m",
+                 "_ts", "_lat", "_lng", "_start", "_size",
+                 "history_ts", "history_lat", "history_lng")
+
+    def __init__(self, capacity=256, history_limit=1024, epsilon_m=15.0):
+        self.capacity = capacity
+        self.history_limit = history_limit
+        self.epsilon_m = epsilon_m
+        self._ts = array("d", bytes(8 * capacity))
+        self._lat = array("d", bytes(8 * capacity))
+        self._lng = array("d", bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+        self.history_ts = array("d")
+        self.history_lat = array("d")
+        self.history_lng = array("d")
+
+    def __len__(self):
+        return self._size + len(self.history_ts)
+
+    def last(self):
+        if not self._size:
+            return None
+        i = (self._start + self._size - 1) % self.capacity
+        return self._ts[i], self._lat[i], self._lng[i]
+
+    def append(self, ts, lat, lng):
+        """Thêm một điểm; bỏ qua điểm cũ hơn điểm cuối cùng. Trả về True nếu được thêm."""
+        last = self.last()
+        if last is not None and ts < last[0]:
+            return False
+        if self._size == self.capacity:
+            self._compact(self.capacity // 2)
+        i = (self._start + self._size) % self.capacity
+        self._ts[i] = ts
+        self._lat[i] = lat
+        self._lng[i] = lng
+        self._size += 1
+        return True
+
+    def _recent(self, count=None):
+        count = self._size if count is None else count
+        idx = [(self._start + j) % self.capacity for j in range(count)]
+        return ([self._ts[i] for i in idx], [self._lat[i] for i in idx], [self._lng[i] for i in idx])
+
+    def _compact(self, count):
+        ts, lats, lngs = self._recent(count)
+        for i in douglas_peucker(ts, lats, lngs, self.epsilon_m):
+            self.history_ts.append(ts[i])
+            self.history_lat.append(lats[i])
+            self.history_lng.append(lngs[i])
+        self._start = (self._start + count) % self.capacity
+        self._size -= count
+        if len(self.history_ts) > self.history_limit:
+            # Lịch sử vượt giới hạn: giản lược lại với ngưỡng gấp đôi, sau đó cắt bớt phần cũ nhất
+            keep = douglas_peucker(self.history_ts, self.history_lat, self.history_lng, self.epsilon_m * 2)
+            keep = keep[-self.history_limit:]
+            self.history_ts = array("d", (self.history_ts[i] for i in keep))
+            self.history_lat = array("d", (self.history_lat[i] for i in keep))
+            self.history_lng = array("d", (self.history_lng[i] for i in keep))
+
+    def points(self, since=None):
+        """Toàn bộ điểm (lịch sử nén + gần đây) dạng list [ts, lat, lng], tăng dần theo ts."""
+        ts, lats, lngs = self._recent()
+        all_ts = list(self.history_ts) + ts
+        all_lat = list(self.history_lat) + lats
+        all_lng = list(self.history_lng) + lngs
+        return [[t, la, ln] for t, la, ln in zip(all_ts, all_lat, all_lng) if since is None or t > since]
+
+
+class TrajectoryStore:
+    """Quỹ đạo của mọi tài xế, nhận điểm GPS theo lô từ nhiều tài xế."""
+
+    def __init__(self, capacity=256, history_limit=1024, epsilon_m=15.0):
+        self.capacity = capacity
+        self.history_limit = history_limit
+        self.epsilon_m = epsilon_m
+        self._trajectories = {}
+        self._lock = threading.Lock()
+        self.points_ingested = 0
+
+    def get(self, driver_id):
+        return self._trajectories.get(int(driver_id))
+
+    def ingest(self, driver_id, points):
+        """
+        points: các tuple (ts, lat, lng) của một tài xế, theo thứ tự bất kỳ.
+        Trả về điểm mới nhất (ts, lat, lng) sau khi thêm, hoặc None.
+        """
+        driver_id = int(driver_id)
+        with self._lock:
+            trajectory = self._trajectories.get(driver_id)
+            if trajectory is None:
+                trajectory = Trajectory(self.capacity, self.history_limit, self.epsilon_m)
+                self._trajectories[driver_id] = trajectory
+            for ts, lat, lng in sorted(points):
+                if trajectory.append(ts, lat, lng):
+                    self.points_ingested += 1
+            return trajectory.last()
@@ -1,26 +1,65 @@
+import itertools
 import json
+import logging
 import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: chỉ an toàn giữa các thread trong một tiến trình
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # orjson là tùy chọn: nhanh hơn json vài lần khi ghi WAL/SQLite
+    orjson = None
+
+from metrics import STORAGE_BYTES, STORAGE_SECONDS
+
+logger = logging.getLogger(__name__)
 
 # Define the base directory for the data folder
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# (SMART_RIDE_DATA_DIR cho phép chạy trên bộ dữ liệu khác, vd. khi benchmark)
+DATA_DIR = os.environ.get("SMART_RIDE_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+def to_json(obj):
+    """default= cho json/orjson: model (models.py) được ghi qua to_dict()."""
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def dumps(obj):
+    """JSON một dòng (str, giữ nguyên Unicode); dùng orjson nếu có cài."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=to_json, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, default=to_json)
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 def load_data(filename):
     try:
         # Ensure the file path is within the existing data folder
         absolute_path = os.path.join(DATA_DIR, filename)
-        print(f"Attempting to load data from {absolute_path}")
+        logger.debug("Loading data from %s", absolute_path)
         if not os.path.exists(absolute_path):
-            print(f"File {absolute_path} does not exist")
+            logger.info("File %s does not exist", absolute_path)
             if "drivers" in filename:
                 return {"drivers": []}
             return []
             
         with open(absolute_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            print(f"Successfully loaded data from {absolute_path}")
+            STORAGE_BYTES.inc(f.tell(), target="file", direction="read")
             return data
-    except Exception as e:
-        print(f"Error loading data from {absolute_path}: {str(e)}")
+    except Exception:
+        logger.exception("Error loading data from %s", absolute_path)
         if "drivers" in filename:
             return {"drivers": []}
         return []
@@ -29,18 +68,79 @@ def save_data(filename, data):
     try:
         # Ensure the file path is within the existing data folder
         absolute_path = os.path.join(DATA_DIR, filename)
-        print(f"Attempting to save data to {absolute_path}")
-        with open(absolute_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-        print(f"Successfully saved data to {absolute_path}")
-    except Exception as e:
-        print(f"Error saving data to {absolute_path}: {str(e)}")
+        logger.debug("Saving data to %s", absolute_path)
+        with STORAGE_SECONDS.time(target="file"):
+            with open(absolute_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False, default=to_json)
+                STORAGE_BYTES.inc(f.tell(), target="file", direction="write")
+    except Exception:
+        logger.exception("Error saving data to %s", absolute_path)
+
+class IdAllocator:
+    """
+    Cấp ID theo từng khối giữ trong bộ nhớ.
+    File id_tracker.json lưu mốc cao nhất đã cấp (high-water mark); mỗi lần
+    hết khối mới khóa file (fcntl) để xin khối tiếp theo, nên an toàn với
+    nhiều thread lẫn nhiều tiến trình WSGI. Mốc được ghi xuống đĩa trước khi
+    dùng khối nên sau khi khởi động lại không bao giờ cấp trùng ID.
+    """
+
+    def __init__(self, path="id_tracker.json", block_size=100):
+        self.path = os.path.join(DATA_DIR, path)
+        self.block_size = block_size
+        self._blocks = {}  # id_type -> (itertools.count, giới hạn của khối)
+        self._lock = threading.Lock()
+
+    def next_id(self, id_type):
+        # Đường đi thường gặp: next() trên itertools.count là nguyên tử dưới GIL
+        block = self._blocks.get(id_type)
+        if block is not None:
+            value = next(block[0])
+            if value < block[1]:
+                return value
+        with self._lock:
+            block = self._blocks.get(id_type)
+            if block is not None:
+                value = next(block[0])
+                if value < block[1]:
+                    return value
+            start = self._lease(id_type)
+            self._blocks[id_type] = (itertools.count(start + 1), start + self.block_size)
+            return start
+
+    def _lease(self, id_type):
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                ids = {}
+                if os.path.exists(self.path):
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        ids = json.load(f)
+                start = ids.get(id_type, 1)
+                ids[id_type] = start + self.block_size
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(ids, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                return start
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+id_allocator = IdAllocator()
+
+
+def use_id_allocator(allocator):
+    """Thay bộ cấp ID mặc định, vd. bằng sqlite_store.SqliteIdAllocator."""
+    global id_allocator
+    id_allocator = allocator
+
 
 def generate_id(id_type, path="id_tracker.json"):
-    # Ensure the path is within the existing data folder
-    absolute_path = os.path.join(DATA_DIR, path)
-    ids = load_data(absolute_path)
-    current = ids.get(id_type, 1)
-    ids[id_type] = current + 1
-    save_data(absolute_path, ids)
-    return current
+    if path != "id_tracker.json":
+        return IdAllocator(path, block_size=1).next_id(id_type)
+    return id_allocator.next_id(id_type)
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Table, Badge, Alert, Pagination, Card, Nav, Button } from 'react-bootstrap';
 import { toast } from 'react-hot-toast';
 
@@ -6,6 +6,7 @@ const AdminDashboard = () => {
   const [activeRides, setActiveRides] = useState([]);
   const [rideHistory, setRideHistory] = useState([]);
   const [drivers, setDrivers] = useState([]);
+  const [heatmap, setHeatmap] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
 
@@ -13,31 +14,72 @@ const AdminDashboard = () => {
   const [currentPage, setCurrentPage] = useState(1);
   const [activeTab, setActiveTab] = useState('active-rides');
   const recordsPerPage = 10;
+  const refreshInterval = 5000;
+
+  // Bản sao cục bộ của snapshot /api/admin/dashboard, cập nhật bằng delta
+  const snapshot = useRef({ version: null, epoch: null, etag: null, rides: new Map(), drivers: new Map() });
 
   useEffect(() => {
     fetchData();
+    const timer = setInterval(() => fetchData({ background: true }), refreshInterval);
+    return () => clearInterval(timer);
   }, []);
 
-  const fetchData = async () => {
+  const fetchDashboard = async () => {
+    const current = snapshot.current;
+    let url = '/api/admin/dashboard';
+    const headers = {};
+    if (current.version !== null) {
+      url += `?since=${current.version}&epoch=${encodeURIComponent(current.epoch)}`;
+      headers['If-None-Match'] = current.etag;
+    }
+    const response = await fetch(url, { headers });
+    if (response.status === 304) {
+      return false;
+    }
+    const data = await response.json();
+    if (!response.ok) {
+      throw new Error(data.error || response.statusText);
+    }
+    if (data.full) {
+      current.rides = new Map();
+      current.drivers = new Map();
+    }
+    data.rides.forEach(ride => current.rides.set(ride.id, ride));
+    // Chuyến đi đã được chuyển sang kho lưu trữ
+    (data.removed_rides || []).forEach(id => current.rides.delete(id));
+    data.drivers.forEach(driver => current.drivers.set(driver.id, driver));
+    current.version = data.version;
+    current.epoch = data.epoch;
+    current.etag = response.headers.get('ETag');
+    return true;
+  };
+
+  const fetchData = async ({ background = false } = {}) => {
     try {
-      setLoading(true);
+      if (!background) {
+        setLoading(true);
+      }
       setError(null);
 
-      const [activeRidesRes, historyRes, driversRes] = await Promise.all([
-        fetch('/api/admin/rides/active'),
-        fetch('/api/admin/rides/history'),
-        fetch('/api/admin/drivers')
-      ]);
-
-      const [activeRidesData, historyData, driversData] = await Promise.all([
-        activeRidesRes.json(),
-        historyRes.json(),
-        driversRes.json()
+      const [changed, heatmapData] = await Promise.all([
+        fetchDashboard(),
+        fetch('/api/admin/heatmap').then(res => res.json())
       ]);
 
-      setActiveRides(Array.isArray(activeRidesData) ? activeRidesData : []);
-      setRideHistory(Array.isArray(historyData) ? historyData : []);
-      setDrivers(Array.isArray(driversData) ? driversData : []);
+      if (changed) {
+        // Mới nhất lên đầu như các endpoint danh sách
+        const rides = [...snapshot.current.rides.values()].sort((a, b) =>
+          (b.created_at || '').localeCompare(a.created_at || '') || b.id - a.id);
+        const active = ['pending', 'accepted', 'in_progress', 'ongoing'];
+        const finished = ['completed', 'cancelled'];
+        setActiveRides(rides.filter(ride => active.includes(ride.status)));
+        setRideHistory(rides.filter(ride => finished.includes(ride.status)));
+        setDrivers([...snapshot.current.drivers.values()]);
+      }
+      // Ô thiếu tài xế nhất (surge cao, cầu lớn) đứng đầu
+      const cells = Array.isArray(heatmapData?.cells) ? heatmapData.cells : [];
+      setHeatmap(cells.sort((a, b) => b.surge - a.surge || b.demand - a.demand));
     } catch (error) {
       console.error('Chi tiết lỗi:', error);
       setError('Không thể tải dữ liệu. Vui lòng thử lại sau.');
@@ -211,6 +253,11 @@ const AdminDashboard = () => {
                 <i className="fas fa-users me-2"></i>Quản lý tài xế
               </Nav.Link>
             </Nav.Item>
+            <Nav.Item>
+              <Nav.Link eventKey="heatmap">
+                <i className="fas fa-fire me-2"></i>Cung cầu
+              </Nav.Link>
+            </Nav.Item>
           </Nav>
 
           {loading ? (
@@ -396,6 +443,45 @@ const AdminDashboard = () => {
                   )}
                 </>
               )}
+
+              {/* Tab Cung cầu theo khu vực */}
+              {activeTab === 'heatmap' && (
+                <>
+                  {heatmap.length === 0 ? (
+                    <Alert variant="info" className="admin-alert">Chưa có dữ liệu cung cầu</Alert>
+                  ) : (
+                    <>
+                      <Table striped bordered hover responsive className="admin-table">
+                        <thead>
+                          <tr>
+                            <th>Khu vực (tâm ô)</th>
+                            <th>Yêu cầu gần đây</th>
+                            <th>Tài xế rảnh</th>
+                            <th>Hệ số giá</th>
+                          </tr>
+                        </thead>
+                        <tbody>
+                          {getCurrentData(heatmap).map(cell => (
+                            <tr key={`${cell.lat},${cell.lng}`}>
+                              <td>{cell.lat.toFixed(3)}, {cell.lng.toFixed(3)}</td>
+                              <td>{cell.demand}</td>
+                              <td>{cell.supply}</td>
+                              <td>
+                                <Badge bg={cell.surge >= 2 ? 'danger' : cell.surge > 1 ? 'warning' : 'success'}>
+                                  x{cell.surge.toFixed(1)}
+                                </Badge>
+                              </td>
+                            </tr>
+                          ))}
+                        </tbody>
+                      </Table>
+                      <div className="admin-pagination">
+                        {renderPagination(heatmap.length)}
+                      </div>
+                    </>
+                  )}
+                </>
+              )}
             </div>
           )}
         </Card.Body>
@@ -1,11 +1,12 @@
 import React, { useState, useEffect } from 'react';
-import { Card, Row, Col, Badge, Table } from 'react-bootstrap';
+import { Card, Row, Col, Badge, Table, Button } from 'react-bootstrap';
 import { toast } from 'react-hot-toast';
 import { useNavigate } from 'react-router-dom';
 
 const DriverDashboard = () => {
   const [driverDetails, setDriverDetails] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [offers, setOffers] = useState([]);
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -17,6 +18,55 @@ const DriverDashboard = () => {
     fetchDriverDetails(driverId);
   }, [navigate]);
 
+  // Long-poll lời mời chuyến đi (chỉ có khi máy chủ chạy DISPATCH_MODE=offer)
+  useEffect(() => {
+    const driverId = localStorage.getItem('driver_id');
+    if (!driverId) return;
+    let active = true;
+    const controller = new AbortController();
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    const poll = async () => {
+      while (active) {
+        try {
+          const response = await fetch(`/api/driver/${driverId}/offers?wait=25`, { signal: controller.signal });
+          if (response.status === 404) return;
+          if (!response.ok) throw new Error('Không thể tải lời mời');
+          const data = await response.json();
+          setOffers(data.offers);
+          // Khi đang có lời mời, máy chủ trả về ngay: làm mới chậm lại để cập nhật thời gian còn lại
+          if (data.offers.length) await sleep(1000);
+        } catch (error) {
+          if (!active) return;
+          await sleep(5000);
+        }
+      }
+    };
+    poll();
+    return () => {
+      active = false;
+      controller.abort();
+    };
+  }, []);
+
+  const respondToOffer = async (offer, action) => {
+    const driverId = localStorage.getItem('driver_id');
+    try {
+      const response = await fetch(`/api/driver/${driverId}/offers/${offer.id}/${action}`, { method: 'POST' });
+      const data = await response.json();
+      setOffers((current) => current.filter((item) => item.id !== offer.id));
+      if (!response.ok) {
+        throw new Error(data.error || 'Không thể phản hồi lời mời');
+      }
+      toast.success(data.message);
+      if (action === 'accept') {
+        fetchDriverDetails(driverId);
+      }
+    } catch (error) {
+      toast.error(error.message);
+    }
+  };
+
   const fetchDriverDetails = async (driverId) => {
     try {
       const response = await fetch(`/api/driver/${driverId}/details`);
@@ -65,6 +115,28 @@ const DriverDashboard = () => {
 
   return (
     <div className="driver-dashboard container py-4">
+      {/* Lời mời chuyến đi đang chờ trả lời */}
+      {offers.map((offer) => (
+        <Card className="mb-4 border-warning" key={offer.id}>
+          <Card.Header as="h5" className="bg-warning">
+            <i className="fas fa-bell me-2"></i>
+            Lời mời chuyến đi #{offer.ride_id}
+            <Badge bg="dark" className="ms-2">Còn {Math.ceil(offer.expires_in)} giây</Badge>
+          </Card.Header>
+          <Card.Body>
+            <p><strong>Điểm đón:</strong> {offer.pickup?.address}</p>
+            <p><strong>Điểm đến:</strong> {offer.dropoff?.address}</p>
+            <p><strong>Giá:</strong> {formatCurrency(offer.fare)}</p>
+            <Button variant="success" className="me-2" onClick={() => respondToOffer(offer, 'accept')}>
+              Nhận chuyến
+            </Button>
+            <Button variant="outline-danger" onClick={() => respondToOffer(offer, 'decline')}>
+              Từ chối
+            </Button>
+          </Card.Body>
+        </Card>
+      ))}
+
       {/* Thông tin tài xế */}
       <Card className="mb-4">
         <Card.Header as="h5" className="bg-primary text-white">
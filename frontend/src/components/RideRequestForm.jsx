@@ -6,20 +6,14 @@ const VEHICLE_TYPES = {
   bike: {
     name: "Xe máy",
     icon: "🛵",
-    baseFare: 8000,
-    pricePerKm: 4000,
   },
   car: {
     name: "Ô tô 4 chỗ",
     icon: "🚗",
-    baseFare: 15000,
-    pricePerKm: 8000,
   },
   van: {
     name: "Ô tô 7 chỗ",
     icon: "🚐",
-    baseFare: 20000,
-    pricePerKm: 10000,
   },
 };
 
@@ -32,6 +26,7 @@ const RideRequestForm = () => {
   const [dropoffSuggestions, setDropoffSuggestions] = useState([]);
   const [paymentMethod, setPaymentMethod] = useState("cash");
   const [vehicleType, setVehicleType] = useState("car");
+  const [quotes, setQuotes] = useState({});
   const [fare, setFare] = useState(null);
   const [distance, setDistance] = useState(null);
   const [duration, setDuration] = useState(null);
@@ -146,9 +141,7 @@ const RideRequestForm = () => {
                 address: selectedDropoff.display_name
             },
             vehicle_type: vehicleType,
-            estimated_price: fare,
-            estimated_distance: distance,
-            estimated_duration: duration
+            payment_method: paymentMethod
         };
 
         console.log('Đang gửi request với payload:', JSON.stringify(payload, null, 2));
@@ -170,6 +163,12 @@ const RideRequestForm = () => {
                 console.log('Thông tin tài xế:', data.driver);
                 setDriver(data.driver);
                 setRideId(data.ride_id);
+                // Giá và thời gian tài xế tới do máy chủ tính khi ghép chuyến
+                setFare(data.fare);
+                if (data.eta != null) {
+                    setDriverToPickupDuration(data.eta);
+                    setDriverToPickupCountdown(Math.floor(data.eta));
+                }
                 if (data.driver.current_location) {
                     setDriverLocation({
                         lat: data.driver.current_location.lat,
@@ -310,12 +309,47 @@ const RideRequestForm = () => {
     } else {
         setDistance(distance);
         setDuration(duration);
-        const { baseFare, pricePerKm } = VEHICLE_TYPES[vehicleType];
-        const estimatedFare = baseFare + (distance / 1000) * pricePerKm;
-        setFare(Math.round(estimatedFare));
     }
   };
 
+  // Báo giá của máy chủ cho mọi loại xe trong một lần gọi
+  useEffect(() => {
+    if (!selectedPickup || !selectedDropoff) {
+      setQuotes({});
+      return;
+    }
+    let cancelled = false;
+    const fetchQuotes = async () => {
+      try {
+        const res = await fetch("/api/quote", {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify({
+            pickup: { lat: parseFloat(selectedPickup.lat), lng: parseFloat(selectedPickup.lon) },
+            dropoff: { lat: parseFloat(selectedDropoff.lat), lng: parseFloat(selectedDropoff.lon) },
+          }),
+        });
+        if (!res.ok) return;
+        const data = await res.json();
+        if (!cancelled) {
+          setQuotes(Object.fromEntries(data.quotes.map((q) => [q.vehicle_type, q])));
+        }
+      } catch (err) {
+        console.error("Lỗi khi lấy báo giá:", err);
+      }
+    };
+    fetchQuotes();
+    return () => {
+      cancelled = true;
+    };
+  }, [selectedPickup, selectedDropoff]);
+
+  useEffect(() => {
+    if (!driver) {
+      setFare(quotes[vehicleType]?.fare ?? null);
+    }
+  }, [quotes, vehicleType, driver]);
+
   useEffect(() => {
     if (driver && driver.current_location) {
       setDriverLocation(driver.current_location);
@@ -323,6 +357,17 @@ const RideRequestForm = () => {
     }
   }, [driver]);
 
+  // Nhận vị trí tài xế theo thời gian thực qua Server-Sent Events
+  useEffect(() => {
+    if (!rideId || !driver) return;
+    const source = new EventSource(`/api/ride/driver-location/${rideId}/stream`);
+    source.addEventListener("location", (e) => {
+      const { lat, lng } = JSON.parse(e.data);
+      setDriverLocation({ lat, lng });
+    });
+    return () => source.close();
+  }, [rideId, driver]);
+
   return (
     <div className="ride-request-form">
       <form onSubmit={handleSubmit}>
@@ -400,7 +445,7 @@ const RideRequestForm = () => {
                 <div>{info.icon}</div>
                 <div>{info.name}</div>
                 <div style={{ fontSize: '0.8em', color: '#666' }}>
-                  Giá từ: {info.baseFare.toLocaleString()}đ
+                  {quotes[type] ? `${quotes[type].fare.toLocaleString()}đ` : "—"}
                 </div>
               </button>
             ))}
@@ -470,7 +515,6 @@ const RideRequestForm = () => {
             }}>
               <h4 style={{ margin: '0 0 8px 0', color: '#1976d2' }}>Thông tin đón khách</h4>
               <p>📍 Khoảng cách đến điểm đón: {(driverToPickupDistance / 1000).toFixed(2)} km</p>
-              <p>🚗 Tốc độ trung bình: 30 km/h</p>
               <p>⏱️ Ước tính thời gian: {Math.ceil(driverToPickupDuration / 60)} phút</p>
               {driverToPickupCountdown > 0 && (
                 <p style={{ 